@@ -1,34 +1,313 @@
+import calendar
 import cgi
+import datetime
+import errno
+import fcntl
+import gflags
+import heapq
+import itertools
+import os
+import select
+import thread
 import threading
 import time
+import traceback
 
 from projects.lib.base import logging
 from projects.lib.concurrency import threadlib
+from projects.lib.concurrency import threadpool
 from projects.lib.telemetry import event_collection
+from projects.lib.telemetry import histogram
 from projects.lib.telemetry.internalz import handlers
 
 
+FLAGS = gflags.FLAGS
+
+gflags.DEFINE_integer('periodic_task_numthreads', 4,
+                      'Number of threads running periodic tasks.',
+                      lower_bound=1)
+
 _IN_SHUTDOWN = False
 _TASKS = []
 _TASKS_LOCK = threading.RLock()
+_TASK_IDS = itertools.count()
+_SCHEDULER = None
+
+# Task states, as shown on /taskz.
+WAIT_FOR_READY = 'WaitForReady'
+WAIT_FOR_START = 'WaitForStart'
+WAIT_FOR_INTERVAL = 'WaitForInterval'
+RUNNING = 'Running'
+PAUSED = 'Paused'
+DEAD = 'Dead'
+
+# What happens when a run is still going when the next one is due. See
+# PeriodicTask.
+COALESCE = 'coalesce'
+SKIP = 'skip'
+CONCURRENT = 'concurrent'
+
+
+# Reason for a pause requested through Pause().
+_USER_PAUSE = 'user'
+
+# (name, lowest, highest) of each field of a Calendar spec. Day of week 7 is
+# Sunday, like 0.
+_CALENDAR_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+)
+
+# Calendar.Next() gives up looking for a matching time after this long.
+_CALENDAR_HORIZON = datetime.timedelta(days=5 * 366)
 
 
 class PeriodicTaskError(Exception):
   pass
 
 
-class PeriodicTask(threadlib.Thread):
-  """Periodically run a task in a separate thread.
+def _ParseCalendarField(text, name, low, high):
+  values = set()
+  for part in text.split(','):
+    step = 1
+    if '/' in part:
+      part, step = part.split('/', 1)
+      step = int(step)
+    if part == '*':
+      start, end = low, high
+    elif '-' in part:
+      start, end = [int(x) for x in part.split('-', 1)]
+    else:
+      start = end = int(part)
+      if step != 1:
+        end = high
+    if start < low or end > high or start > end or step < 1:
+      raise PeriodicTaskError('Bad %s in calendar spec: %s' % (name, text))
+    values.update(xrange(start, end + 1, step))
+  return frozenset(values)
+
+
+class Calendar(object):
+  """Cron-like trigger for PeriodicTask.On(), in local time.
+
+  The spec has the five cron fields: minute, hour, day of month, month and
+  day of week (0 or 7 is Sunday). Each field is *, a number, a range a-b,
+  any of those with a /step, or a comma-separated list of them. As in cron,
+  when both day fields are restricted a day matching either one matches.
+
+  # Every 5 minutes from 09:30 to 16:25, Monday to Friday.
+  Calendar('*/5 10-15 * * 1-5')
+  Calendar('30-55/5 9 * * 1-5')
+  """
+
+  def __init__(self, spec):
+    fields = spec.split()
+    if len(fields) != len(_CALENDAR_FIELDS):
+      raise PeriodicTaskError('Calendar spec needs 5 fields: %s' % (spec,))
+    self._spec = spec
+    (self._minutes, self._hours, self._days, self._months, weekdays) = [
+        _ParseCalendarField(text, name, low, high)
+        for text, (name, low, high) in zip(fields, _CALENDAR_FIELDS)]
+    self._weekdays = frozenset(day % 7 for day in weekdays)
+    self._either_day = not (
+        fields[2].startswith('*') or fields[4].startswith('*'))
+
+  def __str__(self):
+    return 'calendar %s' % (self._spec,)
+
+  def _DayMatches(self, dt):
+    day_matches = dt.day in self._days
+    # datetime counts from Monday = 0; cron from Sunday = 0.
+    weekday_matches = (dt.weekday() + 1) % 7 in self._weekdays
+    if self._either_day:
+      return day_matches or weekday_matches
+    return day_matches and weekday_matches
+
+  def Next(self, after):
+    """Returns the first matching time after `after`, in seconds."""
+    dt = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+    dt += datetime.timedelta(minutes=1)
+    limit = dt + _CALENDAR_HORIZON
+    while dt < limit:
+      if dt.month not in self._months:
+        month_start = dt.replace(day=1, hour=0, minute=0)
+        dt = (month_start + datetime.timedelta(days=32)).replace(day=1)
+      elif not self._DayMatches(dt):
+        dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+      elif dt.hour not in self._hours:
+        dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+      elif dt.minute not in self._minutes:
+        dt += datetime.timedelta(minutes=1)
+      else:
+        return time.mktime(dt.timetuple())
+    raise PeriodicTaskError('Calendar never matches: %s' % (self._spec,))
+
+
+class Gate(object):
+  """Keeps a set of tasks paused while it is closed.
+
+  Tasks are added with PeriodicTask.GatedBy(). The gate pauses independently
+  of Pause() and Unpause(): a task runs only while all of its gates are open
+  and it is not paused. Subclasses call Open() and Close() as their
+  condition changes.
+  """
+
+  def __init__(self, is_open=True):
+    self._lock = threading.Lock()
+    self._open = is_open
+    self._tasks = []
+
+  def __str__(self):
+    return type(self).__name__
+
+  def IsOpen(self):
+    with self._lock:
+      return self._open
+
+  def AddTask(self, task):
+    with self._lock:
+      self._tasks.append(task)
+      if not self._open:
+        task._PauseFor(self)
+
+  def Open(self):
+    self._Set(True)
+
+  def Close(self):
+    self._Set(False)
+
+  def _Set(self, is_open):
+    with self._lock:
+      if is_open == self._open:
+        return
+      self._open = is_open
+      for task in self._tasks:
+        if is_open:
+          task._UnpauseFor(self)
+        else:
+          task._PauseFor(self)
+
+
+class _Scheduler(object):
+  """Dispatches due tasks to a ThreadPool from a single timer thread.
+
+  Pending runs are kept in a min-heap of (deadline, sequence, task,
+  generation). The timer thread sleeps until the earliest deadline, or until
+  an earlier one is pushed, so idle tasks cause no wakeups at all. Entries
+  whose generation no longer matches their task's, because the task was
+  paused, cancelled or rescheduled since, are dropped when they come due.
+
+  The thread sleeps in select() on a pipe rather than in Condition.wait():
+  on Python 2 a wait with a timeout polls every few milliseconds.
+  """
+
+  def __init__(self, num_threads):
+    self._lock = threading.Lock()
+    self._heap = []
+    self._seq = itertools.count()
+    self._shutdown = False
+    self._wakeup_r, self._wakeup_w = os.pipe()
+    flags = fcntl.fcntl(self._wakeup_w, fcntl.F_GETFL)
+    fcntl.fcntl(self._wakeup_w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    # Allowed to grow, so that a few slow or overrunning tasks holding every
+    # thread don't hold up the dispatch of all the others.
+    self._pool = threadpool.ThreadPool(
+        size=num_threads, max_size=FLAGS.threadpool_max_numthreads)
+
+    self._thread = threadlib.Thread(target=self._Run)
+    self._thread.daemon = True
+    self._thread.name = 'PeriodicTask/Scheduler'
+    self._thread.start()
+
+    event_collection.AddCallback('periodic-tasks-pending', self.NumPending)
+
+  def NumPending(self):
+    with self._lock:
+      return len(self._heap)
+
+  def _Wake(self):
+    try:
+      os.write(self._wakeup_w, 'x')
+    except OSError as e:
+      # A full pipe already guarantees a wakeup.
+      if e.errno != errno.EAGAIN:
+        raise
+
+  def Schedule(self, task, deadline, generation):
+    with self._lock:
+      entry = (deadline, next(self._seq), task, generation)
+      heapq.heappush(self._heap, entry)
+      earliest = self._heap[0] is entry
+    if earliest:
+      self._Wake()
+
+  def Shutdown(self):
+    """Stops the scheduler thread and waits for the pool's workers to exit."""
+    with self._lock:
+      self._shutdown = True
+    self._Wake()
+    if self._thread is not threading.current_thread():
+      self._thread.join()
+    self._pool.Shutdown(wait=True)
+
+  def _Run(self):
+    while True:
+      due = []
+      timeout = None
+      with self._lock:
+        if self._shutdown:
+          return
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+          due.append(heapq.heappop(self._heap))
+        if self._heap:
+          timeout = self._heap[0][0] - now
+
+      for _, _, task, generation in due:
+        task._Dispatch(generation, self._pool)
+      if due:
+        continue
+
+      readable, _, _ = select.select([self._wakeup_r], [], [], timeout)
+      if readable:
+        os.read(self._wakeup_r, 4096)
+      event_collection.Increment('periodic-tasks-scheduler-wakeups')
+
+
+class PeriodicTask(object):
+  """Periodically run a task on the periodic task ThreadPool.
 
   A task can run an arbitrary number of times, including once. If a task is to
   be run more than once, an interval must be specified by calling Every().
 
-  The task is eligible to run after StartingNow() or one of the StartingAfter*
-  methods is called. The time it takes a task to run is not included in the
-  interval. In other words, if a PeriodicTask with interval 10 seconds is
-  created and started at 0h00m00s, the second run will occur at 0h00m00s
-  whether the task completed in 0.1 seconds or 9.9 seconds. Overruns are not
-  currently handled, which is kind of a bummer.
+  The task is eligible to run after StartingNow(), StartingAt() or one of the
+  StartingAfter* methods is called, and first runs one interval after that.
+  Instead of an interval, On() can give a trigger such as a Calendar, in which
+  case the task runs at the trigger's times from then on. Later runs are
+  scheduled on a fixed grid of one interval apart, so with an interval of 10
+  seconds, a task that first runs at 0h00m10s is next due at 0h00m20s whether
+  it completed in 0.1 seconds or 9.9 seconds.
+
+  A run that is still going when the next one is due is an overrun, and what
+  happens then is chosen with OnOverrun():
+    COALESCE (default): the missed runs are replaced by one run as soon as
+      the overrunning one finishes, then the grid resumes.
+    SKIP: the missed runs are dropped and the task next runs at the next
+      grid time after the overrunning one finishes.
+    CONCURRENT: runs start on time while up to max_concurrent are already
+      running; beyond that, the run is skipped.
+
+  Run duration and start lateness (actual minus scheduled start) are kept in
+  histograms, and overruns and skipped runs are counted. They are exported
+  as periodic-task-<name>-* and shown on /taskz.
+
+  Tasks do not have a thread each. A single scheduler thread sleeps until the
+  next task is due and hands it to a pool of --periodic_task_numthreads
+  threads, which grows up to --threadpool_max_numthreads while runs are
+  waiting for a free thread.
 
   The initialization functions return a reference to the object instance and
   are designed to be chained. Note that the Starting* method must be called
@@ -45,139 +324,297 @@ class PeriodicTask(threadlib.Thread):
   # Example 3:
   ready = threading.Event()
   task.Runs(5).Every(minutes=1).StartingAfterEvent(ready)
+
+  # Example 4:
+  task.RunForever().Every(seconds=1).OnOverrun(SKIP).StartingNow()
+
+  # Example 5: at 16:05 on weekdays, from tomorrow.
+  task.RunForever().On(Calendar('5 16 * * 1-5')).StartingAt(tomorrow)
+
+  # Example 6: only while the gate is open.
+  task.RunForever().Every(seconds=5).GatedBy(gate).StartingNow()
   """
 
-  def __init__(self, task, *args, **kwargs):
-    super(PeriodicTask, self).__init__(*args, **kwargs)
+  def __init__(self, task, scheduler, name, metric_name):
+    self.name = name
     self._task = task
+    self._scheduler = scheduler
     self._lock = threading.Lock()
+    self._idle = threading.Condition(self._lock)
     self._cancel = threading.Event()
-    self._ready = threading.Event()
     self._pause = threading.Event()
+    self._pause_reasons = set()
+    self._state = WAIT_FOR_READY
+    self._num_running = 0
+    # Idents of the pool threads running the task.
+    self._running_in = set()
+    # Incremented whenever pending runs in the scheduler become invalid.
+    self._generation = 0
     self._next_run = None
+    # Grid times of the pending run and of the last run started.
+    self._slot = None
+    self._last_slot = None
     self._pause_limbo_time = None
     self._run_interval = None
+    self._trigger = None
     self._runs_remaining = None
     self._runs_total = 0
     self._start_at = None
     self._start_event = None
     self._started_at = None
-    self._current_state = self._WaitForReady
 
-  def run(self):
-    while self._current_state is not None:
-      next_state = self._current_state()
-      if next_state != self._current_state:
-        logging.debug('current_state: %s', _StateName(self._current_state))
-        logging.debug('next_state: %s', _StateName(next_state))
-      self._current_state = next_state
-
-  def _WaitForReady(self):
-    """Waits until PeriodicTask is fully initialized.
-
-    A PeriodicTask is considered ready when StartingNow() or one of the
-    StartingAfter* methods is called.
+    self._policy = COALESCE
+    self._max_concurrent = 1
+    self._metric_prefix = 'periodic-task-%s' % (metric_name,)
+    self._overruns = 0
+    self._skipped = 0
+    self._duration_ms = histogram.Histogram(
+        '%s-duration-ms' % (self._metric_prefix,))
+    self._lateness_ms = histogram.Histogram(
+        '%s-lateness-ms' % (self._metric_prefix,))
+
+  def _ScheduleLocked(self, when, slot=None):
+    self._generation += 1
+    self._next_run = when
+    self._slot = when if slot is None else slot
+    if not self._num_running:
+      self._state = WAIT_FOR_INTERVAL
+    self._scheduler.Schedule(self, when, self._generation)
+
+  def _OverrunLocked(self, skipped):
+    self._overruns += 1
+    self._skipped += skipped
+    event_collection.Increment('%s-overruns' % (self._metric_prefix,))
+    if skipped:
+      event_collection.Add('%s-skipped-runs' % (self._metric_prefix,), skipped)
+
+  def _NextSlot(self, after):
+    if self._trigger is not None:
+      return self._trigger.Next(after)
+    return after + (self._run_interval or 0)
+
+  def _ScheduleNextLocked(self, now):
+    """Schedules the run after the last one, applying the overrun policy."""
+    slot = self._NextSlot(self._last_slot)
+    if slot >= now or (self._trigger is None and not self._run_interval):
+      self._ScheduleLocked(max(slot, now), slot)
+      return
 
-    """
-    self._ready.wait()
+    # Grid times that passed while the last run was going.
+    if self._trigger is None:
+      missed = int((now - slot) // self._run_interval) + 1
+      latest = slot + (missed - 1) * self._run_interval
+      upcoming = latest + self._run_interval
+    else:
+      missed = 0
+      while slot < now:
+        latest = slot
+        slot = self._trigger.Next(slot)
+        missed += 1
+      upcoming = slot
+
+    if self._policy == SKIP:
+      self._OverrunLocked(missed)
+      self._ScheduleLocked(upcoming)
+    else:
+      self._OverrunLocked(missed - 1)
+      self._ScheduleLocked(now, latest)
 
+  def _Ready(self):
+    """Validates the task and arranges for its first run."""
     if self._runs_remaining is None:
       raise PeriodicTaskError('Number of runs not set.')
 
-    if self._runs_remaining > 1 and self._run_interval is None:
+    if (self._runs_remaining > 1 and self._run_interval is None and
+        self._trigger is None):
       raise PeriodicTaskError('Run interval not set.')
 
-    return self._WaitForStart
-
-  def _WaitForStart(self):
-    """Waits until the starting condition is met or the task is canceled."""
-    if self._start_at:
-      return self._WaitForStartTime
-    elif self._start_event:
-      return self._WaitForStartEvent
-    else:
-      raise PeriodicTaskError('No start condition to wait for.')
-
-  def _WaitForStartTime(self):
     with self._lock:
-      start_time_passed = time.time() > self._start_at
-
-    if start_time_passed:
-      self._started_at = time.time()
-      self._next_run = time.time() + self._run_interval
-      return self._WaitForInterval
+      self._state = WAIT_FOR_START
+      if self._start_event is None:
+        self._StartedLocked(self._start_at)
+        return
 
-    cancelled = self._cancel.wait(0.2)
-    if cancelled:
-      return
-    else:
-      return self._WaitForStartTime
+    # Event.wait() without a timeout blocks without polling.
+    waiter = threadlib.Thread(target=self._WaitForStartEvent)
+    waiter.daemon = True
+    waiter.name = '%s/StartEvent' % (self.name,)
+    waiter.start()
 
   def _WaitForStartEvent(self):
-    if self._start_event.is_set():
-      self._started_at = time.time()
-      self._next_run = time.time() + self._run_interval
-      return self._WaitForInterval
+    self._start_event.wait()
+    with self._lock:
+      self._StartedLocked(time.time())
 
-    cancelled = self._cancel.wait(0.2)
-    if cancelled:
+  def _StartedLocked(self, when):
+    if self._cancel.is_set():
       return
+    self._started_at = when
+    first_run = self._NextSlot(when)
+    if self._pause.is_set():
+      self._pause_limbo_time = max(first_run - time.time(), 0)
+      self._state = PAUSED
     else:
-      return self._WaitForStartEvent
+      self._ScheduleLocked(first_run)
 
-  def _WaitForInterval(self):
-    if self._pause.wait(0.05):
-      return self._WaitForUnpause
+  def _Dispatch(self, generation, pool):
+    with self._lock:
+      if generation != self._generation:
+        return
+      now = time.time()
+      slot = self._slot
+      self._lateness_ms.Add(max(now - slot, 0) * 1000)
+
+      concurrent = self._policy == CONCURRENT
+      if concurrent and self._num_running >= self._max_concurrent:
+        self._last_slot = slot
+        self._OverrunLocked(1)
+        self._ScheduleLocked(self._NextSlot(slot))
+        return
+
+      self._state = RUNNING
+      self._num_running += 1
+      self._runs_total += 1
+      self._runs_remaining -= 1
+      self._last_slot = slot
+      self._next_run = self._NextSlot(slot)
+      if concurrent and self._runs_remaining > 0:
+        self._ScheduleLocked(self._next_run)
+    pool.RunTask(self._RunTask, self._Finished)
+
+  def _RunTask(self):
+    ident = thread.get_ident()
+    with self._lock:
+      self._running_in.add(ident)
+    start = time.time()
+    try:
+      self._task()
+    except Exception:
+      event_collection.Increment('periodic-tasks-errors')
+      logging.error('%s raised:\n%s', self.name, traceback.format_exc())
+    finally:
+      with self._lock:
+        self._running_in.discard(ident)
+    return time.time() - start
+
+  def _Finished(self, future):
+    if future.ExcInfo() is None:
+      self._duration_ms.Add(future.Result() * 1000)
+    with self._lock:
+      self._num_running -= 1
+      if not self._num_running:
+        if self._cancel.is_set() or self._runs_remaining <= 0:
+          self._state = DEAD
+        elif self._pause.is_set():
+          self._state = PAUSED
+        elif self._policy == CONCURRENT:
+          self._state = WAIT_FOR_INTERVAL
+        else:
+          self._ScheduleNextLocked(time.time())
+      self._idle.notify_all()
 
-    if self._cancel.wait(0.05):
-      return
+  def Join(self):
+    """Waits until the task is not running.
 
-    if time.time() > self._next_run:
-      return self._RunTaskNow
-    else:
-      return self._WaitForInterval
+    Called from within the task, e.g. through RemoveTask(), it waits only
+    for the task's other runs rather than for itself.
+    """
+    with self._lock:
+      own = 1 if thread.get_ident() in self._running_in else 0
+      while self._num_running > own:
+        self._idle.wait()
 
-  def _RunTaskNow(self):
-    self._next_run = time.time() + self._run_interval
-    self._runs_total += 1
-    self._task()
+  # PeriodicTask used to be a threading.Thread. These keep callers of its
+  # thread methods working: the task is alive until it has finished its
+  # last run or been cancelled.
 
-    self._runs_remaining -= 1
-    if self._runs_remaining:
-      return self._WaitForInterval
-    else:
-      return
+  def join(self, timeout=None):
+    with self._lock:
+      deadline = None if timeout is None else time.time() + timeout
+      while self._state != DEAD:
+        if deadline is None:
+          self._idle.wait()
+        elif time.time() >= deadline:
+          return
+        else:
+          self._idle.wait(deadline - time.time())
 
-  def _WaitForUnpause(self):
-    cancelled = self._cancel.wait(0.1)
-    if cancelled:
-      return
+  def is_alive(self):
+    return self._state != DEAD
 
-    if self._pause.is_set():
-      time.sleep(0.1)
-      return self._WaitForUnpause
-    else:
-      if self._pause_limbo_time:
-        self._next_run = time.time() + self._pause_limbo_time
-        self._pause_limbo_time = None
-      return self._WaitForInterval
+  isAlive = is_alive
 
-  def Pause(self):
-    self._pause.set()
+  def _PauseFor(self, reason):
+    with self._lock:
+      paused = bool(self._pause_reasons)
+      self._pause_reasons.add(reason)
+      if paused or self._state == DEAD:
+        return
+      self._pause.set()
+      self._generation += 1
+
+      if self._next_run is None:
+        self._pause_limbo_time = self._run_interval
+      else:
+        self._pause_limbo_time = max(self._next_run - time.time(), 0)
+      if self._state == WAIT_FOR_INTERVAL:
+        self._state = PAUSED
+    logging.debug('pause_limbo_time: %s', self._pause_limbo_time)
+
+  def _UnpauseFor(self, reason):
+    with self._lock:
+      if reason not in self._pause_reasons:
+        return
+      self._pause_reasons.remove(reason)
+      if self._pause_reasons or not self._pause.is_set():
+        return
+      self._pause.clear()
+      # Concurrent runs are scheduled independently of running ones.
+      concurrent_pending = (
+          self._policy == CONCURRENT and self._state == RUNNING and
+          self._runs_remaining > 0 and not self._cancel.is_set())
+      if self._state == PAUSED or concurrent_pending:
+        now = time.time()
+        if self._trigger is not None:
+          # Resume on the calendar rather than part way between slots.
+          self._ScheduleLocked(self._trigger.Next(now))
+        else:
+          self._ScheduleLocked(now + (self._pause_limbo_time or 0))
+      self._pause_limbo_time = None
 
-    if self._next_run is None:
-      self._pause_limbo_time = self._run_interval
-    else:
-      self._pause_limbo_time = max(self._next_run - time.time(), 0)
-    logging.debug('pause_limbo_time: %.2f', self._pause_limbo_time)
+  def Pause(self):
+    self._PauseFor(_USER_PAUSE)
 
   def Unpause(self):
-    self._pause.clear()
+    self._UnpauseFor(_USER_PAUSE)
+
+  def GatedBy(self, gate):
+    """Runs the task only while gate, a Gate, is open."""
+    gate.AddTask(self)
+    return self
 
   def Cancel(self):
-    logging.info(
-        'Cancelling %s (%s)', self.name, _StateName(self._current_state))
-    self._cancel.set()
+    logging.info('Cancelling %s (%s)', self.name, self._state)
+    with self._lock:
+      self._cancel.set()
+      self._generation += 1
+      if not self._num_running:
+        self._state = DEAD
+      self._idle.notify_all()
+
+  def _UnregisterEventCallbacks(self):
+    self._duration_ms.Unregister()
+    self._lateness_ms.Unregister()
+    for event in ('overruns', 'skipped-runs'):
+      event_collection.Remove('%s-%s' % (self._metric_prefix, event))
+
+  def OnOverrun(self, policy, max_concurrent=1):
+    if policy not in (COALESCE, SKIP, CONCURRENT):
+      raise PeriodicTaskError('Unknown overrun policy: %s' % (policy,))
+    with self._lock:
+      self._policy = policy
+      self._max_concurrent = max_concurrent
+    return self
 
   def Every(self, seconds=None, minutes=None, hours=None):
     with self._lock:
@@ -190,6 +627,16 @@ class PeriodicTask(threadlib.Thread):
         self._run_interval += hours * 60 * 60
     return self
 
+  def On(self, trigger):
+    """Runs the task at the times given by trigger instead of an interval.
+
+    trigger is a Calendar, or any object whose Next(t) returns the first
+    time after t at which to run.
+    """
+    with self._lock:
+      self._trigger = trigger
+    return self
+
   def RunOnce(self):
     self._runs_remaining = 1
     return self
@@ -211,26 +658,49 @@ class PeriodicTask(threadlib.Thread):
         self._start_at += minutes * 60
       if hours:
         self._start_at += hours * 60 * 60
-    self._ready.set()
+    self._Ready()
     return self
 
   def StartingAt(self, when):
-    raise NotImplementedError()
+    """Starts the task at when, a datetime or seconds since the epoch.
+
+    Naive datetimes are in local time.
+    """
+    if isinstance(when, datetime.datetime):
+      if when.tzinfo is None:
+        seconds = time.mktime(when.timetuple())
+      else:
+        seconds = calendar.timegm(when.utctimetuple())
+      when = seconds + when.microsecond / 1e6
+    with self._lock:
+      self._start_at = when
+    self._Ready()
+    return self
 
   def StartingNow(self):
     with self._lock:
       self._start_at = time.time()
-    self._ready.set()
+    self._Ready()
     return self
 
   def StartingAfterEvent(self, event):
     with self._lock:
       self._start_event = event
-    self._ready.set()
+    self._Ready()
     return self
 
+  def IsStarted(self):
+    return self._started_at is not None and self._started_at <= time.time()
+
+  def GetScheduleText(self):
+    if self._trigger is not None:
+      return str(self._trigger)
+    if self._run_interval is not None:
+      return 'every %ss' % (self._run_interval,)
+    return 'once'
+
   def GetStartConditionText(self):
-    if self._started_at is not None:
+    if self.IsStarted():
       return 'Started at %s' % (time.ctime(self._started_at),)
 
     if self._start_event:
@@ -243,46 +713,48 @@ class PeriodicTask(threadlib.Thread):
     return 'Not startable'
 
 
-def _StateName(state):
-  if state is None:
-    return 'Dead'
-  else:
-    return state.__name__
-
+def AddTask(closure, name=None):
+  """Returns a new PeriodicTask for closure, ready to be configured.
 
-def AddTask(closure):
+  name, if given, is shown on /taskz and used in the task's metrics in place
+  of its number.
+  """
+  global _SCHEDULER
   if _IN_SHUTDOWN:
     logging.warning('Attempted to add task while shutting down')
     return
 
-  # Invariant: All tasks in _TASKS are alive.
   with _TASKS_LOCK:
-    task = PeriodicTask(closure)
-    task.daemon = True
-    task.start()
-    task.name = 'PeriodicTask/%d' % (task.tid)
+    if _SCHEDULER is None:
+      _SCHEDULER = _Scheduler(FLAGS.periodic_task_numthreads)
+    task_id = next(_TASK_IDS)
+    if name is None:
+      task = PeriodicTask(
+          closure, _SCHEDULER, 'PeriodicTask/%d' % (task_id,), task_id)
+    else:
+      task = PeriodicTask(closure, _SCHEDULER, name, name)
     _TASKS.append(task)
   return task
 
 
 def RemoveTask(task):
-  # Invariant: All live tasks are in _TASKS.
   if not task._cancel.is_set():
     logging.warning('Task %s being removed while still alive', task.name)
     logging.warning('You should explicitly call task.Cancel()')
     task.Cancel()
 
+  logging.info('Waiting for %s to terminate', task.name)
+  task.Join()
   with _TASKS_LOCK:
-    logging.info('Waiting for %s to terminate', task.name)
-    task.join()
-    _TASKS.remove(task)
+    if task in _TASKS:
+      _TASKS.remove(task)
+  task._UnregisterEventCallbacks()
 
 
 def CancelAllTasks():
   with _TASKS_LOCK:
     # First, all tasks are cancelled, then all tasks are removed. Two stages
-    # are used because RemoveTask() calls join() on the task, which can block
-    # if the task is busy.
+    # are used because RemoveTask() waits for a running task to finish.
     for task in _TASKS:
       task.Cancel()
 
@@ -292,10 +764,13 @@ def CancelAllTasks():
 
 
 def Shutdown():
+  global _IN_SHUTDOWN
   logging.info('Shutting down periodic tasks')
   with _TASKS_LOCK:
     _IN_SHUTDOWN = True
     CancelAllTasks()
+    if _SCHEDULER is not None:
+      _SCHEDULER.Shutdown()
 
 
 def TasksTotal():
@@ -304,7 +779,7 @@ def TasksTotal():
 
 def TasksStarted():
   with _TASKS_LOCK:
-    return len([t for t in _TASKS if t._started_at is not None])
+    return len([t for t in _TASKS if t.IsStarted()])
 
 def HandleTaskz(environ, start_response):
   response = []
@@ -314,11 +789,17 @@ def HandleTaskz(environ, start_response):
   response.append('<tr>')
   response.append('<th>Task</th>')
   response.append('<th>Started</th>')
+  response.append('<th>Schedule</th>')
   response.append('<th>State</th>')
   response.append('<th>Paused</th>')
   response.append('<th>Next Run</th>')
   response.append('<th>Times Run</th>')
   response.append('<th>Runs Remaining</th>')
+  response.append('<th>Overrun Policy</th>')
+  response.append('<th>Overruns</th>')
+  response.append('<th>Skipped</th>')
+  response.append('<th>Duration p50/p99 ms</th>')
+  response.append('<th>Lateness p50/p99 ms</th>')
   response.append('</tr>')
 
   with _TASKS_LOCK:
@@ -328,8 +809,14 @@ def HandleTaskz(environ, start_response):
         response.append('<td>%s</td>' % (task.name))
         response.append('<td>%s</td>' % (
             cgi.escape(task.GetStartConditionText()),))
-        response.append('<td>%s</td>' % (task._current_state.__name__,))
-        response.append('<td>%s</td>' % (task._pause.is_set(),))
+        response.append('<td>%s</td>' % (
+            cgi.escape(task.GetScheduleText()),))
+        response.append('<td>%s</td>' % (task._state,))
+        if task._pause_reasons:
+          paused = ', '.join(sorted(str(r) for r in task._pause_reasons))
+        else:
+          paused = False
+        response.append('<td>%s</td>' % (cgi.escape(str(paused)),))
 
         if task._next_run:
           next_run = time.ctime(task._next_run)
@@ -338,6 +825,15 @@ def HandleTaskz(environ, start_response):
         response.append('<td>%s</td>' % (next_run,))
         response.append('<td>%s</td>' % (task._runs_total,))
         response.append('<td>%s</td>' % (task._runs_remaining,))
+        policy = task._policy
+        if policy == CONCURRENT:
+          policy = '%s (max %d)' % (policy, task._max_concurrent)
+        response.append('<td>%s</td>' % (policy,))
+        response.append('<td>%s</td>' % (task._overruns,))
+        response.append('<td>%s</td>' % (task._skipped,))
+        for hist in (task._duration_ms, task._lateness_ms):
+          response.append('<td>%s / %s</td>' % (
+              hist.Percentile(50), hist.Percentile(99)))
       response.append('</tr>')
 
   response.append('</table></pre></body></html>')
@@ -1,13 +1,20 @@
 #!/usr/bin/python -B
 
+import datetime
+import gflags
+import os
 import sys
 import threading
 import time
+import unittest
 
-from google.apputils import app
 from projects.lib.base import logging
 from projects.lib.concurrency import periodic_task
 from projects.lib.telemetry import embedded_server
+from projects.lib.telemetry import event_collection
+
+
+FLAGS = gflags.FLAGS
 
 
 def LoggerTask():
@@ -37,7 +44,9 @@ def AddSomeTasksAndWait():
   logging.info('Sleeping then terminating')
   time.sleep(600)
 
-def main(unused_argv):
+
+def Demo():
+  """Runs a few tasks for ten minutes; watch them on /taskz."""
   telemetry_server = embedded_server.TelemetryServer()
   telemetry_server.start()
 
@@ -48,5 +57,323 @@ def main(unused_argv):
     sys.exit(0)
 
 
+def WaitFor(predicate, timeout_secs=2.0):
+  deadline = time.time() + timeout_secs
+  while not predicate():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.005)
+  return True
+
+
+class Counter(object):
+
+  def __init__(self):
+    self.runs = 0
+    self.times = []
+
+  def __call__(self):
+    self.runs += 1
+    self.times.append(time.time())
+
+
+class _FakeTask(object):
+
+  def __init__(self, name, dispatched):
+    self.name = name
+    self._dispatched = dispatched
+
+  def _Dispatch(self, generation, pool):
+    self._dispatched.append((self.name, generation))
+
+
+class SchedulerTest(unittest.TestCase):
+
+  def testDispatchesInDeadlineOrder(self):
+    scheduler = periodic_task._Scheduler(1)
+    dispatched = []
+    now = time.time()
+    for name, delay in (('c', 0.15), ('a', 0.05), ('b', 0.1)):
+      scheduler.Schedule(_FakeTask(name, dispatched), now + delay, 7)
+    self.assertEqual(3, scheduler.NumPending())
+    self.assertTrue(WaitFor(lambda: len(dispatched) == 3))
+    self.assertEqual([('a', 7), ('b', 7), ('c', 7)], dispatched)
+    self.assertEqual(0, scheduler.NumPending())
+    scheduler.Shutdown()
+
+  def testEarlierDeadlineWakesScheduler(self):
+    scheduler = periodic_task._Scheduler(1)
+    dispatched = []
+    scheduler.Schedule(_FakeTask('late', dispatched), time.time() + 60, 0)
+    time.sleep(0.02)
+    scheduler.Schedule(_FakeTask('soon', dispatched), time.time() + 0.01, 0)
+    self.assertTrue(WaitFor(lambda: dispatched))
+    self.assertEqual([('soon', 0)], dispatched)
+    scheduler.Shutdown()
+
+
+class PeriodicTaskTest(unittest.TestCase):
+
+  def tearDown(self):
+    periodic_task.CancelAllTasks()
+
+  def testRunOnce(self):
+    counter = Counter()
+    task = periodic_task.AddTask(counter).RunOnce().StartingNow()
+    task.join(2)
+    self.assertFalse(task.is_alive())
+    self.assertEqual(1, counter.runs)
+
+  def testRuns(self):
+    counter = Counter()
+    task = periodic_task.AddTask(counter)
+    task.Runs(3).Every(seconds=0.02).StartingNow()
+    task.join(2)
+    self.assertFalse(task.isAlive())
+    self.assertEqual(3, counter.runs)
+    gaps = [b - a for a, b in zip(counter.times, counter.times[1:])]
+    self.assertTrue(all(gap > 0.01 for gap in gaps), gaps)
+
+  def testRunsNeedsInterval(self):
+    task = periodic_task.AddTask(Counter()).Runs(2)
+    self.assertRaises(periodic_task.PeriodicTaskError, task.StartingNow)
+
+  def testPauseUnpause(self):
+    counter = Counter()
+    task = periodic_task.AddTask(counter)
+    task.RunForever().Every(seconds=0.02).StartingNow()
+    self.assertTrue(WaitFor(lambda: counter.runs >= 2))
+
+    task.Pause()
+    task.Join()
+    paused_runs = counter.runs
+    time.sleep(0.1)
+    self.assertEqual(paused_runs, counter.runs)
+
+    task.Unpause()
+    self.assertTrue(WaitFor(lambda: counter.runs > paused_runs))
+    task.Cancel()
+
+  def testStartingAfterEvent(self):
+    counter = Counter()
+    event = threading.Event()
+    task = periodic_task.AddTask(counter)
+    task.RunOnce().StartingAfterEvent(event)
+    time.sleep(0.05)
+    self.assertEqual(0, counter.runs)
+    self.assertFalse(task.IsStarted())
+
+    event.set()
+    task.join(2)
+    self.assertEqual(1, counter.runs)
+    self.assertTrue(task.IsStarted())
+
+  def testTaskThatRaisesKeepsRunning(self):
+    counter = Counter()
+
+    def Fail():
+      counter()
+      raise ValueError('expected')
+
+    task = periodic_task.AddTask(Fail)
+    task.Runs(3).Every(seconds=0.01).StartingNow()
+    task.join(2)
+    self.assertEqual(3, counter.runs)
+
+  def testBlockedTasksDontDelayOthers(self):
+    release = threading.Event()
+    try:
+      for _ in xrange(FLAGS.periodic_task_numthreads):
+        periodic_task.AddTask(release.wait).RunOnce().StartingNow()
+      counter = Counter()
+      task = periodic_task.AddTask(counter).RunOnce().StartingNow()
+      task.join(2)
+      self.assertEqual(1, counter.runs)
+    finally:
+      release.set()
+
+  def testRemoveTaskFromWithinTask(self):
+    removed = threading.Event()
+    holder = []
+
+    def RemoveSelf():
+      periodic_task.RemoveTask(holder[0])
+      removed.set()
+
+    holder.append(periodic_task.AddTask(RemoveSelf))
+    holder[0].RunForever().Every(seconds=0.01).StartingNow()
+    self.assertTrue(removed.wait(2))
+    holder[0].join(2)
+    self.assertFalse(holder[0].is_alive())
+
+
+def _Timestamp(*args):
+  return time.mktime(datetime.datetime(*args).timetuple())
+
+
+def _DateTime(timestamp):
+  return datetime.datetime.fromtimestamp(timestamp)
+
+
+class CalendarTest(unittest.TestCase):
+  """Calendar.Next in a zone with daylight saving time."""
+
+  def setUp(self):
+    self._tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+
+  def tearDown(self):
+    if self._tz is None:
+      del os.environ['TZ']
+    else:
+      os.environ['TZ'] = self._tz
+    time.tzset()
+
+  def testWeekdaysSkipTheWeekend(self):
+    calendar = periodic_task.Calendar('30 9 * * 1-5')
+    # Friday after the open.
+    after = _Timestamp(2026, 10, 16, 10, 0)
+    self.assertEqual(datetime.datetime(2026, 10, 19, 9, 30),
+                     _DateTime(calendar.Next(after)))
+
+  def testNextIsStrictlyAfter(self):
+    calendar = periodic_task.Calendar('30 9 * * *')
+    after = _Timestamp(2026, 10, 16, 9, 30)
+    self.assertEqual(datetime.datetime(2026, 10, 17, 9, 30),
+                     _DateTime(calendar.Next(after)))
+
+  def testDaylightSavingTime(self):
+    calendar = periodic_task.Calendar('0 12 * * *')
+    # Clocks go forward on 2026-03-08 and back on 2026-11-01.
+    after = _Timestamp(2026, 3, 7, 12, 0)
+    spring = calendar.Next(after)
+    self.assertEqual(datetime.datetime(2026, 3, 8, 12, 0), _DateTime(spring))
+    self.assertEqual(23 * 3600, spring - after)
+
+    after = _Timestamp(2026, 10, 31, 12, 0)
+    fall = calendar.Next(after)
+    self.assertEqual(datetime.datetime(2026, 11, 1, 12, 0), _DateTime(fall))
+    self.assertEqual(25 * 3600, fall - after)
+
+  def testLeapDay(self):
+    calendar = periodic_task.Calendar('0 0 29 2 *')
+    after = _Timestamp(2026, 3, 1, 0, 0)
+    self.assertEqual(datetime.datetime(2028, 2, 29, 0, 0),
+                     _DateTime(calendar.Next(after)))
+
+  def testNeverMatches(self):
+    calendar = periodic_task.Calendar('0 0 30 2 *')
+    self.assertRaises(periodic_task.PeriodicTaskError, calendar.Next,
+                      time.time())
+
+
+class GateTest(unittest.TestCase):
+
+  def tearDown(self):
+    periodic_task.CancelAllTasks()
+
+  def testGatedTaskRunsOnlyWhileOpen(self):
+    counter = Counter()
+    gate = periodic_task.Gate(is_open=False)
+    task = periodic_task.AddTask(counter)
+    task.RunForever().Every(seconds=0.02).GatedBy(gate).StartingNow()
+    time.sleep(0.1)
+    self.assertEqual(0, counter.runs)
+
+    gate.Open()
+    self.assertTrue(WaitFor(lambda: counter.runs >= 2))
+
+    gate.Close()
+    task.Join()
+    closed_runs = counter.runs
+    time.sleep(0.1)
+    self.assertEqual(closed_runs, counter.runs)
+
+  def testUserPauseAndGateAreIndependent(self):
+    counter = Counter()
+    gate = periodic_task.Gate()
+    task = periodic_task.AddTask(counter)
+    task.RunForever().Every(seconds=0.02).GatedBy(gate).StartingNow()
+    task.Pause()
+    task.Join()
+    gate.Close()
+    gate.Open()
+    paused_runs = counter.runs
+    time.sleep(0.1)
+    self.assertEqual(paused_runs, counter.runs)
+
+    task.Unpause()
+    self.assertTrue(WaitFor(lambda: counter.runs > paused_runs))
+
+
+class OverrunPolicyTest(unittest.TestCase):
+  """A 0.1s task whose first run takes 0.25s, overrunning two grid times."""
+
+  def tearDown(self):
+    periodic_task.CancelAllTasks()
+
+  def _RunSlowFirst(self, policy):
+    counter = Counter()
+
+    def SlowFirst():
+      counter()
+      if counter.runs == 1:
+        time.sleep(0.25)
+
+    task = periodic_task.AddTask(SlowFirst)
+    task.Runs(3).Every(seconds=0.1).OnOverrun(policy).StartingNow()
+    task.join(3)
+    self.assertEqual(3, counter.runs)
+    return task, counter
+
+  def testCoalesce(self):
+    task, counter = self._RunSlowFirst(periodic_task.COALESCE)
+    self.assertEqual(1, task._overruns)
+    self.assertEqual(1, task._skipped)
+    # The coalesced run starts as soon as the slow one finishes.
+    self.assertLess(counter.times[1] - counter.times[0], 0.3)
+
+  def testSkip(self):
+    task, counter = self._RunSlowFirst(periodic_task.SKIP)
+    self.assertEqual(1, task._overruns)
+    self.assertEqual(2, task._skipped)
+    # The next run waits for the next grid time.
+    self.assertGreater(counter.times[1] - counter.times[0], 0.28)
+
+  def testConcurrentRespectsMax(self):
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def Slow():
+      with lock:
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+      time.sleep(0.25)
+      with lock:
+        running[0] -= 1
+
+    task = periodic_task.AddTask(Slow)
+    task.Runs(4).Every(seconds=0.05).OnOverrun(
+        periodic_task.CONCURRENT, max_concurrent=2).StartingNow()
+    task.join(5)
+    self.assertEqual(2, peak[0])
+    self.assertEqual(4, task._runs_total)
+    self.assertGreater(task._overruns, 0)
+    self.assertEqual(task._overruns, task._skipped)
+
+  def testRemoveTaskUnregistersMetrics(self):
+    task = periodic_task.AddTask(Counter(), name='short-lived')
+    task.RunOnce().StartingNow()
+    task.join(2)
+    self.assertIn('periodic-task-short-lived-duration-ms',
+                  event_collection.GetEvents())
+    periodic_task.RemoveTask(task)
+    self.assertNotIn('periodic-task-short-lived-duration-ms',
+                     event_collection.GetEvents())
+
+
 if __name__ == '__main__':
-  app.run()
+  FLAGS(sys.argv[:1])
+  unittest.main()
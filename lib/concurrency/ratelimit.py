@@ -0,0 +1,113 @@
+import heapq
+import itertools
+import threading
+import time
+
+from projects.lib.telemetry import event_collection
+
+
+class TokenBucket(object):
+  """Allows `rate` operations per `per_secs`, with bursts of up to `burst`.
+
+  Not thread-safe; callers must serialize access.
+  """
+
+  def __init__(self, rate, per_secs, burst=None):
+    self._fill_rate = float(rate) / per_secs
+    self._capacity = float(burst if burst is not None else rate)
+    self._tokens = self._capacity
+    self._last_fill = time.time()
+
+  def _Fill(self, now):
+    elapsed = now - self._last_fill
+    self._tokens = min(self._capacity, self._tokens + elapsed * self._fill_rate)
+    self._last_fill = now
+
+  def Take(self, now):
+    """Takes a token if one is available and returns whether it did."""
+    self._Fill(now)
+    if self._tokens >= 1:
+      self._tokens -= 1
+      return True
+    return False
+
+  def SecondsUntilToken(self, now):
+    self._Fill(now)
+    if self._tokens >= 1:
+      return 0
+    return (1 - self._tokens) / self._fill_rate
+
+  def Tokens(self):
+    self._Fill(time.time())
+    return self._tokens
+
+
+class PriorityRateLimiter(object):
+  """Admits callers at the rate of a TokenBucket, lowest priority value first.
+
+  Acquire() blocks the calling thread until it is at the head of the queue
+  and a token is available. Callers with equal priority are admitted in
+  arrival order.
+
+  Queue wait and admissions are published to event_collection under
+  ratelimit-<name>-*, along with the tokens remaining and queue length.
+  """
+
+  def __init__(self, name, rate, per_secs, burst=None):
+    self._name = name
+    self._bucket = TokenBucket(rate, per_secs, burst)
+    self._cond = threading.Condition(threading.Lock())
+    self._waiters = []
+    self._seq = itertools.count()
+    self._RegisterEventCallbacks()
+
+  def _RegisterEventCallbacks(self):
+    event_collection.AddCallback(
+        self._EventKey('tokens-remaining'), self.TokensRemaining)
+    event_collection.AddCallback(self._EventKey('queued'), self.NumQueued)
+
+  def UnregisterEventCallbacks(self):
+    event_collection.RemoveCallback(
+        self._EventKey('tokens-remaining'), self.TokensRemaining)
+    event_collection.RemoveCallback(self._EventKey('queued'), self.NumQueued)
+
+  def _EventKey(self, event):
+    return 'ratelimit-%s-%s' % (self._name, event)
+
+  def TokensRemaining(self):
+    with self._cond:
+      return self._bucket.Tokens()
+
+  def NumQueued(self):
+    with self._cond:
+      return len(self._waiters)
+
+  def Acquire(self, priority):
+    start = time.time()
+    with self._cond:
+      me = (priority, next(self._seq))
+      heapq.heappush(self._waiters, me)
+      try:
+        while True:
+          now = time.time()
+          if self._waiters[0] == me:
+            if self._bucket.Take(now):
+              heapq.heappop(self._waiters)
+              break
+            timeout = self._bucket.SecondsUntilToken(now)
+          else:
+            timeout = None
+          self._cond.wait(timeout)
+      except BaseException:
+        # E.g. KeyboardInterrupt. Leave the queue, or everyone behind us
+        # would wait forever.
+        self._waiters.remove(me)
+        heapq.heapify(self._waiters)
+        raise
+      finally:
+        # The new head of the queue may be able to go now.
+        self._cond.notify_all()
+
+    wait_ms = int((time.time() - start) * 1000)
+    event_collection.Increment(self._EventKey('admitted'))
+    event_collection.Add(self._EventKey('queue-wait-ms'), wait_ms)
@@ -0,0 +1,116 @@
+#!/usr/bin/python -B
+
+import threading
+import time
+import unittest
+
+from projects.lib.concurrency import ratelimit
+
+
+class TokenBucketTest(unittest.TestCase):
+
+  def testBurstThenRefill(self):
+    bucket = ratelimit.TokenBucket(10, 1, burst=2)
+    now = time.time()
+    self.assertTrue(bucket.Take(now))
+    self.assertTrue(bucket.Take(now))
+    self.assertFalse(bucket.Take(now))
+    self.assertAlmostEqual(0.1, bucket.SecondsUntilToken(now), places=3)
+    self.assertFalse(bucket.Take(now + 0.05))
+    self.assertTrue(bucket.Take(now + 0.11))
+
+  def testRefillIsCapped(self):
+    bucket = ratelimit.TokenBucket(10, 1, burst=2)
+    now = time.time()
+    self.assertTrue(bucket.Take(now))
+    self.assertTrue(bucket.Take(now))
+    now += 60
+    self.assertTrue(bucket.Take(now))
+    self.assertTrue(bucket.Take(now))
+    self.assertFalse(bucket.Take(now))
+
+
+class PriorityRateLimiterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.limiter = ratelimit.PriorityRateLimiter(
+        'ratelimit-test', 20, 1, burst=1)
+
+  def tearDown(self):
+    self.limiter.UnregisterEventCallbacks()
+
+  def _Queue(self, priorities):
+    """Starts an Acquire() per priority, each once the last is queued."""
+    admitted = []
+    threads = []
+    queued = self.limiter.NumQueued()
+    for priority in priorities:
+      def Acquire(priority=priority):
+        self.limiter.Acquire(priority)
+        admitted.append(priority)
+
+      threads.append(threading.Thread(target=Acquire))
+      threads[-1].daemon = True
+      threads[-1].start()
+      deadline = time.time() + 2
+      while (self.limiter.NumQueued() < queued + len(threads) and
+             time.time() < deadline):
+        time.sleep(0.001)
+    return threads, admitted
+
+  def testAdmitsAtRate(self):
+    start = time.time()
+    for _ in xrange(5):
+      self.limiter.Acquire(0)
+    # One token up front, then one every 50ms.
+    self.assertGreater(time.time() - start, 0.18)
+
+  def testLowestPriorityFirst(self):
+    self.limiter.Acquire(0)  # Empty the bucket.
+    threads, admitted = self._Queue([5, 1, 3, 1, 0])
+    for t in threads:
+      t.join(2)
+    self.assertEqual([0, 1, 1, 3, 5], admitted)
+    self.assertEqual(0, self.limiter.NumQueued())
+
+  def testInterruptedWaiterLeavesQueue(self):
+    self.limiter.Acquire(0)
+    wait = self.limiter._cond.wait
+    interrupt = threading.Event()
+
+    def Wait(timeout=None):
+      if threading.current_thread().name != 'interrupted':
+        return wait(timeout)
+      while not interrupt.is_set():
+        wait(0.01)
+      raise KeyboardInterrupt
+
+    self.limiter._cond.wait = Wait
+    errors = []
+
+    def Acquire():
+      try:
+        self.limiter.Acquire(0)
+      except KeyboardInterrupt as e:
+        errors.append(e)
+
+    interrupted = threading.Thread(target=Acquire, name='interrupted')
+    interrupted.daemon = True
+    interrupted.start()
+    while self.limiter.NumQueued() < 1:
+      time.sleep(0.001)
+
+    # Queued behind the head of the queue, which is then interrupted.
+    threads, admitted = self._Queue([1, 2])
+    self.assertEqual(3, self.limiter.NumQueued())
+    interrupt.set()
+    interrupted.join(2)
+    for t in threads:
+      t.join(2)
+    self.assertEqual(1, len(errors))
+    self.assertEqual([1, 2], admitted)
+    self.assertEqual(0, self.limiter.NumQueued())
+
+
+if __name__ == '__main__':
+  unittest.main()
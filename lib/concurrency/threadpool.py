@@ -1,133 +1,369 @@
+import collections
 import functools
 import gflags
-import Queue
 import sys
 import threading
 import time
+import traceback
 
-from projects.lib.base import debuglog
+from projects.lib.base import logging
 from projects.lib.concurrency import threadlib
 from projects.lib.telemetry import event_collection
 
 
 FLAGS = gflags.FLAGS
 
-gflags.DEFINE_integer('threadpool_numthreads', 4, 'Number of threads.',
+gflags.DEFINE_integer('threadpool_numthreads', 4,
+                      'Minimum and initial number of threads.', lower_bound=1)
+gflags.DEFINE_integer('threadpool_max_numthreads', 16,
+                      'Number of threads a pool may grow to under load.',
                       lower_bound=1)
+gflags.DEFINE_integer('threadpool_target_wait_ms', 100,
+                      'Queue wait above which a pool adds threads.',
+                      lower_bound=1)
+gflags.DEFINE_integer('threadpool_idle_timeout_secs', 30,
+                      'Idle time after which threads above '
+                      '--threadpool_numthreads exit.', lower_bound=0)
+
+
+class Future(object):
+  """The eventual result of a task passed to ThreadPool.RunTask.
+
+  future = pool.RunTask(closure)
+  future.AddDoneCallback(lambda f: logging.info('Done: %s', f.Result()))
+  value = future.Result()  # Raises whatever closure raised.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._done = False
+    # Created by the first caller to wait, as most futures are never waited
+    # on.
+    self._event = None
+    self._result = None
+    self._exc_info = None
+    self._callbacks = []
+
+  def _Run(self, closure):
+    """Runs closure and resolves the future with its outcome.
+
+    Exceptions that are not Exceptions, such as SystemExit, are kept on the
+    future like any other and then re-raised.
+    """
+    try:
+      self._result = closure()
+    except BaseException:
+      self._exc_info = sys.exc_info()
+      event_collection.Increment('executor-tasks-failed')
+
+    with self._lock:
+      self._done = True
+      callbacks, self._callbacks = self._callbacks, None
+      event = self._event
+    if event is not None:
+      event.set()
+    for callback in callbacks:
+      self._Call(callback)
+    exc_info = self._exc_info
+    if exc_info is not None and not isinstance(exc_info[1], Exception):
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+  def _Call(self, callback):
+    try:
+      callback(self)
+    except Exception:
+      logging.error('Future callback failed:\n%s', traceback.format_exc())
+
+  def Done(self):
+    return self._done
+
+  def Wait(self, timeout=None):
+    """Waits for the task to finish. Returns whether it has."""
+    with self._lock:
+      if self._done:
+        return True
+      if self._event is None:
+        self._event = threading.Event()
+      event = self._event
+    return event.wait(timeout)
+
+  def Result(self, timeout=None):
+    """Returns the task's result, or raises its exception."""
+    if not self.Wait(timeout):
+      raise RuntimeError('Task not done after %s seconds' % (timeout,))
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+  def Exception(self, timeout=None):
+    """Returns the exception the task raised, or None."""
+    return (self.ExcInfo(timeout) or (None, None, None))[1]
+
+  def ExcInfo(self, timeout=None):
+    """Returns sys.exc_info() from the task's exception, or None."""
+    if not self.Wait(timeout):
+      raise RuntimeError('Task not done after %s seconds' % (timeout,))
+    return self._exc_info
+
+  def AddDoneCallback(self, callback):
+    """Calls callback(future) when the task finishes, or now if it has."""
+    with self._lock:
+      if self._callbacks is not None:
+        self._callbacks.append(callback)
+        return
+    self._Call(callback)
 
 
 class ThreadPool(object):
-  def __init__(self, size=None):
+  """Runs closures on a pool of worker threads that grows and shrinks.
+
+  Workers take tasks straight from a shared queue, so a task is handed off
+  once, from the caller to whichever worker is free. RunTask returns a
+  Future. A closure that raises does not take its worker down; the exception
+  is kept on the Future.
+
+  The pool starts with size threads and never has fewer. When no worker is
+  free and the oldest queued task has waited longer than target_wait_ms, it
+  adds a thread, up to max_size. It adds at most one thread per
+  target_wait_ms, so a burst does not spawn max_size threads before the new
+  ones have had a chance to drain the queue. While tasks are queued and every
+  worker is busy, a monitor thread rechecks every target_wait_ms, so the pool
+  grows even when all its workers are stuck on long tasks; it exits once the
+  backlog clears. max_size defaults to size if size is given, and to
+  --threadpool_max_numthreads otherwise. A thread above size exits
+  after idle_timeout_secs without work. Growing takes milliseconds and
+  shrinking tens of seconds, so a bursty load settles on the size it needs
+  rather than thrashing.
+
+  Threads, busy and free threads and queued tasks are published to
+  event_collection as <name>-*, and each thread added or removed is counted
+  in <name>-threads-grown or <name>-threads-shrunk.
+  """
+
+  def __init__(self, size=None, max_size=None, target_wait_ms=None,
+               idle_timeout_secs=None, name='executor'):
+    if max_size is None:
+      if size is None:
+        max_size = FLAGS.threadpool_max_numthreads
+      else:
+        max_size = size
     if size is None:
       size = FLAGS.threadpool_numthreads
+    if target_wait_ms is None:
+      target_wait_ms = FLAGS.threadpool_target_wait_ms
+    if idle_timeout_secs is None:
+      idle_timeout_secs = FLAGS.threadpool_idle_timeout_secs
 
     self._size = size
-    self._busy = []
-    self._free = []
-    self._sem = threading.Semaphore(self._size)
+    self._max_size = max(max_size, size)
+    self._target_wait_secs = target_wait_ms / 1000.0
+    self._idle_timeout_secs = idle_timeout_secs
+    self._name = name
     self._lock = threading.Lock()
-    self._queue = Queue.Queue()
+    # Up to one idle thread per thread above size waits on _surplus_cond
+    # with the idle timeout, and exits when it expires; the rest wait on
+    # _cond without one. py2's Condition.wait(timeout) polls, so a timed
+    # waiter can take tens of milliseconds to notice a notify; tasks go to
+    # an untimed waiter when there is one.
+    self._cond = threading.Condition(self._lock)
+    self._surplus_cond = threading.Condition(self._lock)
+    self._num_waiting = 0
+    self._num_surplus_waiting = 0
+    # Separate from _cond so that RunTask's notify always wakes a worker.
+    self._monitor_cond = threading.Condition(self._lock)
+    self._monitoring = False
+    self._tasks = collections.deque()
+    self._num_threads = 0
+    self._num_idle = 0
+    self._last_grow = 0
+    self._shutdown = False
+    self._threads = set()
     self._CreateThreads()
     self._RegisterEventCallbacks()
 
   def _RegisterEventCallbacks(self):
-    event_collection.AddCallback('executor-threads-busy', self.GetNumBusy)
-    event_collection.AddCallback('executor-threads-free', self.GetNumFree)
-    event_collection.AddCallback('executor-tasks-queued', self.GetNumQueued)
+    name = self._name
+    event_collection.AddCallback('%s-threads-total' % (name,),
+                                 self.GetNumThreads)
+    event_collection.AddCallback('%s-threads-busy' % (name,), self.GetNumBusy)
+    event_collection.AddCallback('%s-threads-free' % (name,), self.GetNumFree)
+    event_collection.AddCallback('%s-tasks-queued' % (name,),
+                                 self.GetNumQueued)
+
+  def _UnregisterEventCallbacks(self):
+    name = self._name
+    event_collection.RemoveCallback('%s-threads-total' % (name,),
+                                    self.GetNumThreads)
+    event_collection.RemoveCallback('%s-threads-busy' % (name,),
+                                    self.GetNumBusy)
+    event_collection.RemoveCallback('%s-threads-free' % (name,),
+                                    self.GetNumFree)
+    event_collection.RemoveCallback('%s-tasks-queued' % (name,),
+                                    self.GetNumQueued)
+
+  def GetNumThreads(self):
+    with self._lock:
+      return self._num_threads
 
   def GetNumBusy(self):
     with self._lock:
-      return len(self._busy)
+      return self._num_threads - self._num_idle
 
   def GetNumFree(self):
     with self._lock:
-      return len(self._free)
+      return self._num_idle
 
   def GetNumQueued(self):
     with self._lock:
-      return self._queue.qsize()
+      return len(self._tasks)
 
-  def _GetThreadFromPool(self):
-    start = time.time()
-    self._sem.acquire()
-    wait_ms = int((time.time() - start) * 1000)
-    event_collection.Add('executor-queue-wait-ms', wait_ms)
-    with self._lock:
-      if not self._free:
-        return None
-      thread = self._free.pop()
-      self._busy.append(thread)
+  def _StartThreadLocked(self):
+    self._num_threads += 1
+    t = threadlib.Thread(target=self._Work)
+    t.daemon = True
+    t.name = 'ThreadPool_ExecutorThread'
+    self._threads.add(t)
+    t.start()
+
+  def _MaybeGrowLocked(self, now):
+    if self._num_idle or self._num_threads >= self._max_size:
+      return
+    if now - self._tasks[0][2] <= self._target_wait_secs:
+      return
+    if now - self._last_grow < self._target_wait_secs:
+      return
+    self._last_grow = now
+    self._StartThreadLocked()
+    event_collection.Increment('%s-threads-grown' % (self._name,))
+    logging.debug('%s grew to %d threads', self._name, self._num_threads)
 
-    return thread
+  def _HasBacklogLocked(self):
+    return (self._tasks and not self._num_idle and not self._shutdown and
+            self._num_threads < self._max_size)
 
-  def _ReturnThreadToPool(self, thread):
+  def _WatchBacklogLocked(self, now):
+    self._MaybeGrowLocked(now)
+    if self._monitoring or not self._HasBacklogLocked():
+      return
+    self._monitoring = True
+    t = threadlib.Thread(target=self._Monitor)
+    t.daemon = True
+    t.name = 'ThreadPool_Monitor'
+    self._threads.add(t)
+    t.start()
+
+  def _Monitor(self):
     with self._lock:
-      self._busy.remove(thread)
-      self._free.append(thread)
-    self._sem.release()
+      while self._HasBacklogLocked():
+        now = time.time()
+        self._MaybeGrowLocked(now)
+        next_check = (max(self._tasks[0][2], self._last_grow) +
+                      self._target_wait_secs)
+        self._monitor_cond.wait(max(next_check - now, 0) + 0.001)
+      self._monitoring = False
+      self._threads.discard(threading.current_thread())
+
+  def _WaitForTaskLocked(self):
+    """Returns the next task, or None if this thread should exit."""
+    idle_since = time.time()
+    while not self._tasks:
+      if self._shutdown:
+        return None
+      if self._num_surplus_waiting >= self._num_threads - self._size:
+        # _NotifyLocked takes this thread off _num_waiting when it wakes it.
+        self._num_waiting += 1
+        self._cond.wait()
+        continue
+      remaining = idle_since + self._idle_timeout_secs - time.time()
+      if remaining <= 0:
+        event_collection.Increment('%s-threads-shrunk' % (self._name,))
+        logging.debug('%s shrank to %d threads', self._name,
+                      self._num_threads - 1)
+        return None
+      self._num_surplus_waiting += 1
+      self._surplus_cond.wait(remaining)
+      self._num_surplus_waiting -= 1
+    return self._tasks.popleft()
+
+  def _NotifyLocked(self):
+    if self._num_waiting:
+      self._num_waiting -= 1
+      self._cond.notify()
+    else:
+      self._surplus_cond.notify()
 
-  def _RunTasksInThread(self):
+  def _Work(self):
     while True:
-      task = self._queue.get()
+      with self._lock:
+        self._num_idle += 1
+        task = self._WaitForTaskLocked()
+        self._num_idle -= 1
+        if task is None:
+          self._num_threads -= 1
+          self._threads.discard(threading.current_thread())
+          return
+        now = time.time()
+        if self._tasks:
+          self._WatchBacklogLocked(now)
 
-      thread = self._GetThreadFromPool()
-      thread.task = task
-      thread.event.set()
+      closure, future, queued_at = task
+      wait_ms = int((now - queued_at) * 1000)
+      event_collection.Add('%s-queue-wait-ms' % (self._name,), wait_ms)
+      try:
+        future._Run(closure)
+      except BaseException:
+        # closure raised e.g. SystemExit. Let this thread exit as asked, but
+        # keep the pool at its size.
+        with self._lock:
+          self._num_threads -= 1
+          self._threads.discard(threading.current_thread())
+          if not self._shutdown and self._num_threads < self._size:
+            self._StartThreadLocked()
+        raise
 
   def _CreateThreads(self):
-    debuglog.Log('Creating %d threads', self._size)
-    event_collection.Set('executor-threads-total', self._size)
-    for i in xrange(self._size):
-      t = ExecutorThread()
-
-      t.daemon = True
-      t.name = 'ThreadPool_ExecutorThread'
-      t.event = threading.Event()
-      t.returncb = self._ReturnThreadToPool
-      t.shutdown = False
-      t.task = None
-      t.start()
-
-      self._free.append(t)
-
-    self._manager = threadlib.Thread(target=self._RunTasksInThread)
-    self._manager.daemon = True
-    self._manager.name = 'ThreadPool_Manager'
-    self._manager.start()
-
-  def RunTask(self, closure, donecb):
-    event_collection.Increment('executor-tasks-run')
-    if closure is None or donecb is None:
-      raise TypeError('closure and donecb must not be None')
-
-    self._queue.put((closure, donecb))
-
-  def Shutdown(self):
+    logging.debug('Creating %d threads', self._size)
     with self._lock:
-      all_threads = self._busy + self._free
+      for i in xrange(self._size):
+        self._StartThreadLocked()
 
-    for thread in all_threads:
-      thread.shutdown = True
-      thread.event.set()
+  def RunTask(self, closure, donecb=None):
+    """Queues closure to run on a worker and returns its Future.
 
+    If given, donecb is called on the worker with the Future once closure
+    has returned or raised, as with Future.AddDoneCallback.
+    """
+    if closure is None:
+      raise TypeError('closure must not be None')
+    event_collection.Increment('%s-tasks-run' % (self._name,))
 
-class ExecutorThread(threadlib.Thread):
-  def __init__(self):
-    super(ExecutorThread, self).__init__()
-
-  def run(self):
-    while True:
-      self.event.wait()
-      self.event.clear()
-
-      if self.shutdown:
-        return
-
-      closure, donecb = self.task
+    future = Future()
+    if donecb is not None:
+      future.AddDoneCallback(donecb)
+    with self._lock:
+      if self._shutdown:
+        raise RuntimeError('ThreadPool is shut down')
+      now = time.time()
+      self._tasks.append((closure, future, now))
+      self._WatchBacklogLocked(now)
+      self._NotifyLocked()
+    return future
 
-      result = closure()
-      donecb(result)
-      self.returncb(self)
+  def Shutdown(self, wait=False):
+    """Stops the workers once the tasks already queued have run.
 
-  def Name(self):
-    return '%s/%s' % (self.name, self.tid)
+    With wait, also waits for them to exit, except for the calling thread if
+    it is one of them. The pool's event_collection callbacks are removed.
+    """
+    self._UnregisterEventCallbacks()
+    with self._lock:
+      self._shutdown = True
+      self._num_waiting = 0
+      self._cond.notify_all()
+      self._surplus_cond.notify_all()
+      self._monitor_cond.notify_all()
+      threads = list(self._threads)
+    if wait:
+      for t in threads:
+        if t is not threading.current_thread():
+          t.join()
@@ -1,9 +1,18 @@
 #!/usr/bin/python -B
 
+import Queue
+import gflags
 import os
+import sys
 import threading
 import time
+import unittest
+
 from projects.lib.concurrency import threadlib
+from projects.lib.concurrency import threadpool
+
+
+FLAGS = gflags.FLAGS
 
 
 class T1(threadlib.Thread):
@@ -21,7 +30,8 @@ def DumpThreads():
     print '%s  pid: %s  tid: %s' % (t.name, os.getpid(), tid)
 
 
-def main():
+def Demo():
+  """Prints the pool's threads and their kernel thread ids."""
   DumpThreads()
 
   t1 = T1()
@@ -35,5 +45,192 @@ def main():
   t1.join()
 
 
+def Benchmark(num_tasks=50000):
+  """Prints ThreadPool throughput and round trip time for empty tasks."""
+  for size in (1, 4, 16):
+    pool = threadpool.ThreadPool(size=size)
+    start = time.time()
+    futures = [pool.RunTask(lambda: None) for _ in xrange(num_tasks)]
+    for future in futures:
+      future.Result()
+    throughput = num_tasks / (time.time() - start)
+
+    results = Queue.Queue()
+    start = time.time()
+    for _ in xrange(num_tasks / 10):
+      pool.RunTask(lambda: None, results.put)
+      results.get()
+    round_trip_us = (time.time() - start) / (num_tasks / 10) * 1e6
+    pool.Shutdown()
+    print 'threads: %2d  %8.0f tasks/s  %6.1f us round trip' % (
+        size, throughput, round_trip_us)
+
+
+def Fail():
+  raise ValueError('expected')
+
+
+class FutureTest(unittest.TestCase):
+
+  def setUp(self):
+    self.pool = threadpool.ThreadPool(size=2, name='threadpool-test')
+
+  def tearDown(self):
+    self.pool.Shutdown(wait=True)
+
+  def testResult(self):
+    future = self.pool.RunTask(lambda: 42)
+    self.assertEqual(42, future.Result(2))
+    self.assertTrue(future.Done())
+    self.assertEqual(None, future.Exception())
+    self.assertEqual(None, future.ExcInfo())
+
+  def testException(self):
+    future = self.pool.RunTask(Fail)
+    self.assertRaises(ValueError, future.Result, 2)
+    self.assertTrue(isinstance(future.Exception(), ValueError))
+    exc_type, exc_value, exc_tb = future.ExcInfo()
+    self.assertEqual(ValueError, exc_type)
+    self.assertTrue(exc_value is future.Exception())
+    self.assertTrue(exc_tb is not None)
+
+  def testAddDoneCallbackAfterCompletion(self):
+    future = self.pool.RunTask(lambda: 'done')
+    future.Wait(2)
+    called = []
+    future.AddDoneCallback(called.append)
+    self.assertEqual([future], called)
+
+  def testAddDoneCallbackBeforeCompletion(self):
+    release = threading.Event()
+    future = self.pool.RunTask(release.wait)
+    called = Queue.Queue()
+    future.AddDoneCallback(called.put)
+    self.assertTrue(called.empty())
+    release.set()
+    self.assertTrue(called.get(timeout=2) is future)
+
+  def testWaitTimeout(self):
+    release = threading.Event()
+    future = self.pool.RunTask(release.wait)
+    self.assertFalse(future.Wait(0.05))
+    self.assertFalse(future.Done())
+    self.assertRaises(RuntimeError, future.Result, 0.05)
+    self.assertRaises(RuntimeError, future.Exception, 0.05)
+    release.set()
+    self.assertTrue(future.Wait(2))
+
+  def testDoneCbGetsFuture(self):
+    results = Queue.Queue()
+    future = self.pool.RunTask(lambda: 7, results.put)
+    self.assertTrue(results.get(timeout=2) is future)
+    self.assertEqual(7, future.Result())
+
+  def testDoneCbCalledWhenTaskRaises(self):
+    results = Queue.Queue()
+    self.pool.RunTask(Fail, results.put)
+    future = results.get(timeout=2)
+    self.assertTrue(isinstance(future.Exception(), ValueError))
+
+  def testSystemExitResolvesFuture(self):
+    exited = []
+
+    def Exit():
+      exited.append(threading.current_thread())
+      sys.exit(3)
+
+    future = self.pool.RunTask(Exit)
+    self.assertRaises(SystemExit, future.Result, 2)
+    # The worker exits, as asked, and is replaced.
+    exited[0].join(2)
+    self.assertFalse(exited[0].is_alive())
+    self.assertEqual(2, self.pool.GetNumThreads())
+    self.assertNotIn(exited[0], self.pool._threads)
+    self.assertEqual(1, self.pool.RunTask(lambda: 1).Result(2))
+
+
+class ThreadPoolTest(unittest.TestCase):
+
+  def testMaxSizeDefaultsToSize(self):
+    pool = threadpool.ThreadPool(size=3, name='threadpool-test')
+    self.assertEqual(3, pool._max_size)
+    pool.Shutdown(wait=True)
+
+  def testGrowsWhileWorkersAreBlocked(self):
+    pool = threadpool.ThreadPool(size=1, max_size=4, target_wait_ms=10,
+                                 name='threadpool-test')
+    release = threading.Event()
+    futures = [pool.RunTask(release.wait) for _ in xrange(20)]
+    deadline = time.time() + 2
+    while pool.GetNumThreads() < 4 and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(4, pool.GetNumThreads())
+    self.assertEqual(16, pool.GetNumQueued())
+
+    release.set()
+    for future in futures:
+      self.assertTrue(future.Wait(2))
+    pool.Shutdown(wait=True)
+    self.assertEqual(0, pool.GetNumThreads())
+
+  def testShrinksAfterIdleTimeout(self):
+    pool = threadpool.ThreadPool(size=1, max_size=3, target_wait_ms=10,
+                                 idle_timeout_secs=0.2, name='threadpool-test')
+    release = threading.Event()
+    futures = [pool.RunTask(release.wait) for _ in xrange(10)]
+    deadline = time.time() + 2
+    while pool.GetNumThreads() < 3 and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(3, pool.GetNumThreads())
+    release.set()
+    for future in futures:
+      self.assertTrue(future.Wait(2))
+
+    # Still above size until the surplus threads have been idle long enough.
+    self.assertEqual(3, pool.GetNumThreads())
+    deadline = time.time() + 2
+    while pool.GetNumThreads() > 1 and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(1, pool.GetNumThreads())
+    self.assertEqual(42, pool.RunTask(lambda: 42).Result(2))
+    pool.Shutdown(wait=True)
+
+  def testIdleThreadsPickUpTasksPromptly(self):
+    pool = threadpool.ThreadPool(size=2, max_size=4, target_wait_ms=10,
+                                 idle_timeout_secs=60, name='threadpool-test')
+    release = threading.Event()
+    futures = [pool.RunTask(release.wait) for _ in xrange(8)]
+    deadline = time.time() + 2
+    while pool.GetNumThreads() < 4 and time.time() < deadline:
+      time.sleep(0.01)
+    release.set()
+    for future in futures:
+      self.assertTrue(future.Wait(2))
+    time.sleep(0.05)
+
+    # Two threads above size are idle, waiting with a timeout.
+    for _ in xrange(20):
+      start = time.time()
+      pool.RunTask(lambda: None).Wait()
+      self.assertLess(time.time() - start, 0.01)
+    pool.Shutdown(wait=True)
+
+  def testBoundedPoolDoesNotGrow(self):
+    pool = threadpool.ThreadPool(size=2, target_wait_ms=10,
+                                 name='threadpool-test')
+    release = threading.Event()
+    futures = [pool.RunTask(release.wait) for _ in xrange(10)]
+    time.sleep(0.1)
+    self.assertEqual(2, pool.GetNumThreads())
+    release.set()
+    for future in futures:
+      self.assertTrue(future.Wait(2))
+    pool.Shutdown(wait=True)
+
+
 if __name__ == '__main__':
-  main()
+  FLAGS(sys.argv[:1])
+  if sys.argv[1:] == ['benchmark']:
+    Benchmark()
+  else:
+    unittest.main()
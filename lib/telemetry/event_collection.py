@@ -22,6 +22,11 @@ def Set(key, value):
     EVENTS[key] = value
 
 
+def Remove(key):
+  with LOCK:
+    EVENTS.pop(key, None)
+
+
 def Get(key):
   with LOCK:
     return EVENTS.get(key)
@@ -42,3 +47,9 @@ def GetEvents():
 def AddCallback(key, cb):
   with LOCK:
     CALLBACKS.append((key, cb))
+
+
+def RemoveCallback(key, cb):
+  """Removes a callback added with AddCallback(key, cb)."""
+  with LOCK:
+    CALLBACKS[:] = [(k, c) for k, c in CALLBACKS if (k, c) != (key, cb)]
@@ -0,0 +1,83 @@
+import bisect
+import threading
+
+from projects.lib.telemetry import event_collection
+
+
+# Bucket upper bounds suited to latencies measured in milliseconds.
+DEFAULT_MS_BOUNDS = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Histogram(object):
+  """Fixed-bucket histogram exported to event_collection as `name`.
+
+  A value v is counted in the first bucket whose upper bound is >= v; values
+  above the last bound fall in an overflow bucket. Percentiles are reported as
+  the upper bound of the bucket they fall in, so they are accurate to the
+  bucket width.
+  """
+
+  def __init__(self, name, bounds=DEFAULT_MS_BOUNDS):
+    self._bounds = tuple(bounds)
+    self._counts = [0] * (len(self._bounds) + 1)
+    self._count = 0
+    self._sum = 0
+    self._max = None
+    self._lock = threading.Lock()
+    self._name = name
+    event_collection.AddCallback(name, self.Snapshot)
+
+  def Unregister(self):
+    """Stops exporting the histogram, e.g. when its owner goes away."""
+    event_collection.RemoveCallback(self._name, self.Snapshot)
+
+  def Add(self, value):
+    i = bisect.bisect_left(self._bounds, value)
+    with self._lock:
+      self._counts[i] += 1
+      self._count += 1
+      self._sum += value
+      if self._max is None or value > self._max:
+        self._max = value
+
+  def Count(self):
+    with self._lock:
+      return self._count
+
+  def _PercentileLocked(self, pct):
+    if not self._count:
+      return None
+    rank = pct / 100.0 * self._count
+    seen = 0
+    for i, count in enumerate(self._counts):
+      seen += count
+      if seen >= rank:
+        if i < len(self._bounds):
+          return self._bounds[i]
+        return self._max
+    return self._max
+
+  def Percentile(self, pct):
+    with self._lock:
+      return self._PercentileLocked(pct)
+
+  def Snapshot(self):
+    with self._lock:
+      buckets = {}
+      for i, count in enumerate(self._counts):
+        if not count:
+          continue
+        if i < len(self._bounds):
+          buckets['<=%s' % (self._bounds[i],)] = count
+        else:
+          buckets['>%s' % (self._bounds[-1],)] = count
+      return {
+          'count': self._count,
+          'sum': self._sum,
+          'max': self._max,
+          'p50': self._PercentileLocked(50),
+          'p90': self._PercentileLocked(90),
+          'p99': self._PercentileLocked(99),
+          'buckets': buckets,
+      }
@@ -1,19 +1,296 @@
+import collections
+import cPickle
+import sqlite3
+import sys
+import threading
 import time
+import zlib
+
+from projects.lib.telemetry import event_collection
+
+
+def PickledSize(obj):
+  """Returns the size of obj pickled, as an estimate of its deep size.
+
+  sys.getsizeof counts only the outer object, so a dict of quotes looks the
+  same size whatever it holds.
+  """
+  return len(cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL))
+
+
+class _Entry(object):
+  __slots__ = ('obj', 'expiry', 'size')
+
+  def __init__(self, obj, expiry, size):
+    self.obj = obj
+    self.expiry = expiry
+    self.size = size
+
+
+class _Load(object):
+  """A load of one key that concurrent misses on that key wait for."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.obj = None
+    self.exc_info = None
+
 
 class WriteThruCache(object):
-  def __init__(self, lifetime_secs):
-    self._cache = dict()
+  """Thread-safe cache that loads missing or expired keys through a callback.
+
+  Entries expire `lifetime_secs` after they are loaded, unless Get() is given
+  a lifetime of its own for the key. The cache may be bounded by entry count,
+  by total size in bytes as measured by `sizeof` (by default PickledSize),
+  or both; when a bound is exceeded the least recently used entries are
+  evicted.
+  Expired entries are dropped when they are looked up, and the whole cache is
+  swept for expired entries at most once every `sweep_interval_secs` during a
+  Get(). Sweep() may also be called directly, e.g. from a PeriodicTask.
+
+  Concurrent misses on the same key are coalesced: the first caller runs
+  update_func and the others wait for its result (or its exception) instead of
+  issuing their own load.
+
+  Hits, misses, coalesced misses, evictions, expirations and cumulative load
+  time are published to event_collection under cache-<name>-*.
+  """
+
+  def __init__(self, lifetime_secs, max_entries=None, max_bytes=None,
+               sizeof=PickledSize, sweep_interval_secs=60, name='writethru'):
+    self._cache = collections.OrderedDict()
     self._lifetime = lifetime_secs
+    self._max_entries = max_entries
+    self._max_bytes = max_bytes
+    # Sizes are only needed to enforce max_bytes.
+    if max_bytes is None:
+      self._sizeof = lambda obj: 0
+    else:
+      self._sizeof = sizeof
+    self._sweep_interval = sweep_interval_secs
+    self._next_sweep = time.time() + sweep_interval_secs
+    self._bytes = 0
+    self._loading = {}
+    self._lock = threading.Lock()
+    self._name = name
+    self._RegisterEventCallbacks()
+
+  def _RegisterEventCallbacks(self):
+    event_collection.AddCallback(self._EventKey('entries'), self.NumEntries)
+    event_collection.AddCallback(self._EventKey('bytes'), self.NumBytes)
+
+  def UnregisterEventCallbacks(self):
+    event_collection.RemoveCallback(self._EventKey('entries'), self.NumEntries)
+    event_collection.RemoveCallback(self._EventKey('bytes'), self.NumBytes)
+
+  def _EventKey(self, event):
+    return 'cache-%s-%s' % (self._name, event)
+
+  def NumEntries(self):
+    with self._lock:
+      return len(self._cache)
+
+  def NumBytes(self):
+    with self._lock:
+      return self._bytes
+
+  def Get(self, key, update_func, lifetime_secs=None):
+    if lifetime_secs is None:
+      lifetime_secs = self._lifetime
+
+    now = time.time()
+    with self._lock:
+      if now > self._next_sweep:
+        self._SweepLocked(now)
+
+      entry = self._cache.pop(key, None)
+      if entry is not None:
+        if entry.expiry > now:
+          # Re-insert to mark the entry as most recently used.
+          self._cache[key] = entry
+          event_collection.Increment(self._EventKey('hits'))
+          return entry.obj
+        self._bytes -= entry.size
+        event_collection.Increment(self._EventKey('expirations'))
+
+      event_collection.Increment(self._EventKey('misses'))
+      load = self._loading.get(key)
+      if load is None:
+        load = _Load()
+        self._loading[key] = load
+        owner = True
+      else:
+        owner = False
+
+    if owner:
+      self._RunLoad(key, load, update_func, lifetime_secs)
+    else:
+      event_collection.Increment(self._EventKey('coalesced'))
+      load.done.wait()
+
+    if load.exc_info is not None:
+      raise load.exc_info[0], load.exc_info[1], load.exc_info[2]
+    return load.obj
+
+  def _RunLoad(self, key, load, update_func, lifetime_secs):
+    start = time.time()
+    # Whatever happens here, the waiters must be woken.
+    try:
+      try:
+        load.obj = update_func()
+        # Sized outside the lock: sizeof may pickle the whole value.
+        size = self._sizeof(load.obj)
+      except Exception:
+        load.exc_info = sys.exc_info()
+      except BaseException:
+        # KeyboardInterrupt or SystemExit propagates from this caller; the
+        # waiters get an error instead.
+        error = RuntimeError('Load of %r was interrupted' % (key,))
+        load.exc_info = (RuntimeError, error, None)
+        raise
+      finally:
+        load_ms = int((time.time() - start) * 1000)
+        event_collection.Increment(self._EventKey('loads'))
+        event_collection.Add(self._EventKey('load-ms'), load_ms)
+
+        with self._lock:
+          del self._loading[key]
+          if load.exc_info is None:
+            self._PutLocked(key, load.obj, lifetime_secs, size)
+    finally:
+      load.done.set()
+
+  def _PutLocked(self, key, obj, lifetime_secs, size):
+    entry = _Entry(obj, time.time() + lifetime_secs, size)
+    self._cache[key] = entry
+    self._bytes += entry.size
+    self._EvictLocked()
+
+  def _EvictLocked(self):
+    while self._cache and (
+        (self._max_entries is not None
+         and len(self._cache) > self._max_entries) or
+        (self._max_bytes is not None and self._bytes > self._max_bytes)):
+      _, entry = self._cache.popitem(last=False)
+      self._bytes -= entry.size
+      event_collection.Increment(self._EventKey('evictions'))
+
+  def _SweepLocked(self, now):
+    expired = [k for k, entry in self._cache.iteritems() if entry.expiry <= now]
+    for key in expired:
+      self._bytes -= self._cache.pop(key).size
+    if expired:
+      event_collection.Add(self._EventKey('expirations'), len(expired))
+    self._next_sweep = now + self._sweep_interval
+
+  def Sweep(self):
+    with self._lock:
+      self._SweepLocked(time.time())
+
+  def Invalidate(self, key):
+    with self._lock:
+      entry = self._cache.pop(key, None)
+      if entry is not None:
+        self._bytes -= entry.size
+
+
+class DiskCache(object):
+  """Persistent write-through cache for values that never change.
+
+  Values are pickled, zlib-compressed and stored in a sqlite database at
+  `path`, which is read through a memory map of up to `mmap_bytes`. There is
+  no expiry: once a key is stored it is served from disk until it is evicted
+  to keep the total compressed size under `max_bytes`, least recently read
+  first.
+
+  Hits, misses, evictions and bytes read and written are published to
+  event_collection under diskcache-<name>-*.
+  """
+
+  # Eviction frees space down to this fraction of max_bytes so that it runs
+  # in batches rather than on every write once the cache is full.
+  _EVICT_TO = 0.9
+
+  def __init__(self, path, max_bytes, mmap_bytes=256 * 1024 * 1024,
+               name='disk'):
+    self._max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self._name = name
+
+    self._db = sqlite3.connect(
+        path, check_same_thread=False, isolation_level=None)
+    self._db.execute('PRAGMA journal_mode=WAL')
+    self._db.execute('PRAGMA synchronous=NORMAL')
+    self._db.execute('PRAGMA mmap_size=%d' % (mmap_bytes,))
+    self._db.execute(
+        'CREATE TABLE IF NOT EXISTS entries ('
+        '  key TEXT PRIMARY KEY,'
+        '  value BLOB NOT NULL,'
+        '  size INTEGER NOT NULL,'
+        '  atime REAL NOT NULL)')
+    self._db.execute(
+        'CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+    self._bytes = self._db.execute(
+        'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    event_collection.AddCallback(self._EventKey('bytes'), self.NumBytes)
+
+  def _EventKey(self, event):
+    return 'diskcache-%s-%s' % (self._name, event)
+
+  def NumBytes(self):
+    with self._lock:
+      return self._bytes
 
   def Get(self, key, update_func):
-    if key in self._cache:
-      obj, expiry = self._cache.get(key)
-      if expiry > time.time():
-        return obj
+    with self._lock:
+      row = self._db.execute(
+          'SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+      if row is not None:
+        self._db.execute(
+            'UPDATE entries SET atime = ? WHERE key = ?', (time.time(), key))
 
-    obj = update_func()
+    if row is not None:
+      blob = row[0]
+      event_collection.Increment(self._EventKey('hits'))
+      event_collection.Add(self._EventKey('bytes-read'), len(blob))
+      return cPickle.loads(zlib.decompress(blob))
 
-    expiry = time.time() + self._lifetime
-    self._cache[key] = (obj, expiry)
+    event_collection.Increment(self._EventKey('misses'))
+    obj = update_func()
+    self._Put(key, obj)
     return obj
 
+  def _Put(self, key, obj):
+    blob = zlib.compress(cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL))
+    with self._lock:
+      row = self._db.execute(
+          'SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+      if row is not None:
+        self._bytes -= row[0]
+      self._db.execute(
+          'INSERT OR REPLACE INTO entries (key, value, size, atime) '
+          'VALUES (?, ?, ?, ?)',
+          (key, sqlite3.Binary(blob), len(blob), time.time()))
+      self._bytes += len(blob)
+      if self._bytes > self._max_bytes:
+        self._EvictLocked()
+    event_collection.Add(self._EventKey('bytes-written'), len(blob))
+
+  def _EvictLocked(self):
+    target = self._max_bytes * self._EVICT_TO
+    victims = []
+    for key, size in self._db.execute(
+        'SELECT key, size FROM entries ORDER BY atime'):
+      if self._bytes <= target:
+        break
+      victims.append((key,))
+      self._bytes -= size
+
+    self._db.executemany('DELETE FROM entries WHERE key = ?', victims)
+    event_collection.Add(self._EventKey('evictions'), len(victims))
+
+  def Close(self):
+    event_collection.RemoveCallback(self._EventKey('bytes'), self.NumBytes)
+    with self._lock:
+      self._db.close()
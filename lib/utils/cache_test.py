@@ -0,0 +1,210 @@
+#!/usr/bin/python -B
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from projects.lib.utils import cache
+
+
+class Loader(object):
+  """update_func that counts its calls and can be held until released."""
+
+  def __init__(self, value='value', hold=False):
+    self.value = value
+    self.calls = 0
+    self.started = threading.Event()
+    self.release = threading.Event()
+    if not hold:
+      self.release.set()
+
+  def __call__(self):
+    self.calls += 1
+    self.started.set()
+    self.release.wait()
+    if isinstance(self.value, Exception):
+      raise self.value
+    return self.value
+
+
+class WriteThruCacheTest(unittest.TestCase):
+
+  def _Cache(self, **kwargs):
+    kwargs.setdefault('lifetime_secs', 60)
+    return cache.WriteThruCache(name='cache-test', **kwargs)
+
+  def _GetAll(self, c, key, loader, num_threads):
+    results = []
+
+    def Get():
+      try:
+        results.append(c.Get(key, loader))
+      except Exception as e:
+        results.append(e)
+
+    threads = [threading.Thread(target=Get) for _ in xrange(num_threads)]
+    for t in threads:
+      t.start()
+    return threads, results
+
+  def testHit(self):
+    c = self._Cache()
+    loader = Loader()
+    self.assertEqual('value', c.Get('k', loader))
+    self.assertEqual('value', c.Get('k', loader))
+    self.assertEqual(1, loader.calls)
+
+  def testConcurrentMissesAreCoalesced(self):
+    c = self._Cache()
+    loader = Loader(hold=True)
+    threads, results = self._GetAll(c, 'k', loader, 8)
+    self.assertTrue(loader.started.wait(2))
+    time.sleep(0.05)
+    loader.release.set()
+    for t in threads:
+      t.join(2)
+    self.assertEqual(1, loader.calls)
+    self.assertEqual(['value'] * 8, results)
+
+  def testWaitersGetTheLoadError(self):
+    c = self._Cache()
+    loader = Loader(ValueError('expected'), hold=True)
+    threads, results = self._GetAll(c, 'k', loader, 4)
+    self.assertTrue(loader.started.wait(2))
+    time.sleep(0.05)
+    loader.release.set()
+    for t in threads:
+      t.join(2)
+    self.assertEqual(1, loader.calls)
+    self.assertTrue(all(isinstance(r, ValueError) for r in results), results)
+    # Errors are not cached.
+    loader.value = 'value'
+    self.assertEqual('value', c.Get('k', loader))
+
+  def testWaitersWokenWhenSizeofFails(self):
+    def Sizeof(obj):
+      raise TypeError('unsizeable')
+
+    c = self._Cache(max_bytes=100, sizeof=Sizeof)
+    loader = Loader(hold=True)
+    threads, results = self._GetAll(c, 'k', loader, 4)
+    self.assertTrue(loader.started.wait(2))
+    time.sleep(0.05)
+    loader.release.set()
+    for t in threads:
+      t.join(2)
+      self.assertFalse(t.is_alive())
+    self.assertTrue(all(isinstance(r, TypeError) for r in results), results)
+    self.assertEqual(0, c.NumEntries())
+
+  def testLeastRecentlyUsedIsEvicted(self):
+    c = self._Cache(max_entries=2)
+    c.Get('a', Loader('a'))
+    c.Get('b', Loader('b'))
+    c.Get('a', Loader('unused'))  # a is now more recent than b.
+    c.Get('c', Loader('c'))
+    self.assertEqual(2, c.NumEntries())
+    loader = Loader('b2')
+    self.assertEqual('b2', c.Get('b', loader))
+    self.assertEqual(1, loader.calls)
+    self.assertEqual('c', c.Get('c', Loader('unused')))
+
+  def testEvictsBySize(self):
+    c = self._Cache(max_bytes=10, sizeof=len)
+    c.Get('a', Loader('x' * 4))
+    c.Get('b', Loader('x' * 4))
+    self.assertEqual(8, c.NumBytes())
+    c.Get('c', Loader('x' * 4))
+    self.assertEqual(2, c.NumEntries())
+    self.assertEqual(8, c.NumBytes())
+
+  def testEntriesExpire(self):
+    c = self._Cache(lifetime_secs=0.05)
+    loader = Loader()
+    c.Get('k', loader)
+    c.Get('k', loader)
+    self.assertEqual(1, loader.calls)
+    time.sleep(0.1)
+    c.Get('k', loader)
+    self.assertEqual(2, loader.calls)
+
+  def testLifetimePerKey(self):
+    c = self._Cache(lifetime_secs=0.05)
+    loader = Loader()
+    c.Get('k', loader, lifetime_secs=60)
+    time.sleep(0.1)
+    c.Get('k', loader)
+    self.assertEqual(1, loader.calls)
+
+  def testSweep(self):
+    c = self._Cache(lifetime_secs=0.05, max_bytes=100, sizeof=len)
+    c.Get('a', Loader('abc'))
+    c.Get('b', Loader('abc'), lifetime_secs=60)
+    time.sleep(0.1)
+    c.Sweep()
+    self.assertEqual(1, c.NumEntries())
+    self.assertEqual(3, c.NumBytes())
+
+  def testInvalidate(self):
+    c = self._Cache()
+    loader = Loader()
+    c.Get('k', loader)
+    c.Invalidate('k')
+    c.Get('k', loader)
+    self.assertEqual(2, loader.calls)
+
+
+class DiskCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'cache.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testRoundTrip(self):
+    c = cache.DiskCache(self.path, 1024 * 1024, name='cache-test')
+    value = {'bars': [1.5, 2.5], 'symbol': 'VRX'}
+    self.assertEqual(value, c.Get('k', Loader(value)))
+    loader = Loader('unused')
+    self.assertEqual(value, c.Get('k', loader))
+    self.assertEqual(0, loader.calls)
+    c.Close()
+
+  def testPersistsAcrossOpens(self):
+    c = cache.DiskCache(self.path, 1024 * 1024, name='cache-test')
+    c.Get('k', Loader([1, 2, 3]))
+    c.Close()
+
+    c = cache.DiskCache(self.path, 1024 * 1024, name='cache-test')
+    self.assertGreater(c.NumBytes(), 0)
+    loader = Loader('unused')
+    self.assertEqual([1, 2, 3], c.Get('k', loader))
+    self.assertEqual(0, loader.calls)
+    c.Close()
+
+  def testEvictsLeastRecentlyRead(self):
+    # Random bytes don't compress, so each value takes about 1000 bytes.
+    values = dict((key, os.urandom(1000)) for key in 'abc')
+    c = cache.DiskCache(self.path, 2500, name='cache-test')
+    c.Get('a', Loader(values['a']))
+    time.sleep(0.01)
+    c.Get('b', Loader(values['b']))
+    time.sleep(0.01)
+    c.Get('a', Loader('unused'))
+    time.sleep(0.01)
+    c.Get('c', Loader(values['c']))
+    self.assertLessEqual(c.NumBytes(), 2500)
+
+    loader = Loader(values['b'])
+    c.Get('b', loader)
+    self.assertEqual(1, loader.calls)
+    c.Close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,247 @@
+import bisect
+import collections
+import threading
+import time
+
+from projects.lib.base import logging
+from projects.lib.telemetry import event_collection
+
+
+ABOVE = 'above'
+BELOW = 'below'
+
+# What a rule's level is compared against.
+PRICE = 'price'
+PROFIT = 'profit'
+
+# Symbol of profit rules on the whole portfolio rather than one position.
+PORTFOLIO = None
+
+Rule = collections.namedtuple('Rule', [
+    'name',
+    'kind',
+    'symbol',
+    'direction',
+    'level',
+    'hysteresis',
+])
+
+Alert = collections.namedtuple('Alert', ['rule', 'value', 'timestamp'])
+
+
+def PriceRule(name, symbol, direction, level, hysteresis=0.0):
+  """Fires when symbol's price crosses level in the given direction."""
+  return Rule(name, PRICE, symbol, direction, level, hysteresis)
+
+
+def PercentChangeRule(name, symbol, percent, reference, hysteresis=0.0):
+  """Fires when symbol's price moves `percent` from a reference price.
+
+  The direction follows the sign of percent. hysteresis is also in percent
+  of the reference price.
+  """
+  direction = ABOVE if percent > 0 else BELOW
+  level = reference * (1 + percent / 100.0)
+  return Rule(name, PRICE, symbol, direction, level,
+              reference * hysteresis / 100.0)
+
+
+def ProfitRule(name, direction, level, symbol=PORTFOLIO, hysteresis=0.0):
+  """Fires when the profit of a position, or the portfolio, crosses level."""
+  return Rule(name, PROFIT, symbol, direction, level, hysteresis)
+
+
+class _Levels(object):
+  """Rules with one key and direction, split into armed and disarmed.
+
+  Armed rules are sorted by the value at which they fire, disarmed rules by
+  the value at which they re-arm, so both checks are a bisect and the rules
+  returned are a contiguous slice.
+  """
+
+  def __init__(self, direction):
+    self._above = direction == ABOVE
+    self._armed_at = []
+    self._armed = []
+    self._rearm_at = []
+    self._disarmed = []
+
+  def __len__(self):
+    return len(self._armed) + len(self._disarmed)
+
+  def _Arm(self, rule):
+    i = bisect.bisect(self._armed_at, rule.level)
+    self._armed_at.insert(i, rule.level)
+    self._armed.insert(i, rule)
+
+  def _Disarm(self, rule):
+    if self._above:
+      rearm_at = rule.level - rule.hysteresis
+    else:
+      rearm_at = rule.level + rule.hysteresis
+    i = bisect.bisect(self._rearm_at, rearm_at)
+    self._rearm_at.insert(i, rearm_at)
+    self._disarmed.insert(i, rule)
+
+  def Add(self, rule, value):
+    """Adds rule; it starts disarmed if value is already past its level."""
+    if value is None:
+      self._Arm(rule)
+    elif self._above and value >= rule.level:
+      self._Disarm(rule)
+    elif not self._above and value <= rule.level:
+      self._Disarm(rule)
+    else:
+      self._Arm(rule)
+
+  def Remove(self, name):
+    for at, rules in ((self._armed_at, self._armed),
+                      (self._rearm_at, self._disarmed)):
+      for i, rule in enumerate(rules):
+        if rule.name == name:
+          del at[i]
+          del rules[i]
+          return True
+    return False
+
+  def Update(self, value):
+    """Returns the rules that fire at value and re-arms those past it."""
+    if self._above:
+      i = bisect.bisect_right(self._armed_at, value)
+      fired = self._armed[:i]
+      del self._armed_at[:i], self._armed[:i]
+      j = bisect.bisect_right(self._rearm_at, value)
+      rearmed = self._disarmed[j:]
+      del self._rearm_at[j:], self._disarmed[j:]
+    else:
+      i = bisect.bisect_left(self._armed_at, value)
+      fired = self._armed[i:]
+      del self._armed_at[i:], self._armed[i:]
+      j = bisect.bisect_left(self._rearm_at, value)
+      rearmed = self._disarmed[:j]
+      del self._rearm_at[:j], self._disarmed[:j]
+
+    for rule in rearmed:
+      self._Arm(rule)
+    for rule in fired:
+      self._Disarm(rule)
+    return fired
+
+
+def _LogAlert(alert):
+  logging.warning('alert %s: %s %s %s %s (now %s)', alert.rule.name,
+                  alert.rule.symbol, alert.rule.kind, alert.rule.direction,
+                  alert.rule.level, alert.value)
+
+
+class AlertEngine(object):
+  """Evaluates threshold rules against streamed ticks.
+
+  Rules are indexed by kind and symbol, so a tick only looks at the rules
+  for its own symbol, and within those finding the rules to fire is a
+  bisect over their sorted levels. Firing is edge-triggered: a rule fires
+  once when the value crosses its level and then stays quiet until the
+  value has moved back past the level by its hysteresis. A rule whose
+  level is already crossed when it is added, or when the first value for
+  its symbol arrives, does not fire until it has re-armed.
+
+  Profit rules read from `pnl`, a pnl.PnlEngine, which must already have
+  seen the tick:
+
+  alerts = AlertEngine(pnl=engine)
+  alerts.AddRule(PriceRule('vrx-up', 'VRX', ABOVE, 30.0, hysteresis=0.25))
+  alerts.AddRule(ProfitRule('stop', BELOW, -5000.0))
+  for record in ticks:
+    engine.OnTick(record)
+    alerts.OnTick(record)
+
+  `callback` is called with an Alert for every rule that fires, in the
+  thread calling OnTick().
+  """
+
+  def __init__(self, callback=_LogAlert, pnl=None, name='alerts'):
+    self._callback = callback
+    self._pnl = pnl
+    self._name = name
+    self._lock = threading.Lock()
+    # (kind, symbol) -> {direction: _Levels}
+    self._index = {}
+    # (kind, symbol) -> last value seen.
+    self._values = {}
+    self._rules = {}
+    event_collection.AddCallback('%s-rules' % (name,), self.NumRules)
+
+  def UnregisterEventCallbacks(self):
+    event_collection.RemoveCallback('%s-rules' % (self._name,), self.NumRules)
+
+  def NumRules(self):
+    with self._lock:
+      return len(self._rules)
+
+  def AddRule(self, rule):
+    if rule.direction not in (ABOVE, BELOW):
+      raise ValueError('Unknown direction: %s' % (rule.direction,))
+    if rule.kind == PROFIT and self._pnl is None:
+      raise ValueError('Profit rule %s needs a PnlEngine' % (rule.name,))
+    with self._lock:
+      if rule.name in self._rules:
+        raise ValueError('Duplicate rule: %s' % (rule.name,))
+      self._rules[rule.name] = rule
+      key = (rule.kind, rule.symbol)
+      sides = self._index.setdefault(key, {})
+      levels = sides.get(rule.direction)
+      if levels is None:
+        levels = sides[rule.direction] = _Levels(rule.direction)
+      levels.Add(rule, self._values.get(key))
+
+  def RemoveRule(self, name):
+    with self._lock:
+      rule = self._rules.pop(name, None)
+      if rule is None:
+        return False
+      key = (rule.kind, rule.symbol)
+      sides = self._index[key]
+      sides[rule.direction].Remove(name)
+      if not sides[rule.direction]:
+        del sides[rule.direction]
+      if not sides:
+        del self._index[key]
+      return True
+
+  def Rules(self):
+    with self._lock:
+      return sorted(self._rules.values())
+
+  def _Evaluate(self, key, value, now, alerts):
+    sides = self._index.get(key)
+    first = key not in self._values
+    self._values[key] = value
+    if not sides:
+      return
+    for levels in sides.itervalues():
+      fired = levels.Update(value)
+      if not first:
+        alerts.extend(Alert(rule, value, now) for rule in fired)
+
+  def OnTick(self, record):
+    price = record.Price()
+    if price != price:
+      return
+
+    now = time.time()
+    alerts = []
+    with self._lock:
+      self._Evaluate((PRICE, record.symbol), price, now, alerts)
+      if self._pnl is not None:
+        if (PROFIT, record.symbol) in self._index:
+          profit = self._pnl.Profit(record.symbol)
+          if profit is not None:
+            self._Evaluate((PROFIT, record.symbol), profit, now, alerts)
+        if (PROFIT, PORTFOLIO) in self._index:
+          self._Evaluate(
+              (PROFIT, PORTFOLIO), self._pnl.TotalProfit(), now, alerts)
+
+    for alert in alerts:
+      event_collection.Increment('%s-fired' % (self._name,))
+      self._callback(alert)
+    return alerts
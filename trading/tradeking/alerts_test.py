@@ -0,0 +1,173 @@
+#!/usr/bin/python -B
+
+import unittest
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import alerts
+from projects.trading.tradeking import pnl
+from projects.trading.tradeking import records
+
+
+def _Trade(symbol, last):
+  return records.Trade(symbol, 0, last, 1, 1, last)
+
+
+def _Names(rules):
+  return [rule.name for rule in rules]
+
+
+class LevelsTest(unittest.TestCase):
+
+  def _Levels(self, direction, *levels_and_hysteresis):
+    levels = alerts._Levels(direction)
+    for i, (level, hysteresis) in enumerate(levels_and_hysteresis):
+      levels.Add(alerts.PriceRule('r%d' % (i,), 'A', direction, level,
+                                  hysteresis), None)
+    return levels
+
+  def testAboveFiresEveryLevelCrossed(self):
+    levels = self._Levels(alerts.ABOVE, (12.0, 0), (10.0, 0), (11.0, 0))
+    self.assertEqual([], levels.Update(9.0))
+    self.assertEqual(['r1', 'r2'], _Names(levels.Update(11.0)))
+    self.assertEqual([], levels.Update(11.5))
+    self.assertEqual(['r0'], _Names(levels.Update(20.0)))
+    self.assertEqual(3, len(levels))
+
+  def testBelowFiresEveryLevelCrossed(self):
+    levels = self._Levels(alerts.BELOW, (8.0, 0), (10.0, 0), (9.0, 0))
+    self.assertEqual([], levels.Update(11.0))
+    self.assertEqual(['r2', 'r1'], _Names(levels.Update(9.0)))
+    self.assertEqual(['r0'], _Names(levels.Update(1.0)))
+
+  def testHysteresisRearmsAbove(self):
+    levels = self._Levels(alerts.ABOVE, (10.0, 1.0))
+    self.assertEqual(['r0'], _Names(levels.Update(10.0)))
+    # Dipping back, but not by the hysteresis, doesn't re-arm.
+    self.assertEqual([], levels.Update(9.5))
+    self.assertEqual([], levels.Update(10.5))
+    self.assertEqual([], levels.Update(9.0))
+    self.assertEqual([], levels.Update(10.5))
+    # Strictly past the hysteresis does.
+    self.assertEqual([], levels.Update(8.99))
+    self.assertEqual(['r0'], _Names(levels.Update(10.0)))
+
+  def testHysteresisRearmsBelow(self):
+    levels = self._Levels(alerts.BELOW, (10.0, 0.5), (9.0, 2.0))
+    # Fired rules come in level order.
+    self.assertEqual(['r1', 'r0'], _Names(levels.Update(8.0)))
+    self.assertEqual([], levels.Update(10.6))
+    # r0 re-armed at 10.5; r1 needs 11.
+    self.assertEqual(['r0'], _Names(levels.Update(8.0)))
+    self.assertEqual([], levels.Update(11.5))
+    self.assertEqual(['r1', 'r0'], _Names(levels.Update(8.0)))
+
+  def testAddPastLevelStartsDisarmed(self):
+    levels = alerts._Levels(alerts.ABOVE)
+    levels.Add(alerts.PriceRule('r', 'A', alerts.ABOVE, 10.0), 11.0)
+    self.assertEqual([], levels.Update(12.0))
+    levels.Update(9.0)
+    self.assertEqual(['r'], _Names(levels.Update(12.0)))
+
+  def testRemove(self):
+    levels = self._Levels(alerts.ABOVE, (10.0, 0), (11.0, 0))
+    levels.Update(10.5)  # r0 is now disarmed.
+    self.assertTrue(levels.Remove('r0'))
+    self.assertTrue(levels.Remove('r1'))
+    self.assertFalse(levels.Remove('r1'))
+    self.assertEqual(0, len(levels))
+    self.assertEqual([], levels.Update(20.0))
+
+
+class AlertEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.fired = []
+    self.pnl = pnl.PnlEngine(name='alerts-test-pnl')
+    self.engine = alerts.AlertEngine(callback=self.fired.append, pnl=self.pnl,
+                                     name='alerts-test')
+
+  def tearDown(self):
+    self.engine.UnregisterEventCallbacks()
+    self.pnl.UnregisterEventCallbacks()
+
+  def _Tick(self, symbol, price):
+    record = _Trade(symbol, price)
+    self.pnl.OnTick(record)
+    return _Names(alert.rule for alert in self.engine.OnTick(record))
+
+  def testOnlyTheTickSymbolsRules(self):
+    self.engine.AddRule(alerts.PriceRule('a', 'A', alerts.ABOVE, 10.0))
+    self.engine.AddRule(alerts.PriceRule('b', 'B', alerts.ABOVE, 10.0))
+    self._Tick('A', 5.0)
+    self._Tick('B', 5.0)
+    self.assertEqual(['a'], self._Tick('A', 11.0))
+    self.assertEqual(['a'], _Names(alert.rule for alert in self.fired))
+    self.assertEqual(11.0, self.fired[0].value)
+
+  def testFirstValueDoesNotFire(self):
+    self.engine.AddRule(alerts.PriceRule('a', 'A', alerts.ABOVE, 10.0))
+    self.assertEqual([], self._Tick('A', 11.0))
+    self.assertEqual([], self._Tick('A', 12.0))
+    self._Tick('A', 9.0)
+    self.assertEqual(['a'], self._Tick('A', 10.0))
+
+  def testPercentChange(self):
+    self.engine.AddRule(alerts.PercentChangeRule(
+        'down-5', 'A', -5, 100.0, hysteresis=1))
+    self._Tick('A', 100.0)
+    self.assertEqual([], self._Tick('A', 95.5))
+    self.assertEqual(['down-5'], self._Tick('A', 95.0))
+    self.assertEqual([], self._Tick('A', 95.9))
+    self.assertEqual([], self._Tick('A', 94.0))
+    self._Tick('A', 96.5)
+    self.assertEqual(['down-5'], self._Tick('A', 94.0))
+
+  def testProfitRules(self):
+    self.pnl.SetPosition('A', 10, 5.0)
+    self.pnl.SetPosition('B', 10, 5.0)
+    self.engine.AddRule(alerts.ProfitRule('a-stop', alerts.BELOW, -10.0,
+                                          symbol='A'))
+    self.engine.AddRule(alerts.ProfitRule('portfolio-up', alerts.ABOVE,
+                                          100.0))
+    self._Tick('A', 5.0)
+    self._Tick('B', 5.0)
+    self.assertEqual(['a-stop'], self._Tick('A', 3.0))
+    # B's tick moves the portfolio, not A's position.
+    self.assertEqual(['portfolio-up'], self._Tick('B', 20.0))
+
+  def testProfitRuleNeedsPnl(self):
+    engine = alerts.AlertEngine(name='alerts-test-no-pnl')
+    self.assertRaises(ValueError, engine.AddRule,
+                      alerts.ProfitRule('p', alerts.ABOVE, 1.0))
+    engine.UnregisterEventCallbacks()
+
+  def testAddAndRemoveRules(self):
+    rule = alerts.PriceRule('a', 'A', alerts.ABOVE, 10.0)
+    self.engine.AddRule(rule)
+    self.assertRaises(ValueError, self.engine.AddRule, rule)
+    self.assertRaises(ValueError, self.engine.AddRule,
+                      alerts.PriceRule('b', 'A', 'sideways', 10.0))
+    self.assertEqual([rule], self.engine.Rules())
+    self.assertEqual(1, self.engine.NumRules())
+    self.assertTrue(self.engine.RemoveRule('a'))
+    self.assertFalse(self.engine.RemoveRule('a'))
+    self._Tick('A', 5.0)
+    self.assertEqual([], self._Tick('A', 11.0))
+
+  def testRuleAddedPastLevelWaitsToRearm(self):
+    self._Tick('A', 11.0)
+    self.engine.AddRule(alerts.PriceRule('a', 'A', alerts.ABOVE, 10.0))
+    self.assertEqual([], self._Tick('A', 12.0))
+    self._Tick('A', 9.0)
+    self.assertEqual(['a'], self._Tick('A', 12.0))
+
+  def testUnregisterEventCallbacks(self):
+    engine = alerts.AlertEngine(name='alerts-test-unregister')
+    self.assertIn('alerts-test-unregister-rules', event_collection.GetEvents())
+    engine.UnregisterEventCallbacks()
+    self.assertNotIn('alerts-test-unregister-rules',
+                     event_collection.GetEvents())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,187 @@
+import threading
+
+import numpy as np
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import records
+
+
+# Bar lengths in seconds.
+DEFAULT_RESOLUTIONS = (1, 60, 300)
+
+# Same columns as timesales.TimesalesFetcher.FetchBars(), plus vwap.
+_BAR_DTYPES = (
+    ('timestamp', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('last', np.float64),
+    ('volume', np.int64),
+    ('vwap', np.float64),
+)
+
+
+class BarRing(object):
+  """The last `capacity` bars of one resolution for one symbol.
+
+  The bar being built is kept in plain attributes and only written into the
+  preallocated column arrays when the next bar starts, so a tick costs a few
+  comparisons and additions. Intervals without ticks produce no bar.
+  """
+
+  def __init__(self, resolution, capacity):
+    self.resolution = resolution
+    self._capacity = capacity
+    self._columns = dict(
+        (name, np.zeros(capacity, dtype=dtype)) for name, dtype in _BAR_DTYPES)
+    self._closed = 0
+
+    self._start = None
+    self._open = self._high = self._low = self._last = None
+    self._volume = 0
+    self._notional = 0.0
+
+  def Update(self, timestamp, price, size):
+    start = timestamp - timestamp % self.resolution
+    if self._start is None or start > self._start:
+      if self._start is not None:
+        self._CloseBar()
+      self._start = start
+      self._open = self._high = self._low = self._last = price
+      self._volume = 0
+      self._notional = 0.0
+    elif start < self._start:
+      # Late tick for a bar that is already closed.
+      return False
+    else:
+      if price > self._high:
+        self._high = price
+      elif price < self._low:
+        self._low = price
+      self._last = price
+
+    if size:
+      self._volume += size
+      self._notional += price * size
+    return True
+
+  def _VWAP(self):
+    if self._volume:
+      return self._notional / self._volume
+    return self._last
+
+  def _CloseBar(self):
+    i = self._closed % self._capacity
+    columns = self._columns
+    columns['timestamp'][i] = self._start
+    columns['open'][i] = self._open
+    columns['high'][i] = self._high
+    columns['low'][i] = self._low
+    columns['last'][i] = self._last
+    columns['volume'][i] = self._volume
+    columns['vwap'][i] = self._VWAP()
+    self._closed += 1
+
+  def __len__(self):
+    n = min(self._closed, self._capacity)
+    if self._start is not None and n < self._capacity:
+      n += 1
+    return n
+
+  def Columns(self, include_partial=True):
+    """Returns {column: np.ndarray} of bars, oldest first.
+
+    The bar still being built is included last unless include_partial is
+    False. When included, the oldest closed bar is left out if needed so that
+    at most `capacity` bars are returned.
+    """
+    n = min(self._closed, self._capacity)
+    if self._closed > self._capacity:
+      oldest = self._closed % self._capacity
+    else:
+      oldest = 0
+    order = (np.arange(n) + oldest) % self._capacity
+
+    partial = include_partial and self._start is not None
+    if partial and n == self._capacity:
+      order = order[1:]
+
+    if partial:
+      current = {
+          'timestamp': self._start,
+          'open': self._open,
+          'high': self._high,
+          'low': self._low,
+          'last': self._last,
+          'volume': self._volume,
+          'vwap': self._VWAP(),
+      }
+
+    result = {}
+    for name, _ in _BAR_DTYPES:
+      column = self._columns[name][order]
+      if partial:
+        column = np.append(column, current[name])
+      result[name] = column
+    return result
+
+
+class BarAggregator(object):
+  """Builds OHLCV+VWAP bars at several resolutions from streamed ticks.
+
+  Trades update bars with their price and size. Quotes are ignored unless
+  include_quotes is set, in which case their midpoint updates OHLC with no
+  volume, which is useful for thinly traded contracts.
+
+  aggregator = BarAggregator()
+  for record in ticks:
+    aggregator.OnTick(record)
+  minute_bars = aggregator.Bars('VRX', 60)
+  """
+
+  def __init__(self, resolutions=DEFAULT_RESOLUTIONS, capacity=1024,
+               include_quotes=False):
+    self._resolutions = tuple(resolutions)
+    self._capacity = capacity
+    self._include_quotes = include_quotes
+    self._lock = threading.Lock()
+    # symbol -> tuple of BarRings, one per resolution.
+    self._rings = {}
+
+  def OnTick(self, record):
+    if type(record) is records.Trade:
+      price = record.last
+      size = record.vl
+    elif self._include_quotes:
+      price = record.Price()
+      size = 0
+    else:
+      return
+    if price != price:
+      return
+
+    with self._lock:
+      rings = self._rings.get(record.symbol)
+      if rings is None:
+        rings = tuple(BarRing(resolution, self._capacity)
+                      for resolution in self._resolutions)
+        self._rings[record.symbol] = rings
+      late = False
+      for ring in rings:
+        if not ring.Update(record.timestamp, price, size):
+          late = True
+    if late:
+      event_collection.Increment('bars-late-ticks')
+
+  def Symbols(self):
+    with self._lock:
+      return sorted(self._rings)
+
+  def Bars(self, symbol, resolution, include_partial=True):
+    """Returns {column: np.ndarray} of bars for symbol, oldest first."""
+    i = self._resolutions.index(resolution)
+    with self._lock:
+      rings = self._rings.get(symbol)
+      if rings is None:
+        return dict((name, np.zeros(0, dtype)) for name, dtype in _BAR_DTYPES)
+      return rings[i].Columns(include_partial)
@@ -0,0 +1,110 @@
+#!/usr/bin/python -B
+
+import unittest
+
+from projects.trading.tradeking import bars
+from projects.trading.tradeking import records
+
+
+def _Trade(symbol, timestamp, last, vl):
+  return records.Trade(symbol, timestamp, last, vl, 0, last)
+
+
+def _Quote(symbol, timestamp, bid, ask):
+  return records.Quote(symbol, timestamp, bid, ask, 1, 1)
+
+
+class BarRingTest(unittest.TestCase):
+
+  def testOHLCVAndVWAP(self):
+    ring = bars.BarRing(60, 4)
+    for timestamp, price, size in ((120, 10.0, 100), (130, 12.0, 100),
+                                   (140, 9.0, 200), (179, 11.0, 100)):
+      ring.Update(timestamp, price, size)
+    columns = ring.Columns()
+    self.assertEqual([120], list(columns['timestamp']))
+    self.assertEqual(([10.0], [12.0], [9.0], [11.0], [500]), (
+        list(columns['open']), list(columns['high']), list(columns['low']),
+        list(columns['last']), list(columns['volume'])))
+    self.assertAlmostEqual(10.2, columns['vwap'][0])
+
+  def testPartialBar(self):
+    ring = bars.BarRing(60, 4)
+    ring.Update(0, 1.0, 1)
+    ring.Update(60, 2.0, 1)
+    self.assertEqual(2, len(ring))
+    self.assertEqual([0, 60], list(ring.Columns()['timestamp']))
+    self.assertEqual([0], list(ring.Columns(False)['timestamp']))
+
+  def testGapsProduceNoBars(self):
+    ring = bars.BarRing(1, 8)
+    for timestamp in (1, 2, 7):
+      ring.Update(timestamp, float(timestamp), 1)
+    self.assertEqual([1, 2, 7], list(ring.Columns()['timestamp']))
+
+  def testLateTickIsRejected(self):
+    ring = bars.BarRing(60, 4)
+    ring.Update(60, 1.0, 1)
+    ring.Update(120, 2.0, 1)
+    self.assertFalse(ring.Update(119, 5.0, 1))
+    self.assertEqual([1.0, 2.0], list(ring.Columns()['high']))
+
+  def testRolloverKeepsNewestBars(self):
+    ring = bars.BarRing(1, 3)
+    for timestamp in xrange(10):
+      ring.Update(timestamp, float(timestamp), timestamp)
+    # Seven bars were overwritten; the partial bar displaces the oldest
+    # closed one.
+    self.assertEqual(3, len(ring))
+    columns = ring.Columns()
+    self.assertEqual([7, 8, 9], list(columns['timestamp']))
+    self.assertEqual([7, 8, 9], list(columns['volume']))
+    self.assertEqual([6, 7, 8], list(ring.Columns(False)['timestamp']))
+
+  def testRolloverAtEachPosition(self):
+    capacity = 4
+    ring = bars.BarRing(1, capacity)
+    for timestamp in xrange(3 * capacity):
+      ring.Update(timestamp, float(timestamp), 1)
+      closed = ring.Columns(False)['timestamp']
+      expected = range(max(0, timestamp - capacity), timestamp)
+      self.assertEqual(expected, list(closed))
+
+
+class BarAggregatorTest(unittest.TestCase):
+
+  def testResolutions(self):
+    aggregator = bars.BarAggregator(resolutions=(1, 60), capacity=16)
+    for timestamp in xrange(0, 120, 10):
+      aggregator.OnTick(_Trade('A', timestamp, float(timestamp), 1))
+    self.assertEqual(12, len(aggregator.Bars('A', 1)['timestamp']))
+    minutes = aggregator.Bars('A', 60)
+    self.assertEqual([0, 60], list(minutes['timestamp']))
+    self.assertEqual([0.0, 60.0], list(minutes['open']))
+    self.assertEqual([50.0, 110.0], list(minutes['last']))
+    self.assertEqual([6, 6], list(minutes['volume']))
+    self.assertRaises(ValueError, aggregator.Bars, 'A', 300)
+
+  def testQuotesOnlyWhenIncluded(self):
+    aggregator = bars.BarAggregator(resolutions=(60,))
+    aggregator.OnTick(_Quote('A', 0, 1.0, 2.0))
+    self.assertEqual([], aggregator.Symbols())
+    self.assertEqual(0, len(aggregator.Bars('A', 60)['timestamp']))
+
+    aggregator = bars.BarAggregator(resolutions=(60,), include_quotes=True)
+    aggregator.OnTick(_Quote('A', 0, 1.0, 2.0))
+    aggregator.OnTick(_Quote('A', 1, 3.0, 4.0))
+    minute = aggregator.Bars('A', 60)
+    self.assertEqual(([1.5], [3.5], [0]), (
+        list(minute['open']), list(minute['high']), list(minute['volume'])))
+    self.assertEqual([3.5], list(minute['vwap']))
+
+  def testMissingPriceIsIgnored(self):
+    aggregator = bars.BarAggregator(resolutions=(60,))
+    aggregator.OnTick(_Trade('A', 0, 1.0, 1))
+    aggregator.OnTick(_Trade('A', 1, float('nan'), 1))
+    self.assertEqual([1], list(aggregator.Bars('A', 60)['volume']))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,529 @@
+#!/usr/bin/python -B
+
+import BaseHTTPServer
+import SocketServer
+import _strptime  # Imported lazily by strptime(), which races across threads.
+import datetime
+import json
+import math
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import urlparse
+import zlib
+
+import gflags
+
+from projects.lib.base import logging
+from projects.lib.concurrency import threadlib
+from projects.lib.telemetry import event_collection
+
+
+FLAGS = gflags.FLAGS
+
+gflags.DEFINE_integer('fake_tradeking_port', 8081,
+                      'Port for the fake TradeKing server.')
+gflags.DEFINE_integer('fake_tradeking_symbols', 100,
+                      'Number of symbols in the fake market.')
+gflags.DEFINE_float('fake_tradeking_ticks_per_sec', 1000.0,
+                    'Ticks per second on each quote stream.')
+gflags.DEFINE_float('fake_tradeking_latency_ms', 0.0,
+                    'Delay before every response.')
+gflags.DEFINE_float('fake_tradeking_error_rate', 0.0,
+                    'Fraction of requests answered with a server error.')
+
+
+ACCOUNT_ID = '12345678'
+
+# Seconds between timesales rows for each interval, over a 09:30-16:00
+# session. Tick data runs to more than one page at the client's page size.
+_TIMESALES_STEPS = {
+    '1min': 60,
+    '5min': 300,
+    'tick': 15,
+}
+_SESSION_OPEN = datetime.time(9, 30)
+_SESSION_SECS = 390 * 60
+_DEFAULT_RPP = 400
+
+_PARAM_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y')
+
+# (path pattern, endpoint, handler method). Endpoint names match
+# tradeking.CACHE_POLICIES.
+_ROUTES = (
+    (r'/v1/utility/status\.json$', 'status', '_Status'),
+    (r'/v1/utility/version\.json$', 'version', '_Version'),
+    (r'/v1/accounts\.json$', 'accounts', '_Accounts'),
+    (r'/v1/accounts/balances\.json$', 'account-balances', '_AllBalances'),
+    (r'/v1/accounts/(\w+)\.json$', 'account', '_Account'),
+    (r'/v1/accounts/(\w+)/balances\.json$', 'account-balances', '_Balances'),
+    (r'/v1/accounts/(\w+)/history\.json$', 'account-history', '_History'),
+    (r'/v1/accounts/(\w+)/holdings\.json$', 'account-holdings', '_Holdings'),
+    (r'/v1/market/clock\.json$', 'market-clock', '_Clock'),
+    (r'/v1/market/ext/quotes\.json$', 'market-quotes', '_Quotes'),
+    (r'/v1/market/timesales\.json$', 'market-timesales', '_Timesales'),
+    (r'/v1/market/toplists/(\w+)\.json$', 'market-toplists', '_Toplist'),
+    (r'/v1/market/news/search\.json$', 'news-search', '_SearchNews'),
+    (r'/v1/market/news/(\w+)\.json$', 'news-article', '_Article'),
+    (r'/v1/member/profile\.json$', 'member-profile', '_Profile'),
+    (r'/v1/market/quotes\.xml$', 'market-stream', None),
+)
+
+_QUOTE_XML = (
+    '<quote><ask>%.2f</ask><asksz>%d</asksz><bid>%.2f</bid><bidsz>%d</bidsz>'
+    '<datetime>%s</datetime><exch>Q</exch><qcond>REGULAR</qcond>'
+    '<symbol>%s</symbol><timestamp>%d</timestamp></quote>')
+_TRADE_XML = (
+    '<trade><cvol>%d</cvol><datetime>%s</datetime><exch>NYSE</exch>'
+    '<last>%.2f</last><symbol>%s</symbol><timestamp>%d</timestamp>'
+    '<vl>%d</vl><vwap>%.2f</vwap></trade>')
+
+_WORDS = (
+    'shares rose after the company reported quarterly revenue above '
+    'estimates while analysts cut their price targets on concerns about '
+    'guidance for the coming year and pricing pressure in its core markets'
+).split()
+
+
+def _Seeded(*key):
+  return random.Random(zlib.crc32('/'.join(str(k) for k in key)))
+
+
+def _ParseDate(text):
+  for date_format in _PARAM_DATE_FORMATS:
+    try:
+      return datetime.datetime.strptime(text, date_format).date()
+    except (TypeError, ValueError):
+      continue
+  return datetime.date.today()
+
+
+def _Symbols(params):
+  return [s for s in (params.get('symbols') or '').split(',') if s]
+
+
+def _OneOrList(items):
+  # Like the real API, single results are a bare object.
+  if len(items) == 1:
+    return items[0]
+  return items
+
+
+class _FakeMarket(object):
+  """Random-walk prices for any symbol, seeded from the symbol's name."""
+
+  def __init__(self, num_symbols, seed):
+    self.symbols = ['SYM%04d' % (i,) for i in xrange(num_symbols)]
+    self._seed = seed
+    self._lock = threading.Lock()
+    self._prices = {}
+    self._cvol = {}
+    self._notional = {}
+
+  def _PriceLocked(self, symbol):
+    price = self._prices.get(symbol)
+    if price is None:
+      price = _Seeded(self._seed, symbol).uniform(5, 500)
+      self._prices[symbol] = price
+      self._cvol[symbol] = 0
+      self._notional[symbol] = 0.0
+    return price
+
+  def Price(self, symbol):
+    with self._lock:
+      return self._PriceLocked(symbol)
+
+  def Tick(self, rng, symbol, now):
+    """Moves symbol's price and returns a quote or trade element for it."""
+    stamp = datetime.datetime.fromtimestamp(now).strftime('%Y-%m-%dT%H:%M:%S')
+    with self._lock:
+      price = self._PriceLocked(symbol) * math.exp(rng.gauss(0, 0.0005))
+      self._prices[symbol] = price
+      if rng.random() < 0.8:
+        spread = max(0.01, round(price * 0.0005, 2))
+        return _QUOTE_XML % (
+            price + spread / 2, rng.randint(1, 50), price - spread / 2,
+            rng.randint(1, 50), stamp, symbol, now)
+      size = rng.randint(1, 20) * 100
+      cvol = self._cvol[symbol] = self._cvol[symbol] + size
+      self._notional[symbol] += price * size
+      vwap = self._notional[symbol] / cvol
+    return _TRADE_XML % (cvol, stamp, price, symbol, now, size, vwap)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    parsed = urlparse.urlparse(self.path)
+    params = dict(
+        (k, v[-1]) for k, v in urlparse.parse_qs(parsed.query).iteritems())
+    self.server.fake.Serve(self, parsed.path, params)
+
+  def log_message(self, fmt, *args):
+    logging.debug('%s: %s', self.address_string(), fmt % args)
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def handle_error(self, request, client_address):
+    # Clients routinely hang up on streams; that is not worth a traceback.
+    if sys.exc_info()[0] is socket.error:
+      return
+    BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class FakeTradeKingServer(threadlib.Thread):
+  """Local stand-in for the TradeKing REST and streaming APIs.
+
+  Serves every endpoint used by tradeking.Session with generated JSON, and
+  quotes.xml as a chunked stream of quotes and trades for the requested
+  symbols at ticks_per_sec, written every chunk_secs. Generated history
+  (timesales, news) is deterministic for a given seed. OAuth headers are
+  accepted and ignored.
+
+  Every response is delayed by latency_secs plus up to latency_jitter_secs,
+  and a fraction error_rate of requests get one of error_codes instead. On
+  streams, each chunk has a stream_error_rate chance of being cut short and
+  the connection dropped mid-element.
+
+  server = FakeTradeKingServer(port=0, ticks_per_sec=10000)
+  server.start()
+  session = tradeking.Session(
+      'key', 'secret', 'token', 'secret', api_url=server.url,
+      stream_url=server.url)
+  ...
+  server.Shutdown()
+  """
+
+  def __init__(self, port=0, num_symbols=100, ticks_per_sec=1000.0,
+               chunk_secs=0.1, latency_secs=0.0, latency_jitter_secs=0.0,
+               error_rate=0.0, error_codes=(500, 503), stream_error_rate=0.0,
+               seed=0):
+    super(FakeTradeKingServer, self).__init__()
+    self.daemon = True
+    self.name = 'FakeTradeKingServer'
+
+    self._ticks_per_sec = ticks_per_sec
+    self._chunk_secs = chunk_secs
+    self._latency = latency_secs
+    self._jitter = latency_jitter_secs
+    self._error_rate = error_rate
+    self._error_codes = error_codes
+    self._stream_error_rate = stream_error_rate
+    self._seed = seed
+    self._market = _FakeMarket(num_symbols, seed)
+    self._stopping = threading.Event()
+    self._routes = [
+        (re.compile(pattern), endpoint, method and getattr(self, method))
+        for pattern, endpoint, method in _ROUTES]
+
+    # Bind now so that the port is known before the thread starts.
+    self.server = _HTTPServer(('127.0.0.1', port), _Handler)
+    self.server.fake = self
+    self.port = self.server.server_address[1]
+    self.url = 'http://127.0.0.1:%d' % (self.port,)
+
+  @property
+  def symbols(self):
+    return list(self._market.symbols)
+
+  def run(self):
+    logging.info('FakeTradeKingServer listening on %s', self.url)
+    self.server.serve_forever(poll_interval=0.5)
+
+  def Shutdown(self):
+    self._stopping.set()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def Serve(self, handler, path, params):
+    for pattern, endpoint, method in self._routes:
+      match = pattern.match(path)
+      if match:
+        break
+    else:
+      self._SendJSON(handler, 404, {'error': 'Not found: %s' % (path,)})
+      return
+
+    event_collection.Increment('fake-tradeking-requests-%s' % (endpoint,))
+    rng = random.Random()
+    delay = self._latency + rng.uniform(0, self._jitter)
+    if delay > 0:
+      time.sleep(delay)
+    if rng.random() < self._error_rate:
+      event_collection.Increment('fake-tradeking-errors-%s' % (endpoint,))
+      self._SendJSON(handler, rng.choice(self._error_codes),
+                     {'error': 'Injected error'})
+      return
+
+    if method is None:
+      self._Stream(handler, params, rng)
+    else:
+      self._SendJSON(handler, 200, method(params, *match.groups()))
+
+  def _SendJSON(self, handler, code, payload):
+    body = json.dumps({'response': payload})
+    handler.send_response(code)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+  def _Stream(self, handler, params, rng):
+    symbols = _Symbols(params) or self._market.symbols
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/xml')
+    handler.send_header('Transfer-Encoding', 'chunked')
+    handler.end_headers()
+    handler.close_connection = True
+
+    def WriteChunk(data):
+      handler.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+      handler.wfile.flush()
+
+    per_chunk = self._ticks_per_sec * self._chunk_secs
+    carry = 0.0
+    next_at = time.time()
+    try:
+      WriteChunk('<status>connected</status>')
+      while not self._stopping.is_set():
+        next_at += self._chunk_secs
+        wait = next_at - time.time()
+        if wait > 0:
+          time.sleep(wait)
+        carry += per_chunk
+        n = int(carry)
+        carry -= n
+        if not n:
+          continue
+
+        now = int(time.time())
+        data = ''.join(self._market.Tick(rng, rng.choice(symbols), now)
+                       for _ in xrange(n))
+        if rng.random() < self._stream_error_rate:
+          event_collection.Increment('fake-tradeking-stream-errors')
+          WriteChunk(data[:len(data) // 2])
+          return
+        WriteChunk(data)
+        event_collection.Add('fake-tradeking-ticks-streamed', n)
+      WriteChunk('')
+    except socket.error:
+      # The client went away.
+      pass
+
+  def _Status(self, params):
+    return {'time': time.strftime('%a, %d %b %Y %H:%M:%S %Z')}
+
+  def _Version(self, params):
+    return {'version': '1.0'}
+
+  def _HoldingsList(self):
+    holdings = []
+    for symbol in self._market.symbols[:5]:
+      rng = _Seeded(self._seed, 'holding', symbol)
+      qty = rng.randint(1, 10) * 100
+      price = self._market.Price(symbol)
+      purchase = price * rng.uniform(0.8, 1.2)
+      holdings.append({
+          'instrument': {'desc': '%s INC' % (symbol,), 'sym': symbol},
+          'qty': str(qty),
+          'price': '%.2f' % (price,),
+          'purchaseprice': '%.2f' % (purchase,),
+          'costbasis': '%.2f' % (purchase * qty,),
+          'marketvalue': '%.2f' % (price * qty,),
+          'marketvaluechange': '0.00',
+          'gainloss': '%.2f' % ((price - purchase) * qty,),
+      })
+    return holdings
+
+  def _BalanceDict(self):
+    value = sum(float(h['marketvalue']) for h in self._HoldingsList())
+    return {
+        'account': ACCOUNT_ID,
+        'accountvalue': '%.2f' % (value + 10000,),
+        'money': {'cash': '10000.00'},
+        'securities': {'total': '%.2f' % (value,)},
+    }
+
+  def _Accounts(self, params):
+    return {
+        'accounts': {
+            'accountsummary': {
+                'account': ACCOUNT_ID,
+                'accountbalance': self._BalanceDict(),
+                'accountholdings': {'holding': self._HoldingsList()},
+            },
+        },
+    }
+
+  def _AllBalances(self, params):
+    return {'accountbalance': self._BalanceDict()}
+
+  def _Account(self, params, account_id):
+    return {
+        'accountbalance': self._BalanceDict(),
+        'accountholdings': {'holding': self._HoldingsList()},
+    }
+
+  def _Balances(self, params, account_id):
+    return {'accountbalance': self._BalanceDict()}
+
+  def _History(self, params, account_id):
+    return {'transactions': {'transaction': []}}
+
+  def _Holdings(self, params, account_id):
+    return {'accountholdings': {'holding': self._HoldingsList()}}
+
+  def _Clock(self, params):
+    now = datetime.datetime.now()
+    open_at = datetime.datetime.combine(now.date(), _SESSION_OPEN)
+    close_at = open_at + datetime.timedelta(seconds=_SESSION_SECS)
+    if now.weekday() < 5 and open_at <= now < close_at:
+      status = {'current': 'open', 'next': 'after',
+                'change_at': close_at.strftime('%H:%M:%S')}
+    else:
+      status = {'current': 'close', 'next': 'pre',
+                'change_at': '08:00:00'}
+    return {
+        'date': now.strftime('%Y-%m-%d %H:%M:%S.00'),
+        'unixtime': str(int(time.time())),
+        'status': status,
+        'message': 'Market is %s.' % (status['current'],),
+    }
+
+  def _QuoteDict(self, symbol):
+    price = self._market.Price(symbol)
+    return {
+        'symbol': symbol,
+        'name': '%s INC' % (symbol,),
+        'bid': '%.2f' % (price - 0.01,),
+        'ask': '%.2f' % (price + 0.01,),
+        'last': '%.2f' % (price,),
+        'vl': str(_Seeded(self._seed, 'vl', symbol).randint(1, 10 ** 6)),
+        'datetime': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+  def _Quotes(self, params):
+    quotes = [self._QuoteDict(symbol) for symbol in _Symbols(params)]
+    return {'quotes': {'quote': _OneOrList(quotes)}}
+
+  def _Timesales(self, params):
+    symbol = (_Symbols(params) or ['SYM0000'])[0]
+    interval = params.get('interval') or '1min'
+    step = _TIMESALES_STEPS.get(interval, 60)
+    day = _ParseDate(params.get('startdate'))
+    rpp = int(params.get('rpp') or _DEFAULT_RPP)
+    index = int(params.get('index') or 0)
+
+    rng = _Seeded(self._seed, symbol, day, interval)
+    open_at = datetime.datetime.combine(day, _SESSION_OPEN)
+    start_ts = int(time.mktime(open_at.timetuple()))
+    price = self._market.Price(symbol)
+    rows = []
+    cvol = 0
+    for offset in xrange(0, _SESSION_SECS, step):
+      opn = price
+      path = [price * math.exp(rng.gauss(0, 0.001)) for _ in xrange(4)]
+      price = path[-1]
+      volume = rng.randint(1, 100) * 100
+      cvol += volume
+      stamp = datetime.datetime.fromtimestamp(start_ts + offset)
+      rows.append({
+          'date': day.strftime('%Y-%m-%d'),
+          'datetime': stamp.strftime('%Y-%m-%dT%H:%M:%S-04:00'),
+          'timestamp': str(start_ts + offset),
+          'opn': '%.2f' % (opn,),
+          'hi': '%.2f' % (max([opn] + path),),
+          'lo': '%.2f' % (min([opn] + path),),
+          'last': '%.2f' % (price,),
+          'vl': str(volume),
+          'incr_vl': str(volume),
+          'cvl': str(cvol),
+      })
+    page = rows[index * rpp:(index + 1) * rpp]
+    return {'quotes': {'quote': _OneOrList(page) if page else []}}
+
+  def _Toplist(self, params, list_type):
+    ranked = sorted(self._market.symbols,
+                    key=lambda s: _Seeded(self._seed, list_type, s).random())
+    quotes = []
+    for rank, symbol in enumerate(ranked[:25], 1):
+      price = self._market.Price(symbol)
+      pchg = _Seeded(self._seed, 'pchg', symbol).uniform(-10, 10)
+      pcls = price / (1 + pchg / 100)
+      quotes.append({
+          'rank': str(rank),
+          'symbol': symbol,
+          'name': '%s INC' % (symbol,),
+          'last': '%.2f' % (price,),
+          'pcls': '%.2f' % (pcls,),
+          'chg': '%.2f' % (price - pcls,),
+          'pchg': '%.2f%%' % (pchg,),
+          'vl': str(_Seeded(self._seed, 'vl', symbol).randint(1, 10 ** 6)),
+      })
+    return {'quotes': {'quote': quotes}}
+
+  def _Headline(self, rng, symbol):
+    return '%s %s' % (symbol, ' '.join(rng.sample(_WORDS, 6)))
+
+  def _SearchNews(self, params):
+    day = _ParseDate(params.get('startdate'))
+    maxhits = int(params.get('maxhits') or 10)
+    articles = []
+    for symbol in _Symbols(params):
+      for i in xrange(maxhits):
+        article_id = '%08x' % (zlib.crc32('%s/%s/%d' % (symbol, day, i))
+                               & 0xffffffff,)
+        rng = _Seeded(self._seed, article_id)
+        articles.append({
+            'id': article_id,
+            'date': '%sT%02d:00:00-04:00' % (day, 9 + i % 8),
+            'headline': self._Headline(rng, symbol),
+        })
+    return {'articles': {'article': _OneOrList(articles)}}
+
+  def _Article(self, params, article_id):
+    rng = _Seeded(self._seed, article_id)
+    headline = self._Headline(rng, 'SYM')
+    story = ''.join(
+        '<p>%s.</p>' % (' '.join(rng.choice(_WORDS)
+                                 for _ in xrange(rng.randint(20, 60))),)
+        for _ in xrange(rng.randint(2, 5)))
+    return {
+        'article': {
+            'id': article_id,
+            'headline': headline,
+            'date': datetime.date.today().isoformat(),
+            'story': story,
+        },
+    }
+
+  def _Profile(self, params):
+    return {
+        'userdata': {
+            'account': {'account': ACCOUNT_ID},
+            'userprofile': {'entry': [{'name': 'email',
+                                       'value': 'user@example.com'}]},
+        },
+    }
+
+
+def main(unused_argv):
+  server = FakeTradeKingServer(
+      port=FLAGS.fake_tradeking_port,
+      num_symbols=FLAGS.fake_tradeking_symbols,
+      ticks_per_sec=FLAGS.fake_tradeking_ticks_per_sec,
+      latency_secs=FLAGS.fake_tradeking_latency_ms / 1000.0,
+      error_rate=FLAGS.fake_tradeking_error_rate)
+  server.run()
+
+
+if __name__ == '__main__':
+  from google.apputils import app
+  app.run()
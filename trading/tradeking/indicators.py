@@ -0,0 +1,245 @@
+import collections
+import math
+import threading
+
+import numpy as np
+
+
+# Indicators are updated with one bar at a time through Update(), or computed
+# over whole arrays through Batch(). Batch inputs may have any number of
+# leading dimensions (e.g. symbols x bars); time is always the last axis. Both
+# modes produce the same values, with NaN until an indicator has warmed up.
+
+_NAN = float('nan')
+
+
+def _AsFloats(values):
+  return np.asarray(values, dtype=np.float64)
+
+
+class EMA(object):
+  """Exponential moving average of the close, seeded with the first close."""
+
+  def __init__(self, span):
+    self._alpha = 2.0 / (span + 1)
+    self._value = None
+
+  def Update(self, close, vwap, volume):
+    if self._value is None:
+      self._value = close
+    else:
+      self._value = self._alpha * close + (1 - self._alpha) * self._value
+    return self._value
+
+  def Batch(self, closes, vwaps, volumes):
+    x = _AsFloats(closes)
+    out = np.empty_like(x)
+    if not x.shape[-1]:
+      return out
+    out[..., 0] = x[..., 0]
+    # The recurrence is inherently sequential in time, so it is vectorized
+    # across the leading (symbol) axes instead.
+    alpha = self._alpha
+    for t in xrange(1, x.shape[-1]):
+      out[..., t] = alpha * x[..., t] + (1 - alpha) * out[..., t - 1]
+    return out
+
+
+class Volatility(object):
+  """Sample standard deviation of log returns over the last `window` bars."""
+
+  def __init__(self, window):
+    self._window = window
+    self._returns = collections.deque()
+    self._sum = 0.0
+    self._sum_sq = 0.0
+    self._prev = None
+
+  def Update(self, close, vwap, volume):
+    prev = self._prev
+    self._prev = close
+    if prev is None:
+      return _NAN
+
+    r = math.log(close / prev)
+    self._returns.append(r)
+    self._sum += r
+    self._sum_sq += r * r
+    if len(self._returns) > self._window:
+      old = self._returns.popleft()
+      self._sum -= old
+      self._sum_sq -= old * old
+    if len(self._returns) < self._window:
+      return _NAN
+
+    n = self._window
+    var = (self._sum_sq - self._sum * self._sum / n) / (n - 1)
+    return math.sqrt(max(var, 0.0))
+
+  def Batch(self, closes, vwaps, volumes):
+    c = _AsFloats(closes)
+    out = np.full(c.shape, _NAN)
+    n = self._window
+    if c.shape[-1] <= n:
+      return out
+
+    r = np.diff(np.log(c), axis=-1)
+    zeros = np.zeros(r.shape[:-1] + (1,))
+    s = np.concatenate((zeros, np.cumsum(r, axis=-1)), axis=-1)
+    ss = np.concatenate((zeros, np.cumsum(r * r, axis=-1)), axis=-1)
+    window_sum = s[..., n:] - s[..., :-n]
+    window_sum_sq = ss[..., n:] - ss[..., :-n]
+    var = (window_sum_sq - window_sum * window_sum / n) / (n - 1)
+    out[..., n:] = np.sqrt(np.maximum(var, 0.0))
+    return out
+
+
+class RSI(object):
+  """Wilder's relative strength index over `period` bars."""
+
+  def __init__(self, period):
+    self._period = period
+    self._prev = None
+    self._seen = 0
+    self._avg_gain = 0.0
+    self._avg_loss = 0.0
+
+  @staticmethod
+  def _Value(avg_gain, avg_loss):
+    if avg_loss == 0:
+      return 100.0
+    return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+  def Update(self, close, vwap, volume):
+    prev = self._prev
+    self._prev = close
+    if prev is None:
+      return _NAN
+
+    change = close - prev
+    gain = max(change, 0.0)
+    loss = max(-change, 0.0)
+    n = self._period
+    self._seen += 1
+    if self._seen <= n:
+      # Seed with the simple average of the first `period` changes.
+      self._avg_gain += gain / n
+      self._avg_loss += loss / n
+      if self._seen < n:
+        return _NAN
+    else:
+      self._avg_gain = (self._avg_gain * (n - 1) + gain) / n
+      self._avg_loss = (self._avg_loss * (n - 1) + loss) / n
+    return self._Value(self._avg_gain, self._avg_loss)
+
+  def Batch(self, closes, vwaps, volumes):
+    c = _AsFloats(closes)
+    out = np.full(c.shape, _NAN)
+    n = self._period
+    if c.shape[-1] <= n:
+      return out
+
+    change = np.diff(c, axis=-1)
+    gains = np.maximum(change, 0.0)
+    losses = np.maximum(-change, 0.0)
+    avg_gain = np.zeros(c.shape[:-1])
+    avg_loss = np.zeros(c.shape[:-1])
+    for t in xrange(n):
+      avg_gain += gains[..., t] / n
+      avg_loss += losses[..., t] / n
+
+    for t in xrange(n, c.shape[-1]):
+      if t > n:
+        avg_gain = (avg_gain * (n - 1) + gains[..., t - 1]) / n
+        avg_loss = (avg_loss * (n - 1) + losses[..., t - 1]) / n
+      with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+      out[..., t] = np.where(avg_loss == 0, 100.0, rsi)
+    return out
+
+
+class VWAPDeviation(object):
+  """Fractional deviation of the close from the cumulative VWAP.
+
+  Each bar contributes vwap * volume to the cumulative VWAP, so the inputs
+  should cover a single session.
+  """
+
+  def __init__(self):
+    self._notional = 0.0
+    self._volume = 0
+
+  def Update(self, close, vwap, volume):
+    if volume:
+      self._notional += vwap * volume
+      self._volume += volume
+    if not self._volume:
+      return _NAN
+    return close / (self._notional / self._volume) - 1.0
+
+  def Batch(self, closes, vwaps, volumes):
+    c = _AsFloats(closes)
+    v = _AsFloats(volumes)
+    notional = np.cumsum(_AsFloats(vwaps) * v, axis=-1)
+    volume = np.cumsum(v, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      out = c / (notional / volume) - 1.0
+    out[volume == 0] = _NAN
+    return out
+
+
+DEFAULT_INDICATORS = {
+    'ema-12': (EMA, (12,)),
+    'ema-26': (EMA, (26,)),
+    'volatility-20': (Volatility, (20,)),
+    'rsi-14': (RSI, (14,)),
+    'vwap-deviation': (VWAPDeviation, ()),
+}
+
+
+class IndicatorEngine(object):
+  """Maintains a set of indicators per symbol over a stream of bars.
+
+  `indicators` maps a name to an (indicator class, constructor args) pair.
+  OnBar() is O(1) per indicator; Batch() computes the same indicators over
+  arrays of bars, e.g. from BarAggregator.Bars() or
+  TimesalesFetcher.FetchBars(), or over a (symbols x bars) matrix at once.
+  """
+
+  def __init__(self, indicators=DEFAULT_INDICATORS):
+    self._specs = dict(indicators)
+    self._lock = threading.Lock()
+    self._state = {}
+    self._values = {}
+
+  def _New(self):
+    return dict(
+        (name, cls(*args)) for name, (cls, args) in self._specs.iteritems())
+
+  def OnBar(self, symbol, close, vwap=None, volume=0):
+    """Updates symbol's indicators with one closed bar and returns them."""
+    if vwap is None:
+      vwap = close
+    with self._lock:
+      state = self._state.get(symbol)
+      if state is None:
+        state = self._state[symbol] = self._New()
+      values = dict(
+          (name, indicator.Update(close, vwap, volume))
+          for name, indicator in state.iteritems())
+      self._values[symbol] = values
+    return values
+
+  def Values(self, symbol):
+    with self._lock:
+      return self._values.get(symbol)
+
+  def Batch(self, closes, vwaps=None, volumes=None):
+    """Returns {name: np.ndarray} with the same shape as closes."""
+    if vwaps is None:
+      vwaps = closes
+    if volumes is None:
+      volumes = np.zeros(np.shape(closes))
+    return dict(
+        (name, indicator.Batch(closes, vwaps, volumes))
+        for name, indicator in self._New().iteritems())
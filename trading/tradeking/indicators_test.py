@@ -0,0 +1,112 @@
+#!/usr/bin/python -B
+
+import unittest
+
+import numpy as np
+
+from projects.trading.tradeking import indicators
+
+
+def _Bars(num_symbols, num_bars, seed=0):
+  """Returns (closes, vwaps, volumes), each num_symbols x num_bars."""
+  rng = np.random.RandomState(seed)
+  closes = 50 * np.exp(np.cumsum(
+      rng.normal(0, 0.01, (num_symbols, num_bars)), axis=-1))
+  vwaps = closes * (1 + rng.normal(0, 0.001, closes.shape))
+  volumes = rng.randint(0, 1000, closes.shape)
+  # No volume at all until a few bars in.
+  volumes[:, :3] = 0
+  return closes, vwaps, volumes
+
+
+def _Streamed(engine, closes, vwaps, volumes):
+  """Feeds each row of bars through OnBar() as its own symbol."""
+  streamed = {}
+  for s in xrange(closes.shape[0]):
+    for t in xrange(closes.shape[1]):
+      values = engine.OnBar(s, closes[s, t], vwaps[s, t], volumes[s, t])
+      for name, value in values.iteritems():
+        streamed.setdefault(name, np.empty(closes.shape))[s, t] = value
+  return streamed
+
+
+class IndicatorTest(unittest.TestCase):
+
+  def assertSame(self, expected, actual, name=''):
+    self.assertEqual(expected.shape, actual.shape)
+    np.testing.assert_array_equal(np.isnan(expected), np.isnan(actual),
+                                  err_msg=name)
+    ok = ~np.isnan(expected)
+    np.testing.assert_allclose(expected[ok], actual[ok], rtol=1e-9,
+                               atol=1e-12, err_msg=name)
+
+  def testStreamingMatchesBatch(self):
+    closes, vwaps, volumes = _Bars(3, 200)
+    engine = indicators.IndicatorEngine()
+    streamed = _Streamed(engine, closes, vwaps, volumes)
+    batch = engine.Batch(closes, vwaps, volumes)
+    self.assertEqual(sorted(indicators.DEFAULT_INDICATORS), sorted(batch))
+    for name in batch:
+      self.assertSame(streamed[name], batch[name], name)
+
+  def testBatchOneSymbol(self):
+    closes, vwaps, volumes = _Bars(2, 60, seed=1)
+    engine = indicators.IndicatorEngine()
+    matrix = engine.Batch(closes, vwaps, volumes)
+    row = engine.Batch(closes[1], vwaps[1], volumes[1])
+    for name in matrix:
+      self.assertSame(matrix[name][1], row[name], name)
+
+  def testWarmUp(self):
+    closes, vwaps, volumes = _Bars(1, 30)
+    batch = indicators.IndicatorEngine().Batch(closes[0], vwaps[0], volumes[0])
+    self.assertFalse(np.isnan(batch['ema-12']).any())
+    # A window of n returns needs n + 1 closes.
+    self.assertTrue(np.isnan(batch['volatility-20'][:20]).all())
+    self.assertFalse(np.isnan(batch['volatility-20'][20:]).any())
+    self.assertTrue(np.isnan(batch['rsi-14'][:14]).all())
+    self.assertFalse(np.isnan(batch['rsi-14'][14:]).any())
+    self.assertTrue(np.isnan(batch['vwap-deviation'][:3]).all())
+    self.assertFalse(np.isnan(batch['vwap-deviation'][3:]).any())
+
+  def testShortHistory(self):
+    engine = indicators.IndicatorEngine()
+    batch = engine.Batch(np.zeros(0))
+    self.assertEqual((0,), batch['ema-12'].shape)
+    batch = engine.Batch([1.0, 2.0, 3.0])
+    self.assertTrue(np.isnan(batch['volatility-20']).all())
+    self.assertTrue(np.isnan(batch['rsi-14']).all())
+
+  def testKnownValues(self):
+    ema = indicators.EMA(3)
+    self.assertEqual([1.0, 1.5, 2.25],
+                     [ema.Update(c, c, 0) for c in (1.0, 2.0, 3.0)])
+
+    rsi = indicators.RSI(2)
+    values = [rsi.Update(c, c, 0) for c in (10.0, 11.0, 10.5, 10.5)]
+    self.assertTrue(values[0] != values[0])
+    self.assertTrue(values[1] != values[1])
+    # Average gain 0.5, average loss 0.25.
+    self.assertAlmostEqual(100 - 100 / 3.0, values[2])
+    # Average gain 0.25, average loss 0.125.
+    self.assertAlmostEqual(100 - 100 / 3.0, values[3])
+    rising = indicators.RSI(2)
+    self.assertEqual(100.0, [rising.Update(c, c, 0)
+                             for c in (1.0, 2.0, 3.0)][-1])
+
+    deviation = indicators.VWAPDeviation()
+    self.assertTrue(deviation.Update(10.0, 10.0, 0) !=
+                    deviation.Update(10.0, 10.0, 0))
+    deviation.Update(10.0, 10.0, 100)
+    self.assertAlmostEqual(0.1, deviation.Update(12.1, 12.0, 100))
+
+  def testValues(self):
+    engine = indicators.IndicatorEngine({'ema-2': (indicators.EMA, (2,))})
+    self.assertEqual(None, engine.Values('A'))
+    engine.OnBar('A', 3.0)
+    engine.OnBar('A', 6.0)
+    self.assertEqual({'ema-2': 5.0}, engine.Values('A'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,115 @@
+import datetime
+import threading
+import time
+import traceback
+
+from projects.lib.base import logging
+from projects.lib.concurrency import periodic_task
+from projects.lib.telemetry import event_collection
+
+
+# Market clock states in which gated tasks run.
+REGULAR_HOURS = ('open',)
+EXTENDED_HOURS = ('pre', 'open', 'after')
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def _SecondsOfDay(text):
+  parts = [float(x) for x in text.split(':')]
+  parts += [0] * (3 - len(parts))
+  return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def SecondsToChange(clock):
+  """Returns seconds from a MarketClock response until its next change.
+
+  change_at is a time of day in the market's time zone, as is date, so the
+  difference between the two does not depend on the local time zone.
+  """
+  now = _SecondsOfDay(clock['date'].split()[1])
+  change_at = _SecondsOfDay(clock['status']['change_at'])
+  return (change_at - now) % _SECONDS_PER_DAY
+
+
+class MarketSessionGate(periodic_task.Gate):
+  """A periodic_task.Gate that is open while the market is.
+
+  The gate asks Session.MarketClock for the market state and when it next
+  changes, and does not ask again until then (or max_refresh_secs, in case
+  of holidays and half days), so gated tasks are paused outside trading
+  hours and resumed at the open without polling in between. On errors it
+  keeps its state and retries after retry_secs.
+
+  gate = MarketSessionGate(session).Start()
+  periodic_task.AddTask(Poll).RunForever().Every(seconds=5).GatedBy(
+      gate).StartingNow()
+  """
+
+  def __init__(self, session, open_states=REGULAR_HOURS, max_refresh_secs=3600,
+               retry_secs=60, name='market-session'):
+    super(MarketSessionGate, self).__init__(is_open=False)
+    self._session = session
+    self._open_states = frozenset(open_states)
+    self._max_refresh_secs = max_refresh_secs
+    self._retry_secs = retry_secs
+    self._name = name
+    self._refresh_lock = threading.Lock()
+    self._next_refresh = None
+    self._state = None
+    self._task = None
+
+    event_collection.AddCallback(
+        '%s-open' % (name,), lambda: int(self.IsOpen()))
+
+  def Start(self):
+    self._task = periodic_task.AddTask(self._Refresh, name=self._name)
+    self._task.RunForever().On(self).StartingNow()
+    return self
+
+  def Stop(self):
+    if self._task is not None:
+      periodic_task.RemoveTask(self._task)
+      self._task = None
+
+  def State(self):
+    """Returns the last market state seen, e.g. 'open', or None."""
+    with self._refresh_lock:
+      return self._state
+
+  def Next(self, after):
+    """Trigger for the refresh task: when the market state next changes."""
+    with self._refresh_lock:
+      if self._next_refresh is None:
+        return after
+      return max(self._next_refresh, after + 1)
+
+  def _Refresh(self):
+    try:
+      clock = self._session.MarketClock()
+      state = clock['status']['current']
+      delay = min(max(SecondsToChange(clock), 1), self._max_refresh_secs)
+    except Exception:
+      event_collection.Increment('%s-errors' % (self._name,))
+      logging.warning('Market clock failed:\n%s', traceback.format_exc())
+      with self._refresh_lock:
+        self._next_refresh = time.time() + self._retry_secs
+      return
+
+    with self._refresh_lock:
+      if state != self._state:
+        logging.info('Market is %s until %s.', state,
+                     clock['status']['change_at'])
+      self._state = state
+      self._next_refresh = time.time() + delay
+    if state in self._open_states:
+      self.Open()
+    else:
+      self.Close()
+
+  def __str__(self):
+    next_refresh = self._next_refresh
+    if next_refresh is None:
+      return 'market clock'
+    return 'market clock, next %s' % (
+        datetime.datetime.fromtimestamp(next_refresh).strftime('%H:%M:%S'),)
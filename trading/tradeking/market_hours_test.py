@@ -0,0 +1,40 @@
+#!/usr/bin/python -B
+
+import unittest
+
+from projects.trading.tradeking import market_hours
+
+
+def _Clock(now, change_at, current='open'):
+  return {'date': '2016-03-17 %s' % (now,),
+          'status': {'current': current, 'change_at': change_at}}
+
+
+class SecondsToChangeTest(unittest.TestCase):
+
+  def testBeforeTheOpen(self):
+    self.assertEqual(60, market_hours.SecondsToChange(
+        _Clock('09:29:00', '09:30:00', current='pre')))
+    self.assertEqual(1, market_hours.SecondsToChange(
+        _Clock('09:29:59', '09:30', current='pre')))
+
+  def testBeforeTheClose(self):
+    self.assertEqual(6.5 * 3600, market_hours.SecondsToChange(
+        _Clock('09:30:00', '16:00:00')))
+    self.assertEqual(0.5, market_hours.SecondsToChange(
+        _Clock('15:59:59.5', '16:00:00')))
+
+  def testChangeIsTomorrow(self):
+    # After hours end at 20:00; the next change is the pre-market at 08:00.
+    self.assertEqual(12 * 3600, market_hours.SecondsToChange(
+        _Clock('20:00:00', '08:00:00', current='close')))
+    self.assertEqual(60, market_hours.SecondsToChange(
+        _Clock('23:59:30', '00:00:30', current='close')))
+
+  def testAtTheChange(self):
+    self.assertEqual(0, market_hours.SecondsToChange(
+        _Clock('16:00:00', '16:00:00')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,10 +3,15 @@
 import sys
 
 from projects.lib import secrets
+from projects.trading.tradeking import news_ingest
 from projects.trading.tradeking import tradeking
 
 
-def main(symbol):
+# Lines of each article's body shown in the listing.
+PREVIEW_LINES = 2
+
+
+def main(symbols):
   tk = tradeking.Session(
       secrets.TRADEKING_APP_KEY,
       secrets.TRADEKING_APP_SECRET,
@@ -14,32 +19,28 @@ def main(symbol):
       secrets.TRADEKING_OAUTH_SECRET,
   )
 
-  article_results = tk.SearchNews(
-      symbol, maxhits=3, startdate='03/17/2016', enddate='03/17/2016')
-
-  if type(article_results['articles']['article']) is list:
-    articles = reversed(article_results['articles']['article'])
-  else:
-    articles = [article_results['articles']['article']]
-
-  for article in articles:
-    story_date = article['date']
-    story_id = article['id']
-    story_headline = article['headline']
-
-    print '%20s %25s      %s' % (story_date, story_id, story_headline)
-
-    full_article = tk.GetNews(story_id)['article']
+  ingester = news_ingest.NewsIngester(tk)
+  ingester.Ingest(
+      symbols, maxhits=3, startdate='03/17/2016', enddate='03/17/2016')
 
-    print full_article['headline']
-    print '%s...' % (full_article['story'][:50],)
-    print
+  # An article that mentions several of the symbols is listed once.
+  seen = set()
+  for symbol in symbols:
+    for article in reversed(ingester.index.BySymbol(symbol)):
+      if article.id in seen:
+        continue
+      seen.add(article.id)
+      print '%20s %25s      %s' % (article.date, article.id, article.headline)
+      for line in [line for line in article.lines if line][:PREVIEW_LINES]:
+        print line
+      print '...'
+      print
 
 
 
 if __name__ == '__main__':
-  if len(sys.argv) == 2:
-    symbol = sys.argv[1]
+  if len(sys.argv) >= 2:
+    symbols = sys.argv[1:]
   else:
-    symbol = 'vrx'
-  main(symbol)
+    symbols = ['vrx']
+  main(symbols)
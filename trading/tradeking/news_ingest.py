@@ -0,0 +1,181 @@
+import functools
+import Queue
+import re
+import sys
+import threading
+
+from projects.lib.concurrency import threadpool
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import tradeking
+
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def Tokenize(text):
+  return _TOKEN_RE.findall(_TAG_RE.sub(' ', text or '').lower())
+
+
+def _AsList(value):
+  # Single results come back as a bare dict rather than a list of one.
+  if not value:
+    return []
+  if type(value) is dict:
+    return [value]
+  return value
+
+
+class Article(object):
+  """A fetched news article, with its body pre-wrapped for display."""
+
+  __slots__ = ('id', 'date', 'headline', 'symbols', 'story', 'lines')
+
+  def __init__(self, article_id, date, headline, symbols, story):
+    self.id = article_id
+    self.date = date
+    self.headline = headline
+    self.symbols = symbols
+    self.story = story
+    self.lines = tradeking.FormatParagraphs(story or '')
+
+
+class InvertedIndex(object):
+  """Maps headline/body tokens and symbols to the articles containing them."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._articles = {}
+    self._by_token = {}
+    self._by_symbol = {}
+
+  def __contains__(self, article_id):
+    with self._lock:
+      return article_id in self._articles
+
+  def __len__(self):
+    with self._lock:
+      return len(self._articles)
+
+  def Add(self, article):
+    tokens = set(Tokenize(article.headline)) | set(Tokenize(article.story))
+    with self._lock:
+      self._articles[article.id] = article
+      for token in tokens:
+        self._by_token.setdefault(token, set()).add(article.id)
+      for symbol in article.symbols:
+        self._by_symbol.setdefault(symbol, set()).add(article.id)
+
+  def AddSymbols(self, article_id, symbols):
+    """Records more symbols for an article that is already indexed."""
+    with self._lock:
+      article = self._articles[article_id]
+      article.symbols |= symbols
+      for symbol in symbols:
+        self._by_symbol.setdefault(symbol, set()).add(article_id)
+
+  def _Sorted(self, article_ids):
+    articles = [self._articles[i] for i in article_ids]
+    return sorted(articles, key=lambda a: a.date, reverse=True)
+
+  def Get(self, article_id):
+    with self._lock:
+      return self._articles.get(article_id)
+
+  def Search(self, text, symbol=None):
+    """Returns articles containing every word of text, newest first."""
+    with self._lock:
+      matches = None
+      for token in set(Tokenize(text)):
+        ids = self._by_token.get(token, set())
+        matches = ids if matches is None else matches & ids
+      if matches is None:
+        matches = set(self._articles)
+      if symbol is not None:
+        matches = matches & self._by_symbol.get(symbol.upper(), set())
+      return self._Sorted(matches)
+
+  def BySymbol(self, symbol):
+    with self._lock:
+      return self._Sorted(self._by_symbol.get(symbol.upper(), set()))
+
+
+class NewsIngester(object):
+  """Pulls news for a watchlist into a local InvertedIndex.
+
+  Each Ingest() searches every symbol concurrently, merges the results by
+  article id (an article may mention several symbols) and fetches only the
+  bodies of articles not already indexed, also concurrently.
+
+  ingester = NewsIngester(session)
+  ingester.Ingest(['VRX', 'GILD'], startdate='03/17/2016', enddate='03/17/2016')
+  for article in ingester.index.Search('guidance', symbol='VRX'):
+    print '\n'.join(article.lines)
+  """
+
+  def __init__(self, session, num_workers=8):
+    self._session = session
+    self._pool = threadpool.ThreadPool(size=num_workers)
+    self.index = InvertedIndex()
+
+  def _RunAll(self, closures):
+    """Runs closures on the pool and returns their results in order."""
+    results = Queue.Queue()
+
+    def Run(i, closure):
+      try:
+        return i, closure(), None
+      except Exception:
+        return i, None, sys.exc_info()
+
+    for i, closure in enumerate(closures):
+      self._pool.RunTask(functools.partial(Run, i, closure), results.put)
+
+    ordered = [None] * len(closures)
+    exc_info = None
+    for _ in closures:
+      i, result, job_exc_info = results.get().Result()
+      ordered[i] = result
+      exc_info = exc_info or job_exc_info
+    if exc_info is not None:
+      raise exc_info[0], exc_info[1], exc_info[2]
+    return ordered
+
+  def Ingest(self, symbols, maxhits=10, startdate=None, enddate=None):
+    """Indexes news for symbols and returns the newly fetched Articles."""
+    symbols = [s.upper() for s in symbols]
+    searches = self._RunAll([
+        functools.partial(self._session.SearchNews, symbol, maxhits=maxhits,
+                          startdate=startdate, enddate=enddate)
+        for symbol in symbols])
+
+    found = {}
+    for symbol, result in zip(symbols, searches):
+      for summary in _AsList((result.get('articles') or {}).get('article')):
+        article_symbols = found.setdefault(summary['id'], (summary, set()))[1]
+        article_symbols.add(symbol)
+
+    unseen = []
+    for article_id, (summary, article_symbols) in found.iteritems():
+      if article_id in self.index:
+        self.index.AddSymbols(article_id, article_symbols)
+      else:
+        unseen.append((summary, article_symbols))
+    event_collection.Add('news-articles-seen', len(found))
+    event_collection.Add('news-articles-deduped', len(found) - len(unseen))
+
+    bodies = self._RunAll([
+        functools.partial(self._session.GetNews, summary['id'])
+        for summary, _ in unseen])
+
+    articles = []
+    for (summary, article_symbols), body in zip(unseen, bodies):
+      full = body['article']
+      article = Article(
+          summary['id'], summary.get('date'),
+          full.get('headline') or summary.get('headline'), article_symbols,
+          full.get('story'))
+      self.index.Add(article)
+      articles.append(article)
+    event_collection.Add('news-articles-fetched', len(articles))
+    return articles
@@ -0,0 +1,242 @@
+import collections
+import socket
+import sys
+import threading
+import time
+import Queue
+
+from projects.lib.concurrency import threadlib
+from projects.lib.telemetry import event_collection
+from projects.lib.telemetry import histogram
+from projects.trading.tradeking import stream
+
+
+# What TickQueue.Put() does when the queue is full.
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+# Keeps only the latest tick per symbol, in order of each symbol's first
+# pending tick. The queue holds at most one tick per symbol.
+CONFLATE = 'conflate'
+
+_END = object()
+
+
+def _ShutdownSocket(response):
+  """Shuts down the socket under a streaming requests response.
+
+  Closing the response alone does not wake a thread blocked in recv() on
+  it; shutting the socket down does.
+  """
+  try:
+    sock = response.raw._fp.fp._sock
+  except AttributeError:
+    return
+  try:
+    sock.shutdown(socket.SHUT_RDWR)
+  except socket.error:
+    pass
+
+
+class TickQueue(object):
+  """Bounded queue of records between the parser and consumer stages."""
+
+  def __init__(self, policy, max_ticks, name):
+    if policy not in (BLOCK, DROP_OLDEST, CONFLATE):
+      raise ValueError('Unknown overflow policy: %s' % (policy,))
+    self._policy = policy
+    self._max_ticks = max_ticks
+    self._name = name
+    self._cond = threading.Condition(threading.Lock())
+    if policy == CONFLATE:
+      self._pending = collections.OrderedDict()
+    else:
+      self._pending = collections.deque()
+    self._closed = False
+    self._lag_ms = histogram.Histogram('%s-consumer-lag-ms' % (name,))
+    event_collection.AddCallback('%s-queue-depth' % (name,), self.Depth)
+
+  def UnregisterEventCallbacks(self):
+    self._lag_ms.Unregister()
+    event_collection.RemoveCallback('%s-queue-depth' % (self._name,),
+                                    self.Depth)
+
+  def Depth(self):
+    with self._cond:
+      return len(self._pending)
+
+  def Put(self, record):
+    entry = (record, time.time())
+    with self._cond:
+      if self._policy == CONFLATE:
+        if record.symbol in self._pending:
+          event_collection.Increment('%s-ticks-conflated' % (self._name,))
+          # Keep the symbol's place in line and its original enqueue time,
+          # so lag reflects how long the symbol has been waiting.
+          entry = (record, self._pending[record.symbol][1])
+        self._pending[record.symbol] = entry
+      elif self._policy == DROP_OLDEST:
+        if len(self._pending) >= self._max_ticks:
+          self._pending.popleft()
+          event_collection.Increment('%s-ticks-dropped' % (self._name,))
+        self._pending.append(entry)
+      else:
+        while len(self._pending) >= self._max_ticks and not self._closed:
+          self._cond.wait()
+        self._pending.append(entry)
+      self._cond.notify_all()
+
+  def Close(self):
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+  def Get(self):
+    """Returns the next record, or None once closed and drained."""
+    with self._cond:
+      while not self._pending:
+        if self._closed:
+          return None
+        self._cond.wait()
+      if self._policy == CONFLATE:
+        _, (record, enqueued_at) = self._pending.popitem(last=False)
+      else:
+        record, enqueued_at = self._pending.popleft()
+      self._cond.notify_all()
+    self._lag_ms.Add((time.time() - enqueued_at) * 1000)
+    return record
+
+
+class StreamPipeline(object):
+  """Decouples reading the stream from consuming it.
+
+  A reader thread pulls raw chunks off the connection into a bounded chunk
+  queue; a parser thread turns them into records and puts them on a
+  TickQueue with the given overflow policy; the consumer iterates over the
+  pipeline in its own thread. A slow consumer therefore never stalls socket
+  reads unless the policy is BLOCK. Chunks are never dropped, since that
+  would corrupt the XML.
+
+  `tap`, if given, is called with every parsed record in the parser thread
+  before any dropping or conflation, e.g. to record the full stream with
+  ticklog.TickLogWriter.Append.
+
+  Errors raised while reading or parsing are re-raised in the consumer after
+  the records before them have been consumed.
+
+  Stop() ends the pipeline early, e.g. when the consumer stops iterating. It
+  shuts down the socket under `response`, the streaming HTTP response the
+  chunks come from, so that a reader blocked on it wakes up, ends the
+  parser, and joins both threads.
+
+  pipeline = StreamPipeline(chunks, policy=CONFLATE, response=response)
+  try:
+    for record in pipeline.Start():
+      ...
+  finally:
+    pipeline.Stop()
+
+  Queue depths, dropped and conflated ticks, and consumer lag (time from
+  enqueue to dequeue) are published to event_collection under <name>-*.
+  """
+
+  def __init__(self, chunks, policy=BLOCK, max_ticks=10000, max_chunks=256,
+               tap=None, response=None, name='stream'):
+    self._chunks = chunks
+    self._response = response
+    self._chunk_queue = Queue.Queue(max_chunks)
+    self._ticks = TickQueue(policy, max_ticks, name)
+    self._tap = tap
+    self._name = name
+    self._exc_info = None
+    self._stopped = False
+    self._threads = []
+    event_collection.AddCallback(
+        '%s-chunk-queue-depth' % (name,), self._chunk_queue.qsize)
+
+  def _StartThread(self, target, stage):
+    thread = threadlib.Thread(target=target)
+    thread.daemon = True
+    thread.name = '%s/%s' % (self._name, stage)
+    thread.start()
+    self._threads.append(thread)
+
+  def Start(self):
+    self._StartThread(self._ReadChunks, 'reader')
+    self._StartThread(self._ParseChunks, 'parser')
+    return self
+
+  def Stop(self, timeout_secs=5.0):
+    """Closes the stream and waits up to timeout_secs for each thread."""
+    self._stopped = True
+    if self._response is not None:
+      _ShutdownSocket(self._response)
+      self._response.close()
+    self._ticks.Close()
+    # Make room for the reader's last put and wake a parser waiting for a
+    # chunk; it exits on whatever it gets next, as _stopped is set.
+    self._DrainChunks()
+    try:
+      self._chunk_queue.put_nowait(_END)
+    except Queue.Full:
+      pass
+    reader, parser = self._threads or (None, None)
+    if parser is not None:
+      parser.join(timeout_secs)
+    self._DrainChunks()
+    if reader is not None:
+      reader.join(timeout_secs)
+    self._ticks.UnregisterEventCallbacks()
+    event_collection.RemoveCallback(
+        '%s-chunk-queue-depth' % (self._name,), self._chunk_queue.qsize)
+
+  def _DrainChunks(self):
+    while True:
+      try:
+        self._chunk_queue.get_nowait()
+      except Queue.Empty:
+        break
+
+  def _ReadChunks(self):
+    try:
+      for chunk in self._chunks:
+        if self._stopped:
+          break
+        self._chunk_queue.put(chunk)
+        event_collection.Add('%s-bytes-read' % (self._name,), len(chunk))
+    except Exception:
+      # Closing the response in Stop() makes the read fail.
+      if not self._stopped:
+        self._exc_info = sys.exc_info()
+    if self._stopped:
+      # Nothing is left to take it; don't block.
+      try:
+        self._chunk_queue.put_nowait(_END)
+      except Queue.Full:
+        pass
+    else:
+      self._chunk_queue.put(_END)
+
+  def _ParseChunks(self):
+    parser = stream.StreamParser()
+    try:
+      while True:
+        chunk = self._chunk_queue.get()
+        if chunk is _END or self._stopped:
+          break
+        for record in parser.Feed(chunk):
+          if self._tap is not None:
+            self._tap(record)
+          self._ticks.Put(record)
+    except Exception:
+      self._exc_info = self._exc_info or sys.exc_info()
+    self._ticks.Close()
+
+  def __iter__(self):
+    while True:
+      record = self._ticks.Get()
+      if record is None:
+        break
+      yield record
+
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
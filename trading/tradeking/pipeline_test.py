@@ -0,0 +1,91 @@
+#!/usr/bin/python -B
+
+import gflags
+import requests
+import sys
+import time
+import unittest
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import fake_server
+from projects.trading.tradeking import pipeline
+
+
+FLAGS = gflags.FLAGS
+
+_QUOTE = ('<quote><ask>%(price)s</ask><asksz>1</asksz><bid>%(price)s</bid>'
+          '<bidsz>1</bidsz><symbol>%(symbol)s</symbol>'
+          '<timestamp>1458221400</timestamp></quote>')
+
+
+def _Quotes(*symbols_and_prices):
+  return ''.join(_QUOTE % {'symbol': symbol, 'price': price}
+                 for symbol, price in symbols_and_prices)
+
+
+def _Failing(chunks):
+  for chunk in chunks:
+    yield chunk
+  raise IOError('connection reset')
+
+
+class StreamPipelineTest(unittest.TestCase):
+
+  def testRecordsInOrder(self):
+    quotes = _Quotes(('A', 1), ('B', 2))
+    chunks = [quotes[:50], quotes[50:], _Quotes(('C', 3))]
+    ticks = pipeline.StreamPipeline(iter(chunks), name='pipeline-test').Start()
+    self.assertEqual(['A', 'B', 'C'], [r.symbol for r in ticks])
+    ticks.Stop()
+
+  def testConflate(self):
+    chunks = [_Quotes(('A', 1), ('B', 2), ('A', 3))]
+    ticks = pipeline.StreamPipeline(iter(chunks), policy=pipeline.CONFLATE,
+                                    name='pipeline-test')
+    ticks.Start()
+    # Let the parser finish before consuming so that A's ticks conflate.
+    ticks._threads[1].join(2)
+    self.assertEqual([('A', 3), ('B', 2)],
+                     [(r.symbol, r.bid) for r in ticks])
+    ticks.Stop()
+
+  def testReaderErrorIsRaisedAfterRecords(self):
+    ticks = pipeline.StreamPipeline(_Failing([_Quotes(('A', 1))]),
+                                    name='pipeline-test').Start()
+    received = []
+    try:
+      for record in ticks:
+        received.append(record.symbol)
+      self.fail('No error raised')
+    except IOError:
+      pass
+    self.assertEqual(['A'], received)
+    ticks.Stop()
+
+  def testStopOnIdleStream(self):
+    # A connected stream with no ticks: the reader is blocked on the socket
+    # and the parser on the chunk queue.
+    server = fake_server.FakeTradeKingServer(ticks_per_sec=0)
+    server.start()
+    try:
+      response = requests.get(server.url + '/v1/market/quotes.xml',
+                              stream=True)
+      ticks = pipeline.StreamPipeline(
+          response.iter_content(chunk_size=None), response=response,
+          name='pipeline-test').Start()
+      time.sleep(0.2)
+
+      start = time.time()
+      ticks.Stop(timeout_secs=2.0)
+      self.assertLess(time.time() - start, 0.5)
+      self.assertEqual([], [t.name for t in ticks._threads if t.is_alive()])
+      self.assertEqual([], list(ticks))
+      self.assertNotIn('pipeline-test-queue-depth',
+                       event_collection.GetEvents())
+    finally:
+      server.Shutdown()
+
+
+if __name__ == '__main__':
+  FLAGS(sys.argv[:1])
+  unittest.main()
@@ -0,0 +1,173 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+from projects.lib.telemetry import event_collection
+
+
+# Number of most recent tick directions kept per position.
+SIGN_HISTORY = 10
+
+PnlSnapshot = collections.namedtuple('PnlSnapshot', [
+    'timestamp',
+    'symbols',
+    'units',
+    'cost_basis',
+    'price',
+    'value',
+    'profit',
+    'signs',
+    'total_value',
+    'total_cost',
+    'total_profit',
+])
+
+
+class PnlEngine(object):
+  """Incrementally maintained mark-to-market P&L for a set of positions.
+
+  Each position occupies a slot in a set of parallel NumPy arrays. A tick
+  updates its symbol's price, the portfolio totals and the tick direction
+  history in O(1), so reading the totals never requires a pass over all
+  positions. Snapshot() returns a consistent copy for display, telemetry or
+  alerting.
+
+  Quantities are in contracts (or shares) and `multiplier` is the number of
+  units per contract, e.g. 100 for equity options.
+  """
+
+  def __init__(self, capacity=256, name='pnl'):
+    self._lock = threading.Lock()
+    self._slots = {}
+    self._symbols = []
+    self._units = None
+    self._cost_basis = None
+    self._price = None
+    self._signs = None
+    self._num_signs = None
+    self._Allocate(capacity)
+
+    # Totals over positions that have a price.
+    self._total_value = 0.0
+    self._total_cost = 0.0
+
+    self._name = name
+    event_collection.AddCallback('%s-total-value' % (name,), self.TotalValue)
+    event_collection.AddCallback('%s-total-profit' % (name,), self.TotalProfit)
+
+  def UnregisterEventCallbacks(self):
+    event_collection.RemoveCallback(
+        '%s-total-value' % (self._name,), self.TotalValue)
+    event_collection.RemoveCallback(
+        '%s-total-profit' % (self._name,), self.TotalProfit)
+
+  def _Allocate(self, capacity):
+    def Grow(old, fill, shape=None, dtype=np.float64):
+      new = np.full(shape or capacity, fill, dtype=dtype)
+      if old is not None:
+        new[:len(old)] = old
+      return new
+
+    self._units = Grow(self._units, 0.0)
+    self._cost_basis = Grow(self._cost_basis, 0.0)
+    self._price = Grow(self._price, np.nan)
+    self._signs = Grow(
+        self._signs, 0, shape=(capacity, SIGN_HISTORY), dtype=np.int8)
+    self._num_signs = Grow(self._num_signs, 0, dtype=np.int64)
+    self._capacity = capacity
+
+  def SetPosition(self, symbol, quantity, cost_basis, multiplier=1):
+    with self._lock:
+      slot = self._slots.get(symbol)
+      if slot is None:
+        slot = len(self._symbols)
+        if slot == self._capacity:
+          self._Allocate(self._capacity * 2)
+        self._slots[symbol] = slot
+        self._symbols.append(symbol)
+
+      price = self._price[slot]
+      if not np.isnan(price):
+        self._total_value -= self._units[slot] * price
+        self._total_cost -= self._units[slot] * self._cost_basis[slot]
+
+      self._units[slot] = quantity * multiplier
+      self._cost_basis[slot] = cost_basis
+
+      if not np.isnan(price):
+        self._total_value += self._units[slot] * price
+        self._total_cost += self._units[slot] * cost_basis
+
+  def OnTick(self, record):
+    slot = self._slots.get(record.symbol)
+    if slot is None:
+      return
+    price = record.Price()
+    if price != price:
+      # Missing bid, ask or last.
+      return
+
+    with self._lock:
+      units = self._units[slot]
+      old_price = self._price[slot]
+      if old_price != old_price:
+        self._total_value += units * price
+        self._total_cost += units * self._cost_basis[slot]
+      else:
+        self._total_value += units * (price - old_price)
+        if price != old_price:
+          i = self._num_signs[slot] % SIGN_HISTORY
+          self._signs[slot, i] = 1 if price > old_price else -1
+          self._num_signs[slot] += 1
+      self._price[slot] = price
+
+  def TotalValue(self):
+    with self._lock:
+      return self._total_value
+
+  def TotalProfit(self):
+    with self._lock:
+      return self._total_value - self._total_cost
+
+  def Profit(self, symbol):
+    """Returns the position's profit, or None if it has no price yet."""
+    slot = self._slots.get(symbol)
+    if slot is None:
+      return None
+    with self._lock:
+      price = self._price[slot]
+      if price != price:
+        return None
+      return float(self._units[slot] * (price - self._cost_basis[slot]))
+
+  def Snapshot(self):
+    with self._lock:
+      n = len(self._symbols)
+      units = self._units[:n].copy()
+      cost_basis = self._cost_basis[:n].copy()
+      price = self._price[:n].copy()
+      num_signs = self._num_signs[:n]
+      # Rotate each ring so that signs run oldest to newest.
+      order = (np.arange(SIGN_HISTORY) + num_signs[:, None]) % SIGN_HISTORY
+      signs = np.take_along_axis(self._signs[:n], order, axis=1)
+      signs[np.arange(SIGN_HISTORY) < SIGN_HISTORY - num_signs[:, None]] = 0
+      total_value = self._total_value
+      total_cost = self._total_cost
+      symbols = list(self._symbols)
+
+    value = units * price
+    return PnlSnapshot(
+        timestamp=time.time(),
+        symbols=symbols,
+        units=units,
+        cost_basis=cost_basis,
+        price=price,
+        value=value,
+        profit=value - units * cost_basis,
+        signs=signs,
+        total_value=total_value,
+        total_cost=total_cost,
+        total_profit=total_value - total_cost,
+    )
@@ -0,0 +1,123 @@
+#!/usr/bin/python -B
+
+import unittest
+
+import numpy as np
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import pnl
+from projects.trading.tradeking import records
+
+
+def _Quote(symbol, bid, ask):
+  return records.Quote(symbol, 0, bid, ask, 1, 1)
+
+
+def _Trade(symbol, last):
+  return records.Trade(symbol, 0, last, 1, 1, last)
+
+
+class PnlEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.engine = pnl.PnlEngine(capacity=2, name='pnl-test')
+
+  def tearDown(self):
+    self.engine.UnregisterEventCallbacks()
+
+  def testNoPriceNoValue(self):
+    self.engine.SetPosition('A', 2, 1.5, multiplier=100)
+    self.assertEqual(0.0, self.engine.TotalValue())
+    self.assertEqual(None, self.engine.Profit('A'))
+    self.assertEqual(None, self.engine.Profit('UNHELD'))
+
+  def testMarks(self):
+    self.engine.SetPosition('A', 2, 1.5, multiplier=100)
+    self.engine.SetPosition('B', 10, 20.0)
+    self.engine.OnTick(_Quote('A', 1.9, 2.1))
+    self.assertAlmostEqual(400.0, self.engine.TotalValue())
+    self.assertAlmostEqual(100.0, self.engine.TotalProfit())
+    self.assertAlmostEqual(100.0, self.engine.Profit('A'))
+
+    self.engine.OnTick(_Trade('B', 19.0))
+    self.engine.OnTick(_Trade('A', 1.0))
+    self.assertAlmostEqual(390.0, self.engine.TotalValue())
+    self.assertAlmostEqual(-110.0, self.engine.TotalProfit())
+    self.assertAlmostEqual(-10.0, self.engine.Profit('B'))
+
+  def testTicksWithoutPriceAreIgnored(self):
+    self.engine.SetPosition('A', 1, 1.0)
+    self.engine.OnTick(_Trade('A', 2.0))
+    self.engine.OnTick(_Trade('A', float('nan')))
+    self.engine.OnTick(_Trade('UNHELD', 5.0))
+    self.assertAlmostEqual(2.0, self.engine.TotalValue())
+
+  def testFillsAdjustTotals(self):
+    self.engine.SetPosition('A', 1, 10.0)
+    self.engine.OnTick(_Trade('A', 12.0))
+    # Adding to the position at a new average cost.
+    self.engine.SetPosition('A', 3, 11.0)
+    self.assertAlmostEqual(36.0, self.engine.TotalValue())
+    self.assertAlmostEqual(3.0, self.engine.TotalProfit())
+    # Flipping to short.
+    self.engine.SetPosition('A', -2, 12.0)
+    self.engine.OnTick(_Trade('A', 11.0))
+    self.assertAlmostEqual(-22.0, self.engine.TotalValue())
+    self.assertAlmostEqual(2.0, self.engine.TotalProfit())
+    # Flat.
+    self.engine.SetPosition('A', 0, 0.0)
+    self.assertAlmostEqual(0.0, self.engine.TotalValue())
+    self.assertAlmostEqual(0.0, self.engine.TotalProfit())
+
+  def testGrowsPastCapacity(self):
+    for i in xrange(5):
+      self.engine.SetPosition('S%d' % (i,), 1, 1.0)
+      self.engine.OnTick(_Trade('S%d' % (i,), 2.0))
+    self.assertAlmostEqual(10.0, self.engine.TotalValue())
+    self.assertEqual(['S0', 'S1', 'S2', 'S3', 'S4'],
+                     self.engine.Snapshot().symbols)
+
+  def testSignHistory(self):
+    self.engine.SetPosition('A', 1, 1.0)
+    self.engine.SetPosition('B', 1, 1.0)
+    for price in (1.0, 2.0, 2.0, 1.5, 3.0):
+      self.engine.OnTick(_Trade('A', price))
+    snapshot = self.engine.Snapshot()
+    # Unchanged prices don't count, and history runs oldest to newest.
+    self.assertEqual([0] * (pnl.SIGN_HISTORY - 3) + [1, -1, 1],
+                     list(snapshot.signs[0]))
+    self.assertEqual([0] * pnl.SIGN_HISTORY, list(snapshot.signs[1]))
+
+  def testSignHistoryWraps(self):
+    self.engine.SetPosition('A', 1, 1.0)
+    prices = [1.0]
+    for i in xrange(pnl.SIGN_HISTORY + 3):
+      prices.append(prices[-1] + (1 if i % 3 else -1))
+    for price in prices:
+      self.engine.OnTick(_Trade('A', price))
+    expected = [1 if i % 3 else -1 for i in xrange(len(prices) - 1)]
+    self.assertEqual(expected[-pnl.SIGN_HISTORY:],
+                     list(self.engine.Snapshot().signs[0]))
+
+  def testSnapshotIsACopy(self):
+    self.engine.SetPosition('A', 2, 1.0)
+    self.engine.OnTick(_Trade('A', 3.0))
+    snapshot = self.engine.Snapshot()
+    self.engine.OnTick(_Trade('A', 5.0))
+    self.assertEqual(3.0, snapshot.price[0])
+    np.testing.assert_allclose([6.0], snapshot.value)
+    np.testing.assert_allclose([4.0], snapshot.profit)
+    self.assertAlmostEqual(4.0, snapshot.total_profit)
+
+  def testUnregisterEventCallbacks(self):
+    engine = pnl.PnlEngine(name='pnl-test-unregister')
+    self.assertIn('pnl-test-unregister-total-value',
+                  event_collection.GetEvents())
+    engine.UnregisterEventCallbacks()
+    events = event_collection.GetEvents()
+    self.assertNotIn('pnl-test-unregister-total-value', events)
+    self.assertNotIn('pnl-test-unregister-total-profit', events)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,236 @@
+import itertools
+import threading
+import time
+
+from projects.lib.base import logging
+from projects.lib.concurrency import threadlib
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import pipeline
+from projects.trading.tradeking import stream
+
+
+class Subscription(object):
+  """One subscriber's view of the hub: ticks for the symbols it asked for.
+
+  Ticks are queued per subscriber with its own overflow policy, so one slow
+  subscriber only affects others if it uses pipeline.BLOCK.
+  """
+
+  def __init__(self, hub, policy, max_ticks, name):
+    self._hub = hub
+    self._queue = pipeline.TickQueue(policy, max_ticks, name)
+    # Guarded by the hub's lock.
+    self.symbols = frozenset()
+
+  def Put(self, record):
+    self._queue.Put(record)
+
+  def AddSymbols(self, symbols):
+    symbols = frozenset(symbols)
+    self._hub._Update(self, lambda old: old | symbols)
+
+  def RemoveSymbols(self, symbols):
+    symbols = frozenset(symbols)
+    self._hub._Update(self, lambda old: old - symbols)
+
+  def Close(self):
+    """Unsubscribes; iteration ends once queued ticks are consumed."""
+    if not self._hub._Unsubscribe(self):
+      return
+    self._queue.Close()
+    self._queue.UnregisterEventCallbacks()
+
+  def __iter__(self):
+    while True:
+      record = self._queue.Get()
+      if record is None:
+        return
+      yield record
+
+
+class QuoteHub(object):
+  """Shares one upstream quote stream among many in-process subscribers.
+
+  The hub keeps a single streaming connection open for the union of all
+  subscribers' symbols and fans each tick out to the subscribers of its
+  symbol. Subscription changes are batched: the connection is only replaced
+  once no further change has arrived for `debounce_secs` (or `max_delay_secs`
+  after the first pending change), and only if the union of symbols actually
+  changed. The replacement is opened before the old connection is closed.
+
+  hub = QuoteHub(session).Start()
+  sub = hub.Subscribe(['VRX', 'GILD'])
+  for record in sub:
+    ...
+
+  Stop() closes every open Subscription, ending its iteration.
+  """
+
+  def __init__(self, session, debounce_secs=1.0, max_delay_secs=5.0,
+               retry_secs=5.0, name='quotehub'):
+    self._session = session
+    self._debounce = debounce_secs
+    self._max_delay = max_delay_secs
+    self._retry = retry_secs
+    self._name = name
+    self._lock = threading.Lock()
+    # symbol -> tuple of Subscriptions. Replaced rather than mutated so that
+    # the dispatch path can read it without locking.
+    self._subscribers = {}
+    self._changed = threading.Event()
+    self._stop = threading.Event()
+    self._connection = None
+    self._connected_symbols = frozenset()
+    self._generation = 0
+    self._sub_ids = itertools.count()
+    self._subs = set()
+
+    event_collection.AddCallback(
+        '%s-subscribed-symbols' % (name,), self.NumSymbols)
+
+  def NumSymbols(self):
+    with self._lock:
+      return len(self._subscribers)
+
+  def Start(self):
+    thread = threadlib.Thread(target=self._Run)
+    thread.daemon = True
+    thread.name = '%s/manager' % (self._name,)
+    thread.start()
+    return self
+
+  def Stop(self):
+    with self._lock:
+      self._stop.set()
+      subs = list(self._subs)
+    self._changed.set()
+    for sub in subs:
+      sub.Close()
+    event_collection.RemoveCallback(
+        '%s-subscribed-symbols' % (self._name,), self.NumSymbols)
+
+  def Subscribe(self, symbols, policy=pipeline.CONFLATE, max_ticks=10000):
+    name = '%s-sub-%d' % (self._name, next(self._sub_ids))
+    sub = Subscription(self, policy, max_ticks, name)
+    with self._lock:
+      if self._stop.is_set():
+        raise RuntimeError('%s is stopped' % (self._name,))
+      self._subs.add(sub)
+    sub.AddSymbols(symbols)
+    return sub
+
+  def _Unsubscribe(self, sub):
+    """Drops all of sub's symbols. Returns False if it was already closed."""
+    with self._lock:
+      if sub not in self._subs:
+        return False
+      self._subs.remove(sub)
+    self._Update(sub, lambda old: frozenset())
+    return True
+
+  def _Update(self, sub, change):
+    """Sets sub's symbols to change(its current symbols)."""
+    with self._lock:
+      symbols = change(sub.symbols)
+      for symbol in sub.symbols - symbols:
+        remaining = tuple(s for s in self._subscribers[symbol] if s is not sub)
+        if remaining:
+          self._subscribers[symbol] = remaining
+        else:
+          del self._subscribers[symbol]
+      for symbol in symbols - sub.symbols:
+        self._subscribers[symbol] = self._subscribers.get(symbol, ()) + (sub,)
+      sub.symbols = symbols
+    self._changed.set()
+
+  def _Run(self):
+    while not self._stop.is_set():
+      self._changed.wait()
+      self._changed.clear()
+
+      # Debounce: keep absorbing changes until they stop for a while.
+      deadline = time.time() + self._max_delay
+      while not self._stop.is_set():
+        wait = min(self._debounce, deadline - time.time())
+        if wait <= 0 or not self._changed.wait(wait):
+          break
+        self._changed.clear()
+
+      if self._stop.is_set():
+        break
+
+      with self._lock:
+        wanted = frozenset(self._subscribers)
+      if wanted != self._connected_symbols:
+        self._Reconnect(wanted)
+
+    self._CloseConnection()
+
+  def _Reconnect(self, symbols):
+    event_collection.Increment('%s-reconnects' % (self._name,))
+    old = self._connection
+    if symbols:
+      try:
+        new = self._session.OpenQuoteStream(sorted(symbols))
+      except Exception as e:
+        logging.warning('%s: could not open stream: %s', self._name, e)
+        event_collection.Increment('%s-connect-errors' % (self._name,))
+        self._RetryLater()
+        return
+    else:
+      new = None
+
+    with self._lock:
+      self._generation += 1
+      generation = self._generation
+      self._connection = new
+      self._connected_symbols = symbols
+
+    if new is not None:
+      thread = threadlib.Thread(target=self._Read, args=(new, generation))
+      thread.daemon = True
+      thread.name = '%s/reader' % (self._name,)
+      thread.start()
+    if old is not None:
+      old.close()
+
+  def _RetryLater(self):
+    timer = threading.Timer(self._retry, self._changed.set)
+    timer.daemon = True
+    timer.start()
+
+  def _CloseConnection(self):
+    with self._lock:
+      self._generation += 1
+      old = self._connection
+      self._connection = None
+      self._connected_symbols = frozenset()
+    if old is not None:
+      old.close()
+
+  def _Read(self, response, generation):
+    try:
+      for record in stream.ParseStream(
+          response.iter_content(chunk_size=None)):
+        if self._generation != generation:
+          return
+        self._Dispatch(record)
+    except Exception as e:
+      if self._generation == generation:
+        logging.warning('%s: stream failed: %s', self._name, e)
+
+    # The current connection ended on its own; force a reconnect.
+    with self._lock:
+      if self._generation != generation:
+        return
+      self._connected_symbols = frozenset()
+    event_collection.Increment('%s-stream-errors' % (self._name,))
+    self._RetryLater()
+
+  def _Dispatch(self, record):
+    subs = self._subscribers.get(record.symbol)
+    if not subs:
+      return
+    for sub in subs:
+      sub.Put(record)
+    event_collection.Increment('%s-ticks-dispatched' % (self._name,))
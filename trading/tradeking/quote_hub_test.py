@@ -0,0 +1,89 @@
+#!/usr/bin/python -B
+
+import gflags
+import sys
+import threading
+import time
+import unittest
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import fake_server
+from projects.trading.tradeking import quote_hub
+from projects.trading.tradeking import tradeking
+
+
+FLAGS = gflags.FLAGS
+
+
+def _Consume(sub):
+  """Iterates over sub in a thread. Returns the thread and received records."""
+  received = []
+
+  def Run():
+    for record in sub:
+      received.append(record)
+
+  thread = threading.Thread(target=Run)
+  thread.daemon = True
+  thread.start()
+  return thread, received
+
+
+class QuoteHubTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_server.FakeTradeKingServer(
+        num_symbols=10, ticks_per_sec=2000, chunk_secs=0.02)
+    self.server.start()
+    self.session = tradeking.Session(
+        'key', 'secret', 'token', 'secret', api_url=self.server.url,
+        stream_url=self.server.url)
+    self.hub = quote_hub.QuoteHub(self.session, debounce_secs=0.01,
+                                  max_delay_secs=0.05, name='quotehub-test')
+    self.hub.Start()
+
+  def tearDown(self):
+    self.hub.Stop()
+    self.session.Close()
+    self.server.Shutdown()
+
+  def testSubscribersGetTheirSymbols(self):
+    symbols = self.server.symbols
+    sub_a = self.hub.Subscribe(symbols[:2])
+    sub_b = self.hub.Subscribe(symbols[1:3])
+    thread_a, received_a = _Consume(sub_a)
+    thread_b, received_b = _Consume(sub_b)
+    deadline = time.time() + 5
+    while (len(received_a) < 20 or len(received_b) < 20) and (
+        time.time() < deadline):
+      time.sleep(0.01)
+    self.assertEqual(3, self.hub.NumSymbols())
+
+    sub_a.Close()
+    thread_a.join(2)
+    self.assertFalse(thread_a.is_alive())
+    self.assertEqual(2, self.hub.NumSymbols())
+    self.assertTrue(set(r.symbol for r in received_a) <= set(symbols[:2]))
+    self.assertTrue(set(r.symbol for r in received_b) <= set(symbols[1:3]))
+    self.assertGreaterEqual(len(received_b), 20)
+
+  def testStopEndsActiveSubscriptions(self):
+    sub = self.hub.Subscribe(self.server.symbols[:2])
+    thread, received = _Consume(sub)
+    deadline = time.time() + 5
+    while not received and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertTrue(received)
+
+    self.hub.Stop()
+    thread.join(2)
+    self.assertFalse(thread.is_alive())
+    events = event_collection.GetEvents()
+    self.assertNotIn('quotehub-test-subscribed-symbols', events)
+    self.assertNotIn('quotehub-test-sub-0-queue-depth', events)
+    self.assertRaises(RuntimeError, self.hub.Subscribe, ['A'])
+
+
+if __name__ == '__main__':
+  FLAGS(sys.argv[:1])
+  unittest.main()
@@ -0,0 +1,236 @@
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import records
+
+
+DEFAULT_PATH = '/dev/shm/tradeking-quotes'
+
+_MAGIC = 'TKQUOTE1'
+_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('capacity', '<i8'),
+    # Number of slots assigned to symbols. Only ever grows, and is written
+    # after the slot's symbol, so readers never see an unnamed slot.
+    ('count', '<i8'),
+])
+_HEADER_BYTES = 64
+
+# One slot per symbol. `seq` is odd while the writer is updating the slot.
+SLOT_DTYPE = np.dtype([
+    ('seq', '<i8'),
+    ('timestamp', '<i8'),
+    ('symbol', 'S24'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('last', '<f8'),
+    ('vwap', '<f8'),
+    ('bidsz', '<i8'),
+    ('asksz', '<i8'),
+    ('vl', '<i8'),
+    ('cvol', '<i8'),
+])
+
+LatestQuote = collections.namedtuple('LatestQuote', [
+    'symbol',
+    'timestamp',
+    'bid',
+    'ask',
+    'last',
+    'vwap',
+    'bidsz',
+    'asksz',
+    'vl',
+    'cvol',
+])
+
+_NAN = float('nan')
+
+
+class StuckSlotError(Exception):
+  """A slot stayed mid-update, e.g. because its writer died while writing."""
+
+
+def _Map(f, mode, capacity=None):
+  if capacity is None:
+    size = None
+  else:
+    size = _HEADER_BYTES + capacity * SLOT_DTYPE.itemsize
+  raw = np.memmap(f, dtype=np.uint8, mode=mode, shape=size)
+  header = raw[:_HEADER_DTYPE.itemsize].view(_HEADER_DTYPE)
+  slots = raw[_HEADER_BYTES:].view(SLOT_DTYPE)
+  return raw, header, slots
+
+
+class QuoteTableWriter(object):
+  """Publishes the latest quote and trade per symbol to a shared mmap.
+
+  The table is a file, by default in /dev/shm, of fixed-width slots that any
+  process on the box can map with QuoteTableReader. Each slot carries a
+  seqlock-style sequence number: the writer makes it odd, updates the
+  fields, then makes it even again. Readers copy the slot and retry if the
+  number was odd or changed meanwhile, so they never block the writer and
+  never see a half-written quote. There must be a single writer per table.
+
+  Use OnTick as a StreamPipeline tap, or call it for each record.
+  """
+
+  def __init__(self, path=DEFAULT_PATH, capacity=4096, name='quotetable'):
+    self._name = name
+    self._lock = threading.Lock()
+    self._slot_of = {}
+
+    # Build the table under a temporary name so that readers opening the
+    # path never see it uninitialized.
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'w+b') as f:
+      self._raw, self._header, self._slots = _Map(f, 'w+', capacity)
+    self._header['capacity'] = capacity
+    self._header['count'] = 0
+    self._header['magic'] = _MAGIC
+    self._raw.flush()
+    os.rename(tmp_path, path)
+    self._capacity = capacity
+
+    self._seq = self._slots['seq']
+    self._columns = dict(
+        (name, self._slots[name]) for name in SLOT_DTYPE.names)
+    for name in ('bid', 'ask', 'last', 'vwap'):
+      self._columns[name][:] = _NAN
+
+    event_collection.AddCallback('%s-symbols' % (name,), self.NumSymbols)
+
+  def NumSymbols(self):
+    with self._lock:
+      return len(self._slot_of)
+
+  def _AssignLocked(self, symbol):
+    slot = len(self._slot_of)
+    if slot == self._capacity:
+      return None
+    self._columns['symbol'][slot] = symbol
+    self._slot_of[symbol] = slot
+    self._header['count'] = slot + 1
+    return slot
+
+  def OnTick(self, record):
+    with self._lock:
+      slot = self._slot_of.get(record.symbol)
+      if slot is None:
+        slot = self._AssignLocked(record.symbol)
+        if slot is None:
+          event_collection.Increment('%s-full' % (self._name,))
+          return
+
+      columns = self._columns
+      self._seq[slot] += 1
+      columns['timestamp'][slot] = record.timestamp
+      if type(record) is records.Quote:
+        columns['bid'][slot] = record.bid
+        columns['ask'][slot] = record.ask
+        columns['bidsz'][slot] = record.bidsz
+        columns['asksz'][slot] = record.asksz
+      else:
+        columns['last'][slot] = record.last
+        columns['vwap'][slot] = record.vwap
+        columns['vl'][slot] = record.vl
+        columns['cvol'][slot] = record.cvol
+      self._seq[slot] += 1
+
+  def Close(self):
+    with self._lock:
+      self._raw.flush()
+      del self._raw, self._header, self._slots, self._seq, self._columns
+
+
+class QuoteTableReader(object):
+  """Reads a table published by QuoteTableWriter, from any process.
+
+  reader = QuoteTableReader()
+  quote = reader.Get('VRX')
+  print quote.bid, quote.ask, quote.last
+
+  If the writer restarts it replaces the file; Stale() tells when the
+  reader should be recreated. A read that cannot get a consistent copy of a
+  slot within max_read_secs raises StuckSlotError rather than spinning.
+  """
+
+  def __init__(self, path=DEFAULT_PATH, max_read_secs=0.1):
+    self._path = path
+    self._max_read_secs = max_read_secs
+    with open(path, 'rb') as f:
+      self._inode = os.fstat(f.fileno()).st_ino
+      self._raw, self._header, self._slots = _Map(f, 'r')
+    if self._header['magic'][0] != _MAGIC:
+      raise ValueError('%s is not a quote table' % (path,))
+    self._seq = self._slots['seq']
+    self._slot_of = {}
+
+  def Stale(self):
+    try:
+      return os.stat(self._path).st_ino != self._inode
+    except OSError:
+      return True
+
+  def _Count(self):
+    return int(self._header['count'][0])
+
+  def _Refresh(self):
+    for slot in xrange(len(self._slot_of), self._Count()):
+      self._slot_of[str(self._slots['symbol'][slot])] = slot
+
+  def Symbols(self):
+    self._Refresh()
+    return sorted(self._slot_of)
+
+  def _ReadSlot(self, slot):
+    deadline = None
+    while True:
+      before = self._seq[slot]
+      if not before & 1:
+        row = self._slots[slot:slot + 1].copy()
+        if self._seq[slot] == before:
+          return row
+
+      event_collection.Increment('quotetable-read-retries')
+      now = time.time()
+      if deadline is None:
+        deadline = now + self._max_read_secs
+      elif now > deadline:
+        event_collection.Increment('quotetable-stuck-slots')
+        raise StuckSlotError('%s slot %d stuck mid-update' % (
+            self._path, slot))
+      # Let the writer finish if it is in this process.
+      time.sleep(0)
+
+  def Get(self, symbol):
+    """Returns symbol's LatestQuote, or None if it has not been published."""
+    slot = self._slot_of.get(symbol)
+    if slot is None:
+      self._Refresh()
+      slot = self._slot_of.get(symbol)
+      if slot is None:
+        return None
+    row = self._ReadSlot(slot)[0]
+    return LatestQuote(
+        symbol, int(row['timestamp']), float(row['bid']), float(row['ask']),
+        float(row['last']), float(row['vwap']), int(row['bidsz']),
+        int(row['asksz']), int(row['vl']), int(row['cvol']))
+
+  def Snapshot(self):
+    """Returns a SLOT_DTYPE array of every published symbol.
+
+    Each row is consistent on its own; rows are not from a single instant.
+    """
+    n = self._Count()
+    before = self._seq[:n].copy()
+    rows = self._slots[:n].copy()
+    torn = (before != self._seq[:n]) | ((before & 1) == 1)
+    for slot in np.flatnonzero(torn):
+      rows[slot] = self._ReadSlot(slot)[0]
+    return rows
@@ -0,0 +1,105 @@
+#!/usr/bin/python -B
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from projects.trading.tradeking import quote_table
+from projects.trading.tradeking import records
+
+
+def _Quote(symbol, i):
+  # Every field is derived from i, so a row mixing two updates is detectable.
+  return records.Quote(symbol, i, float(i), float(i), i, i)
+
+
+def _Trade(symbol, i):
+  return records.Trade(symbol, i, float(i), i, i, float(i))
+
+
+class QuoteTableTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'quotes')
+    self.writer = quote_table.QuoteTableWriter(
+        self.path, capacity=4, name='quotetable-test')
+
+  def tearDown(self):
+    self.writer.Close()
+    shutil.rmtree(self.directory)
+
+  def testGet(self):
+    reader = quote_table.QuoteTableReader(self.path)
+    self.assertEqual(None, reader.Get('A'))
+    self.writer.OnTick(_Quote('A', 3))
+    self.writer.OnTick(_Trade('B', 5))
+    quote = reader.Get('A')
+    self.assertEqual((3.0, 3.0, 3, 3), (quote.bid, quote.ask, quote.bidsz,
+                                        quote.asksz))
+    # No trade yet.
+    self.assertNotEqual(quote.last, quote.last)
+    trade = reader.Get('B')
+    self.assertEqual((5, 5.0, 5, 5), (trade.timestamp, trade.last, trade.vl,
+                                      trade.cvol))
+    self.assertEqual(['A', 'B'], reader.Symbols())
+
+  def testFullTableDropsNewSymbols(self):
+    for symbol in 'ABCDE':
+      self.writer.OnTick(_Quote(symbol, 1))
+    self.assertEqual(4, self.writer.NumSymbols())
+    reader = quote_table.QuoteTableReader(self.path)
+    self.assertEqual(['A', 'B', 'C', 'D'], reader.Symbols())
+    self.assertEqual(None, reader.Get('E'))
+
+  def testStuckSlotRaises(self):
+    self.writer.OnTick(_Quote('A', 1))
+    self.writer._seq[0] += 1  # As if the writer died mid-update.
+    reader = quote_table.QuoteTableReader(self.path, max_read_secs=0.01)
+    self.assertRaises(quote_table.StuckSlotError, reader.Get, 'A')
+    self.assertRaises(quote_table.StuckSlotError, reader.Snapshot)
+
+  def testStale(self):
+    reader = quote_table.QuoteTableReader(self.path)
+    self.assertFalse(reader.Stale())
+    quote_table.QuoteTableWriter(self.path, name='quotetable-test').Close()
+    self.assertTrue(reader.Stale())
+
+  def testReaderRacingWriterNeverSeesTornRows(self):
+    symbols = ['A', 'B', 'C']
+    for symbol in symbols:
+      self.writer.OnTick(_Quote(symbol, 0))
+    stop = threading.Event()
+
+    def Write():
+      i = 0
+      while not stop.is_set():
+        i += 1
+        for symbol in symbols:
+          self.writer.OnTick(_Quote(symbol, i))
+
+    writer = threading.Thread(target=Write)
+    writer.start()
+    reader = quote_table.QuoteTableReader(self.path)
+    try:
+      deadline = time.time() + 0.5
+      num_snapshots = 0
+      while time.time() < deadline:
+        for row in reader.Snapshot():
+          i = row['timestamp']
+          self.assertEqual((i, i, i, i), (row['bid'], row['ask'],
+                                          row['bidsz'], row['asksz']))
+        quote = reader.Get('B')
+        self.assertEqual(quote.timestamp, quote.bidsz)
+        num_snapshots += 1
+    finally:
+      stop.set()
+      writer.join()
+    self.assertGreater(num_snapshots, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+_NAN = float('nan')
+
+
+def _Float(value):
+  if not value:
+    return _NAN
+  return float(value)
+
+
+def _Int(value):
+  if not value:
+    return 0
+  return int(value)
+
+
+def _Intern(value):
+  if value is None:
+    return None
+  return intern(str(value))
+
+
+class Quote(object):
+  """A top-of-book quote from the streaming API.
+
+  Numeric fields are parsed once when the record is built. String fields that
+  repeat across ticks (symbol, exchange, condition) are interned so that a day
+  of records shares one copy of each.
+  """
+
+  __slots__ = ('symbol', 'timestamp', 'bid', 'ask', 'bidsz', 'asksz', 'exch',
+               'qcond')
+
+  def __init__(self, symbol, timestamp, bid, ask, bidsz, asksz, exch=None,
+               qcond=None):
+    self.symbol = symbol
+    self.timestamp = timestamp
+    self.bid = bid
+    self.ask = ask
+    self.bidsz = bidsz
+    self.asksz = asksz
+    self.exch = exch
+    self.qcond = qcond
+
+  def Price(self):
+    return (self.bid + self.ask) / 2.0
+
+  def __repr__(self):
+    return 'Quote(%s, %d, bid=%s, ask=%s, bidsz=%d, asksz=%d)' % (
+        self.symbol, self.timestamp, self.bid, self.ask, self.bidsz,
+        self.asksz)
+
+
+class Trade(object):
+  """A trade print from the streaming API. See Quote."""
+
+  __slots__ = ('symbol', 'timestamp', 'last', 'vl', 'cvol', 'vwap', 'exch')
+
+  def __init__(self, symbol, timestamp, last, vl, cvol, vwap, exch=None):
+    self.symbol = symbol
+    self.timestamp = timestamp
+    self.last = last
+    self.vl = vl
+    self.cvol = cvol
+    self.vwap = vwap
+    self.exch = exch
+
+  def Price(self):
+    return self.last
+
+  def __repr__(self):
+    return 'Trade(%s, %d, last=%s, vl=%d, cvol=%d, vwap=%s)' % (
+        self.symbol, self.timestamp, self.last, self.vl, self.cvol, self.vwap)
+
+
+def QuoteFromFields(fields):
+  return Quote(
+      _Intern(fields.get('symbol')),
+      _Int(fields.get('timestamp')),
+      _Float(fields.get('bid')),
+      _Float(fields.get('ask')),
+      _Int(fields.get('bidsz')),
+      _Int(fields.get('asksz')),
+      _Intern(fields.get('exch')),
+      _Intern(fields.get('qcond')),
+  )
+
+
+def TradeFromFields(fields):
+  return Trade(
+      _Intern(fields.get('symbol')),
+      _Int(fields.get('timestamp')),
+      _Float(fields.get('last')),
+      _Int(fields.get('vl')),
+      _Int(fields.get('cvol')),
+      _Float(fields.get('vwap')),
+      _Intern(fields.get('exch')),
+  )
+
+
+# Maps the tag of a streamed message to the function that builds its record.
+RECORD_BUILDERS = {
+    'quote': QuoteFromFields,
+    'trade': TradeFromFields,
+}
@@ -0,0 +1,67 @@
+import glob
+import os
+import time
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import ticklog
+
+
+REALTIME = 1.0
+AS_FAST_AS_POSSIBLE = None
+
+
+def LogPaths(directory, first_day=None, last_day=None):
+  """Returns the tick logs in directory, oldest first.
+
+  first_day and last_day are optional inclusive 'YYYYMMDD' bounds.
+  """
+  paths = []
+  for path in sorted(glob.glob(ticklog.LogPath(directory, '*'))):
+    day = os.path.basename(path).split('.')[0]
+    if first_day is not None and day < first_day:
+      continue
+    if last_day is not None and day > last_day:
+      continue
+    paths.append(path)
+  return paths
+
+
+def Replay(paths, speed=AS_FAST_AS_POSSIBLE, symbols=None, start_ts=None,
+           end_ts=None):
+  """Yields recorded Quote and Trade records as if they were streamed live.
+
+  The result can be consumed anywhere the output of stream.ParseStream() or
+  Session.StreamQuotes() is. Ticks are yielded in recorded order from each of
+  `paths` in turn, restricted to `symbols` (if given) and to timestamps in
+  [start_ts, end_ts). The index of each log is used to skip blocks that
+  cannot match.
+
+  With speed=REALTIME ticks are paced by their recorded timestamps; with
+  speed=N they are paced N times faster; with AS_FAST_AS_POSSIBLE they are
+  yielded without pausing.
+
+  # Replay one symbol's morning at 10x into the live display:
+  ticks = Replay(LogPaths(log_dir, '20160317', '20160317'), speed=10,
+                 symbols=['VRX'], start_ts=open_ts, end_ts=noon_ts)
+  """
+  if symbols is not None:
+    symbols = set(symbols)
+
+  wall_start = None
+  ts_start = None
+  for path in paths:
+    reader = ticklog.TickLogReader(path)
+    ticks = reader.Select(symbols, start_ts, end_ts)
+
+    for record in ticklog.IterRecords(ticks):
+      if speed is not AS_FAST_AS_POSSIBLE:
+        if wall_start is None:
+          wall_start = time.time()
+          ts_start = record.timestamp
+        delay = (wall_start + (record.timestamp - ts_start) / float(speed) -
+                 time.time())
+        if delay > 0:
+          time.sleep(delay)
+
+      event_collection.Increment('replay-ticks')
+      yield record
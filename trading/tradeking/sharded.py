@@ -0,0 +1,180 @@
+import multiprocessing
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from projects.lib.base import logging
+from projects.lib.concurrency import threadlib
+from projects.lib.telemetry import event_collection
+from projects.lib.telemetry import histogram
+from projects.trading.tradeking import pipeline
+from projects.trading.tradeking import stream
+from projects.trading.tradeking import ticklog
+
+
+def Partition(symbols, num_shards):
+  """Splits symbols into num_shards lists of nearly equal size."""
+  symbols = sorted(set(symbols))
+  return [symbols[i::num_shards] for i in xrange(num_shards)
+          if symbols[i::num_shards]]
+
+
+def _RunShard(session_factory, symbols, conn):
+  """Worker process: streams symbols and sends parsed ticks to the parent.
+
+  Each message is (time the chunk was read, TICK_DTYPE array as a string),
+  so ticks cross the pipe as one buffer per chunk rather than one pickled
+  object per tick. The last message is None, or an error string.
+  """
+  try:
+    session = session_factory()
+    response = session.OpenQuoteStream(symbols)
+    parser = stream.StreamParser()
+    for chunk in response.iter_content(chunk_size=None):
+      read_at = time.time()
+      rows = [ticklog.ToRow(record) for record in parser.Feed(chunk)]
+      if rows:
+        ticks = np.array(rows, dtype=ticklog.TICK_DTYPE)
+        conn.send((read_at, ticks.tostring()))
+    conn.send(None)
+  except Exception:
+    conn.send(traceback.format_exc())
+  finally:
+    conn.close()
+
+
+class _Shard(object):
+
+  def __init__(self, index, symbols, name):
+    self.index = index
+    self.symbols = symbols
+    self.name = '%s-shard-%d' % (name, index)
+    self.process = None
+    self.conn = None
+    self.error = None
+    self.lag_ms = histogram.Histogram('%s-lag-ms' % (self.name,))
+
+
+class ShardedStream(object):
+  """Streams a large symbol universe from several worker processes.
+
+  Parsing the stream is CPU-bound, so one process cannot keep up with a
+  large universe. The symbols are partitioned across num_shards worker
+  processes, each with its own stream connection and parser. Workers send
+  parsed ticks to the parent over pipes, one packed array per chunk, and a
+  thread per shard feeds them into a single TickQueue that the consumer
+  iterates over. Each shard's ticks keep their stream order; ticks from
+  different shards are interleaved in order of arrival.
+
+  session_factory is called in each worker to build its own Session, so it
+  must be picklable, e.g. functools.partial(tradeking.Session, *credentials).
+
+  ticks = ShardedStream(factory, symbols, num_shards=4).Start()
+  try:
+    for record in ticks:
+      ...
+  finally:
+    ticks.Stop()
+
+  Stop() terminates the workers; iteration then ends without an error.
+
+  Per shard, ticks and bytes received and the lag from the worker reading a
+  chunk to its ticks reaching the parent are published to event_collection
+  under <name>-shard-<n>-*. The merged queue reports as <name>-*, like
+  pipeline.StreamPipeline.
+  """
+
+  def __init__(self, session_factory, symbols, num_shards=4,
+               policy=pipeline.BLOCK, max_ticks=10000, name='sharded'):
+    self._session_factory = session_factory
+    self._shards = [
+        _Shard(i, shard_symbols, name)
+        for i, shard_symbols in enumerate(Partition(symbols, num_shards))]
+    self._ticks = pipeline.TickQueue(policy, max_ticks, name)
+    self._name = name
+    self._lock = threading.Lock()
+    self._running = len(self._shards)
+    self._stopping = False
+    self._threads = []
+
+  def Start(self):
+    for shard in self._shards:
+      parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+      shard.conn = parent_conn
+      shard.process = multiprocessing.Process(
+          target=_RunShard,
+          args=(self._session_factory, shard.symbols, child_conn),
+          name=shard.name)
+      shard.process.daemon = True
+      shard.process.start()
+      # Only the worker writes to its end of the pipe.
+      child_conn.close()
+
+      thread = threadlib.Thread(target=self._Receive, args=(shard,))
+      thread.daemon = True
+      thread.name = '%s/receiver' % (shard.name,)
+      thread.start()
+      self._threads.append(thread)
+    if not self._shards:
+      self._ticks.Close()
+    return self
+
+  def Stop(self, timeout_secs=5.0):
+    """Terminates the workers and waits up to timeout_secs for each."""
+    self._stopping = True
+    for shard in self._shards:
+      if shard.process is not None and shard.process.is_alive():
+        shard.process.terminate()
+    for shard in self._shards:
+      if shard.process is not None:
+        shard.process.join(timeout_secs)
+    # Unblocks receivers waiting to put into a full queue.
+    self._ticks.Close()
+    for thread in self._threads:
+      thread.join(timeout_secs)
+
+    self._ticks.UnregisterEventCallbacks()
+    for shard in self._shards:
+      shard.lag_ms.Unregister()
+
+  def _Receive(self, shard):
+    try:
+      while True:
+        message = shard.conn.recv()
+        if message is None:
+          break
+        if isinstance(message, str):
+          shard.error = message
+          logging.warning('%s failed:\n%s', shard.name, message)
+          break
+        read_at, data = message
+        shard.lag_ms.Add((time.time() - read_at) * 1000)
+        ticks = np.frombuffer(data, dtype=ticklog.TICK_DTYPE)
+        event_collection.Add('%s-ticks' % (shard.name,), len(ticks))
+        event_collection.Add('%s-bytes' % (shard.name,), len(data))
+        for record in ticklog.IterRecords(ticks):
+          self._ticks.Put(record)
+    except EOFError:
+      # Expected once Stop() has terminated the worker.
+      if not self._stopping:
+        shard.error = shard.error or '%s exited unexpectedly' % (shard.name,)
+        logging.warning('%s', shard.error)
+    shard.conn.close()
+
+    with self._lock:
+      self._running -= 1
+      if not self._running:
+        self._ticks.Close()
+
+  def __iter__(self):
+    while True:
+      record = self._ticks.Get()
+      if record is None:
+        break
+      yield record
+
+    errors = [shard.error for shard in self._shards if shard.error]
+    if errors:
+      raise RuntimeError('\n'.join(errors))
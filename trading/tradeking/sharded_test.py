@@ -0,0 +1,74 @@
+#!/usr/bin/python -B
+
+import functools
+import gflags
+import sys
+import unittest
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import fake_server
+from projects.trading.tradeking import sharded
+from projects.trading.tradeking import tradeking
+
+
+FLAGS = gflags.FLAGS
+
+
+class PartitionTest(unittest.TestCase):
+
+  def testPartition(self):
+    self.assertEqual([['A', 'C', 'E'], ['B', 'D']],
+                     sharded.Partition(['E', 'D', 'C', 'B', 'A', 'A'], 2))
+    self.assertEqual([['A'], ['B']], sharded.Partition(['A', 'B'], 4))
+
+
+class ShardedStreamTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_server.FakeTradeKingServer(
+        num_symbols=20, ticks_per_sec=2000, chunk_secs=0.02)
+    self.server.start()
+    self.factory = functools.partial(
+        tradeking.Session, 'key', 'secret', 'token', 'secret',
+        api_url=self.server.url, stream_url=self.server.url)
+
+  def tearDown(self):
+    self.server.Shutdown()
+
+  def testStopEndsIterationCleanly(self):
+    ticks = sharded.ShardedStream(self.factory, self.server.symbols,
+                                  num_shards=2, name='sharded-test').Start()
+    received = set()
+    for record in ticks:
+      received.add(record.symbol)
+      if len(received) == len(self.server.symbols):
+        break
+    ticks.Stop()
+
+    # Anything still queued drains, and no error is raised.
+    for record in ticks:
+      pass
+    self.assertEqual(set(self.server.symbols), received)
+    for shard in ticks._shards:
+      self.assertFalse(shard.process.is_alive())
+      self.assertEqual(None, shard.error)
+    events = event_collection.GetEvents()
+    self.assertNotIn('sharded-test-queue-depth', events)
+    self.assertNotIn('sharded-test-shard-0-lag-ms', events)
+
+  def testWorkerFailureIsRaised(self):
+    # Nothing listens on the stream URL.
+    factory = functools.partial(
+        tradeking.Session, 'key', 'secret', 'token', 'secret',
+        api_url=self.server.url, stream_url='http://127.0.0.1:1')
+    ticks = sharded.ShardedStream(factory, ['A', 'B'], num_shards=2,
+                                  name='sharded-test').Start()
+    try:
+      self.assertRaises(RuntimeError, list, ticks)
+    finally:
+      ticks.Stop()
+
+
+if __name__ == '__main__':
+  FLAGS(sys.argv[:1])
+  unittest.main()
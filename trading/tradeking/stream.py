@@ -0,0 +1,86 @@
+import xml.etree.cElementTree as ET
+
+from projects.trading.tradeking import records
+
+
+# The stream is a sequence of top-level elements with no enclosing document
+# element, so the parser is primed with a synthetic root.
+_STREAM_ROOT = '<stream>'
+
+# Depths of elements in the stream, counting the synthetic root as 1.
+_MESSAGE_DEPTH = 2
+_FIELD_DEPTH = 3
+
+
+class _RecordBuilder(object):
+  """Parser target that turns each streamed message into a record.
+
+  Only messages with a known builder in records.RECORD_BUILDERS are kept;
+  anything else (e.g. <status>) is skipped without building any state.
+  """
+
+  def __init__(self):
+    self.records = []
+    self._depth = 0
+    self._builder = None
+    self._fields = None
+    self._text = []
+
+  def start(self, tag, unused_attrib):
+    self._depth += 1
+    if self._depth == _MESSAGE_DEPTH:
+      self._builder = records.RECORD_BUILDERS.get(tag)
+      if self._builder is not None:
+        self._fields = {}
+    elif self._depth == _FIELD_DEPTH and self._fields is not None:
+      self._text = []
+
+  def data(self, data):
+    if self._depth == _FIELD_DEPTH and self._fields is not None:
+      self._text.append(data)
+
+  def end(self, tag):
+    if self._fields is not None:
+      if self._depth == _FIELD_DEPTH:
+        self._fields[tag] = ''.join(self._text)
+      elif self._depth == _MESSAGE_DEPTH:
+        self.records.append(self._builder(self._fields))
+        self._builder = None
+        self._fields = None
+    self._depth -= 1
+
+  def close(self):
+    pass
+
+
+class StreamParser(object):
+  """Incremental parser for the TradeKing streaming XML API.
+
+  Raw chunks of the response body are fed in as they arrive off the socket;
+  chunk boundaries need not line up with element boundaries. Each call to
+  Feed() returns the records completed by that chunk.
+
+  parser = StreamParser()
+  for chunk in response.iter_content(chunk_size=None):
+    for record in parser.Feed(chunk):
+      ...
+  """
+
+  def __init__(self):
+    self._target = _RecordBuilder()
+    self._parser = ET.XMLParser(target=self._target)
+    self._parser.feed(_STREAM_ROOT)
+
+  def Feed(self, chunk):
+    self._parser.feed(chunk)
+    completed = self._target.records
+    self._target.records = []
+    return completed
+
+
+def ParseStream(chunks):
+  """Yields Quote and Trade records parsed from an iterable of raw chunks."""
+  parser = StreamParser()
+  for chunk in chunks:
+    for record in parser.Feed(chunk):
+      yield record
@@ -0,0 +1,126 @@
+#!/usr/bin/python -B
+
+import unittest
+import xml.etree.cElementTree as ET
+
+from projects.trading.tradeking import records
+from projects.trading.tradeking import stream
+
+
+_QUOTE = (
+    '<quote><ask>9.75</ask><asksz>3</asksz><bid>9.70</bid><bidsz>12</bidsz>'
+    '<datetime>2016-03-17T09:30:00-04:00</datetime><exch>Q</exch>'
+    '<qcond>REGULAR</qcond><symbol>VRX</symbol>'
+    '<timestamp>1458221400</timestamp></quote>')
+_TRADE = (
+    '<trade><cvol>1900</cvol><datetime>2016-03-17T09:30:01-04:00</datetime>'
+    '<exch>NYSE</exch><last>9.72</last><symbol>VRX</symbol>'
+    '<timestamp>1458221401</timestamp><vl>1900</vl><vwap>9.72</vwap></trade>')
+_SAMPLE_STREAM = '<status>connected</status>' + _QUOTE + '\n' + _TRADE
+
+
+def _Chunks(data, chunk_size):
+  return [data[i:i + chunk_size] for i in xrange(0, len(data), chunk_size)]
+
+
+class StreamParserTest(unittest.TestCase):
+
+  def assertSampleRecords(self, parsed):
+    self.assertEqual(2, len(parsed))
+    quote, trade = parsed
+    self.assertEqual(records.Quote, type(quote))
+    self.assertEqual(
+        ('VRX', 1458221400, 9.70, 9.75, 12, 3, 'Q', 'REGULAR'),
+        (quote.symbol, quote.timestamp, quote.bid, quote.ask, quote.bidsz,
+         quote.asksz, quote.exch, quote.qcond))
+    self.assertEqual(records.Trade, type(trade))
+    self.assertEqual(
+        ('VRX', 1458221401, 9.72, 1900, 1900, 9.72, 'NYSE'),
+        (trade.symbol, trade.timestamp, trade.last, trade.vl, trade.cvol,
+         trade.vwap, trade.exch))
+
+  def testChunkBoundariesDontMatter(self):
+    # Chunk boundaries from the socket are arbitrary.
+    for chunk_size in (1, 7, 64, len(_SAMPLE_STREAM)):
+      self.assertSampleRecords(
+          list(stream.ParseStream(_Chunks(_SAMPLE_STREAM, chunk_size))))
+
+  def testFeedReturnsCompletedRecords(self):
+    parser = stream.StreamParser()
+    split = _QUOTE.index('<symbol>') + 3
+    self.assertEqual([], parser.Feed(_QUOTE[:split]))
+    completed = parser.Feed(_QUOTE[split:] + _TRADE[:10])
+    self.assertEqual(['VRX'], [r.symbol for r in completed])
+    self.assertEqual(records.Trade, type(parser.Feed(_TRADE[10:])[0]))
+    self.assertEqual([], parser.Feed(''))
+
+  def testUnknownMessagesAreSkipped(self):
+    data = ('<status>connected</status>'
+            '<heartbeat><time><sec>1</sec></time></heartbeat>' + _QUOTE +
+            '<status>disconnected</status>')
+    parsed = list(stream.ParseStream([data]))
+    self.assertEqual([records.Quote], [type(r) for r in parsed])
+
+  def testMissingAndEmptyFields(self):
+    data = ('<quote><symbol>A</symbol><bid></bid></quote>'
+            '<trade><symbol>A</symbol><last>1.5</last></trade>')
+    quote, trade = stream.ParseStream([data])
+    self.assertTrue(quote.bid != quote.bid)
+    self.assertTrue(quote.ask != quote.ask)
+    self.assertEqual((0, 0, 0, None), (quote.timestamp, quote.bidsz,
+                                       quote.asksz, quote.exch))
+    self.assertEqual((1.5, 0, 0), (trade.last, trade.vl, trade.cvol))
+    self.assertTrue(trade.vwap != trade.vwap)
+
+  def testSymbolsAreInterned(self):
+    parsed = list(stream.ParseStream(_Chunks(_QUOTE * 2, 5)))
+    self.assertEqual(2, len(parsed))
+    self.assertTrue(parsed[0].symbol is parsed[1].symbol)
+    self.assertTrue(parsed[0].qcond is parsed[1].qcond)
+
+  def testMalformedXmlRaises(self):
+    parser = stream.StreamParser()
+    self.assertRaises(ET.ParseError, parser.Feed,
+                      '<quote><bid>1</ask></quote>')
+    self.assertRaises(ET.ParseError, list,
+                      stream.ParseStream([_QUOTE, '<trade><<']))
+
+  def testRecordsBeforeMalformedXmlAreYielded(self):
+    parsed = []
+    try:
+      for record in stream.ParseStream([_QUOTE, '</stream><quote>']):
+        parsed.append(record)
+      self.fail('No error raised')
+    except ET.ParseError:
+      pass
+    self.assertEqual(['VRX'], [r.symbol for r in parsed])
+
+  def testBadNumberRaises(self):
+    self.assertRaises(ValueError, list, stream.ParseStream(
+        ['<quote><symbol>A</symbol><bid>n/a</bid></quote>']))
+
+
+class RecordsTest(unittest.TestCase):
+
+  def testSlots(self):
+    quote = records.Quote('A', 1, 1.0, 2.0, 1, 1)
+    trade = records.Trade('A', 1, 1.5, 1, 1, 1.5)
+    for record in (quote, trade):
+      self.assertFalse(hasattr(record, '__dict__'))
+      self.assertRaises(AttributeError, setattr, record, 'note', 'x')
+
+  def testPrice(self):
+    self.assertEqual(1.5, records.Quote('A', 1, 1.0, 2.0, 1, 1).Price())
+    self.assertEqual(3.25, records.Trade('A', 1, 3.25, 1, 1, 3.0).Price())
+
+  def testBuilders(self):
+    self.assertEqual(
+        set(['quote', 'trade']), set(records.RECORD_BUILDERS))
+    quote = records.QuoteFromFields(
+        {'symbol': u'A', 'bid': '1.25', 'bidsz': '7'})
+    self.assertEqual(str, type(quote.symbol))
+    self.assertEqual((1.25, 7), (quote.bid, quote.bidsz))
+
+
+if __name__ == '__main__':
+  unittest.main()
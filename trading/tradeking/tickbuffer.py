@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+
+from projects.trading.tradeking import records
+
+
+_COLUMN_DTYPES = {
+    records.Quote: [
+        ('timestamp', np.int64),
+        ('bid', np.float64),
+        ('ask', np.float64),
+        ('bidsz', np.int32),
+        ('asksz', np.int32),
+    ],
+    records.Trade: [
+        ('timestamp', np.int64),
+        ('last', np.float64),
+        ('vl', np.int64),
+        ('cvol', np.int64),
+        ('vwap', np.float64),
+    ],
+}
+
+
+class TickRing(object):
+  """Fixed-size columnar ring buffer holding the most recent ticks.
+
+  Each column is a preallocated NumPy array, so appending a tick writes a few
+  machine words and allocates nothing. Once full, the oldest tick is
+  overwritten.
+  """
+
+  def __init__(self, capacity, dtypes):
+    self._capacity = capacity
+    self._names = tuple(name for name, _ in dtypes)
+    self._columns = dict(
+        (name, np.zeros(capacity, dtype=dtype)) for name, dtype in dtypes)
+    self._count = 0
+
+  def __len__(self):
+    return min(self._count, self._capacity)
+
+  def Capacity(self):
+    return self._capacity
+
+  def Append(self, record):
+    i = self._count % self._capacity
+    for name in self._names:
+      self._columns[name][i] = getattr(record, name)
+    self._count += 1
+
+  def Column(self, name):
+    """Returns the named column in oldest-to-newest order.
+
+    The result is a view when the ring has not wrapped and a copy otherwise.
+    """
+    column = self._columns[name]
+    if self._count <= self._capacity:
+      return column[:self._count]
+    start = self._count % self._capacity
+    return np.concatenate((column[start:], column[:start]))
+
+  def Columns(self):
+    return dict((name, self.Column(name)) for name in self._names)
+
+  def Last(self, name):
+    if not self._count:
+      return None
+    return self._columns[name][(self._count - 1) % self._capacity]
+
+
+class TickHistory(object):
+  """Per-symbol quote and trade rings for the last `capacity` ticks of each."""
+
+  def __init__(self, capacity):
+    self._capacity = capacity
+    self._rings = {}
+    self._lock = threading.Lock()
+
+  def Add(self, record):
+    key = (record.symbol, type(record))
+    ring = self._rings.get(key)
+    if ring is None:
+      with self._lock:
+        ring = self._rings.setdefault(
+            key, TickRing(self._capacity, _COLUMN_DTYPES[type(record)]))
+    ring.Append(record)
+
+  def Quotes(self, symbol):
+    return self._rings.get((symbol, records.Quote))
+
+  def Trades(self, symbol):
+    return self._rings.get((symbol, records.Trade))
+
+  def Symbols(self):
+    with self._lock:
+      return sorted(set(symbol for symbol, _ in self._rings))
@@ -0,0 +1,105 @@
+#!/usr/bin/python -B
+
+import unittest
+
+import numpy as np
+
+from projects.trading.tradeking import pipeline
+from projects.trading.tradeking import records
+from projects.trading.tradeking import tickbuffer
+
+
+def _Quote(symbol, i):
+  return records.Quote(symbol, i, i + 0.25, i + 0.75, i, 2 * i)
+
+
+def _Trade(symbol, i):
+  return records.Trade(symbol, i, i + 0.5, i, 10 * i, i + 0.125)
+
+
+class TickRingTest(unittest.TestCase):
+
+  def _Ring(self, capacity):
+    return tickbuffer.TickRing(
+        capacity, tickbuffer._COLUMN_DTYPES[records.Quote])
+
+  def testEmpty(self):
+    ring = self._Ring(4)
+    self.assertEqual(0, len(ring))
+    self.assertEqual(4, ring.Capacity())
+    self.assertEqual(None, ring.Last('bid'))
+    self.assertEqual([], list(ring.Column('bid')))
+
+  def testBeforeWrapping(self):
+    ring = self._Ring(4)
+    for i in xrange(3):
+      ring.Append(_Quote('A', i))
+    self.assertEqual(3, len(ring))
+    self.assertEqual([0, 1, 2], list(ring.Column('timestamp')))
+    self.assertEqual([0.25, 1.25, 2.25], list(ring.Column('bid')))
+    self.assertEqual(2.75, ring.Last('ask'))
+
+  def testWrapAroundOverwritesOldest(self):
+    ring = self._Ring(4)
+    for i in xrange(10):
+      ring.Append(_Quote('A', i))
+    self.assertEqual(4, len(ring))
+    columns = ring.Columns()
+    self.assertEqual([6, 7, 8, 9], list(columns['timestamp']))
+    self.assertEqual([12, 14, 16, 18], list(columns['asksz']))
+    self.assertEqual(9, ring.Last('timestamp'))
+
+  def testExactlyFull(self):
+    ring = self._Ring(4)
+    for i in xrange(4):
+      ring.Append(_Quote('A', i))
+    self.assertEqual([0, 1, 2, 3], list(ring.Column('timestamp')))
+    ring.Append(_Quote('A', 4))
+    self.assertEqual([1, 2, 3, 4], list(ring.Column('timestamp')))
+
+  def testColumnDtypes(self):
+    ring = self._Ring(2)
+    ring.Append(_Quote('A', 1))
+    self.assertEqual(np.int64, ring.Column('timestamp').dtype)
+    self.assertEqual(np.float64, ring.Column('bid').dtype)
+    self.assertEqual(np.int32, ring.Column('bidsz').dtype)
+
+  def testWrappedColumnIsACopy(self):
+    ring = self._Ring(2)
+    for i in xrange(3):
+      ring.Append(_Quote('A', i))
+    column = ring.Column('timestamp')
+    ring.Append(_Quote('A', 3))
+    self.assertEqual([1, 2], list(column))
+
+
+class TickHistoryTest(unittest.TestCase):
+
+  def testSeparatesSymbolsAndTypes(self):
+    history = tickbuffer.TickHistory(3)
+    for i in xrange(5):
+      history.Add(_Quote('A', i))
+      history.Add(_Trade('A', i))
+    history.Add(_Trade('B', 7))
+
+    self.assertEqual(['A', 'B'], history.Symbols())
+    self.assertEqual([2, 3, 4], list(history.Quotes('A').Column('timestamp')))
+    self.assertEqual([20, 30, 40], list(history.Trades('A').Column('cvol')))
+    self.assertEqual(None, history.Quotes('B'))
+    self.assertEqual(7.5, history.Trades('B').Last('last'))
+    self.assertEqual(None, history.Trades('C'))
+
+  def testAsPipelineTap(self):
+    quote = ('<quote><ask>2</ask><asksz>1</asksz><bid>1</bid><bidsz>1</bidsz>'
+             '<symbol>A</symbol><timestamp>%d</timestamp></quote>')
+    chunks = [''.join(quote % (i,) for i in xrange(5))]
+    history = tickbuffer.TickHistory(3)
+    ticks = pipeline.StreamPipeline(iter(chunks), tap=history.Add,
+                                    name='tickbuffer-test').Start()
+    self.assertEqual(5, len(list(ticks)))
+    ticks.Stop()
+    self.assertEqual([2, 3, 4], list(history.Quotes('A').Column('timestamp')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,349 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import records
+
+
+KIND_QUOTE = 0
+KIND_TRADE = 1
+
+# One fixed-width row per tick. Fields that do not apply to a tick's kind are
+# NaN or 0. Exchange and quote condition are not recorded.
+TICK_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('kind', 'u1'),
+    ('symbol', 'S24'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('last', '<f8'),
+    ('vwap', '<f8'),
+    ('bidsz', '<i4'),
+    ('asksz', '<i4'),
+    ('vl', '<i8'),
+    ('cvol', '<i8'),
+])
+
+# Ticks per index block. The index records, for each block, its first
+# timestamp and which symbols appear in it.
+INDEX_BLOCK_TICKS = 4096
+
+_NAN = float('nan')
+_LOG_SUFFIX = '.ticks'
+_INDEX_SUFFIX = '.idx'
+
+
+def LogPath(directory, day):
+  """Returns the path of the log for `day`, a 'YYYYMMDD' string."""
+  return os.path.join(directory, '%s%s' % (day, _LOG_SUFFIX))
+
+
+def _IndexPath(log_path):
+  return log_path + _INDEX_SUFFIX
+
+
+def ToRow(record):
+  """Converts a Quote or Trade into a tuple for one TICK_DTYPE row."""
+  if type(record) is records.Quote:
+    return (record.timestamp, KIND_QUOTE, record.symbol, record.bid,
+            record.ask, _NAN, _NAN, record.bidsz, record.asksz, 0, 0)
+  else:
+    return (record.timestamp, KIND_TRADE, record.symbol, _NAN, _NAN,
+            record.last, record.vwap, 0, 0, record.vl, record.cvol)
+
+
+def ToRecord(row):
+  """Converts a row of a TICK_DTYPE array back into a Quote or Trade."""
+  symbol = intern(str(row['symbol']))
+  if row['kind'] == KIND_QUOTE:
+    return records.Quote(
+        symbol, int(row['timestamp']), float(row['bid']), float(row['ask']),
+        int(row['bidsz']), int(row['asksz']))
+  else:
+    return records.Trade(
+        symbol, int(row['timestamp']), float(row['last']), int(row['vl']),
+        int(row['cvol']), float(row['vwap']))
+
+
+def IterRecords(ticks, chunk_ticks=65536):
+  """Yields a Quote or Trade for each row of a TICK_DTYPE array.
+
+  Rows are converted a chunk of columns at a time, which is much cheaper than
+  indexing the array once per field per tick.
+  """
+  for offset in xrange(0, len(ticks), chunk_ticks):
+    chunk = ticks[offset:offset + chunk_ticks]
+    columns = [chunk[name].tolist() for name in TICK_DTYPE.names]
+    for (timestamp, kind, symbol, bid, ask, last, vwap, bidsz, asksz, vl,
+         cvol) in zip(*columns):
+      symbol = intern(symbol)
+      if kind == KIND_QUOTE:
+        yield records.Quote(symbol, timestamp, bid, ask, bidsz, asksz)
+      else:
+        yield records.Trade(symbol, timestamp, last, vl, cvol, vwap)
+
+
+class _Index(object):
+  """Sparse per-symbol block index over one log file."""
+
+  def __init__(self, num_ticks=0, block_first_ts=None, symbol_blocks=None):
+    self.num_ticks = num_ticks
+    self.block_first_ts = block_first_ts or []
+    self.symbol_blocks = symbol_blocks or {}
+
+  def Extend(self, ticks, first_tick):
+    """Indexes `ticks`, which start at tick number `first_tick` in the log."""
+    offset = 0
+    while offset < len(ticks):
+      tick_num = first_tick + offset
+      block = tick_num // INDEX_BLOCK_TICKS
+      block_end = (block + 1) * INDEX_BLOCK_TICKS - first_tick
+      chunk = ticks[offset:block_end]
+
+      if block == len(self.block_first_ts):
+        self.block_first_ts.append(int(chunk['timestamp'][0]))
+      for symbol in np.unique(chunk['symbol']):
+        blocks = self.symbol_blocks.setdefault(str(symbol), [])
+        if not blocks or blocks[-1] != block:
+          blocks.append(block)
+
+      offset += len(chunk)
+    self.num_ticks = first_tick + len(ticks)
+
+  def Save(self, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({
+          'num_ticks': self.num_ticks,
+          'block_ticks': INDEX_BLOCK_TICKS,
+          'block_first_ts': self.block_first_ts,
+          'symbol_blocks': self.symbol_blocks,
+      }, f)
+    os.rename(tmp_path, path)
+
+  @classmethod
+  def Load(cls, path):
+    if not os.path.exists(path):
+      return cls()
+    with open(path) as f:
+      saved = json.load(f)
+    if saved['block_ticks'] != INDEX_BLOCK_TICKS:
+      return cls()
+    symbol_blocks = dict(
+        (str(symbol), blocks)
+        for symbol, blocks in saved['symbol_blocks'].iteritems())
+    return cls(saved['num_ticks'], saved['block_first_ts'], symbol_blocks)
+
+
+def _CompleteTicks(path, truncate=False):
+  """Returns the number of whole ticks in the log at path.
+
+  A crash mid-write can leave part of a row at the end of the log. With
+  truncate, it is cut off so that later appends stay row-aligned.
+  """
+  if not os.path.exists(path):
+    return 0
+  size = os.path.getsize(path)
+  num_ticks = size // TICK_DTYPE.itemsize
+  if truncate and size % TICK_DTYPE.itemsize:
+    with open(path, 'r+b') as f:
+      f.truncate(num_ticks * TICK_DTYPE.itemsize)
+    event_collection.Increment('ticklog-torn-ticks-truncated')
+  return num_ticks
+
+
+def _LoadIndex(log_path, ticks):
+  """Loads the index saved for a log and extends it over `ticks`, its rows."""
+  index = _Index.Load(_IndexPath(log_path))
+  if index.num_ticks > len(ticks):
+    # Saved for ticks that are no longer in the log.
+    index = _Index()
+  if len(ticks) > index.num_ticks:
+    index.Extend(ticks[index.num_ticks:], index.num_ticks)
+  return index
+
+
+class TickLogWriter(object):
+  """Appends streamed ticks to one fixed-width binary log file per day.
+
+  Ticks are copied into a preallocated buffer and written out when the buffer
+  fills or `flush_interval_secs` have passed since the last write, so Append()
+  costs one row assignment in the common case. The log is rotated when a tick
+  from a new (local) day arrives, and the sparse index is saved alongside the
+  log on Flush(), rotation and Close().
+  """
+
+  def __init__(self, directory, buffer_ticks=8192, flush_interval_secs=1.0):
+    self._directory = directory
+    self._buffer = np.zeros(buffer_ticks, dtype=TICK_DTYPE)
+    self._buffered = 0
+    self._flush_interval = flush_interval_secs
+    self._next_flush = time.time() + flush_interval_secs
+    self._lock = threading.Lock()
+    self._file = None
+    self._index = None
+    self._path = None
+    self._day_ends_at = 0
+
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def _OpenLocked(self, timestamp):
+    self._CloseLocked()
+
+    local = time.localtime(timestamp)
+    self._path = LogPath(self._directory, time.strftime('%Y%m%d', local))
+    num_ticks = _CompleteTicks(self._path, truncate=True)
+    self._file = open(self._path, 'ab')
+
+    # A log left by an earlier run may contain ticks the saved index does
+    # not cover.
+    if num_ticks:
+      existing = np.memmap(self._path, dtype=TICK_DTYPE, mode='r',
+                           shape=(num_ticks,))
+    else:
+      existing = np.zeros(0, dtype=TICK_DTYPE)
+    self._index = _LoadIndex(self._path, existing)
+    del existing
+
+    midnight = time.mktime(
+        (local.tm_year, local.tm_mon, local.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+    self._day_ends_at = midnight
+
+  def Append(self, record):
+    with self._lock:
+      if record.timestamp >= self._day_ends_at or self._file is None:
+        self._FlushLocked()
+        self._OpenLocked(record.timestamp)
+
+      self._buffer[self._buffered] = ToRow(record)
+      self._buffered += 1
+
+      if self._buffered == len(self._buffer):
+        self._FlushLocked()
+      elif self._flush_interval is not None:
+        now = time.time()
+        if now > self._next_flush:
+          self._FlushLocked()
+          self._next_flush = now + self._flush_interval
+
+  def _FlushLocked(self, save_index=False):
+    if self._buffered and self._file is not None:
+      ticks = self._buffer[:self._buffered]
+      self._file.write(ticks.tobytes())
+      self._file.flush()
+      self._index.Extend(ticks, self._index.num_ticks)
+      event_collection.Add('ticklog-ticks-written', self._buffered)
+      event_collection.Add(
+          'ticklog-bytes-written', self._buffered * TICK_DTYPE.itemsize)
+      self._buffered = 0
+    if save_index and self._index is not None:
+      self._index.Save(_IndexPath(self._path))
+
+  def Flush(self):
+    with self._lock:
+      self._FlushLocked(save_index=True)
+
+  def _CloseLocked(self):
+    if self._file is None:
+      return
+    self._FlushLocked(save_index=True)
+    self._file.close()
+    self._file = None
+
+  def Close(self):
+    with self._lock:
+      self._CloseLocked()
+
+
+def Recorded(ticks, writer):
+  """Passes ticks through unchanged after appending each one to writer."""
+  for tick in ticks:
+    writer.Append(tick)
+    yield tick
+
+
+class TickLogReader(object):
+  """Zero-copy access to a tick log through a memory map.
+
+  Ticks() returns the whole log as a TICK_DTYPE array backed by the file.
+  SymbolTicks() and TimeRange() use the sparse index to touch only the blocks
+  that can contain matching ticks.
+  """
+
+  def __init__(self, path):
+    self._path = path
+    # A torn row at the end, from a writer that crashed, is left out.
+    num_ticks = _CompleteTicks(path)
+    if num_ticks:
+      self._ticks = np.memmap(
+          path, dtype=TICK_DTYPE, mode='r', shape=(num_ticks,))
+    else:
+      self._ticks = np.zeros(0, dtype=TICK_DTYPE)
+    self._index = _LoadIndex(path, self._ticks)
+
+  def __len__(self):
+    return len(self._ticks)
+
+  def Ticks(self):
+    return self._ticks
+
+  def Symbols(self):
+    return sorted(self._index.symbol_blocks)
+
+  def _Blocks(self, blocks):
+    if not blocks:
+      return np.zeros(0, dtype=TICK_DTYPE)
+    return np.concatenate([
+        self._ticks[b * INDEX_BLOCK_TICKS:(b + 1) * INDEX_BLOCK_TICKS]
+        for b in blocks])
+
+  def SymbolTicks(self, symbol):
+    ticks = self._Blocks(self._index.symbol_blocks.get(symbol, []))
+    return ticks[ticks['symbol'] == symbol]
+
+  def Select(self, symbols=None, start_ts=None, end_ts=None):
+    """Returns ticks matching all of the given filters, in log order."""
+    first, last = self.TickRange(start_ts, end_ts)
+    blocks = set(xrange(first // INDEX_BLOCK_TICKS,
+                        -(-last // INDEX_BLOCK_TICKS)))
+    if symbols is not None:
+      symbol_blocks = set()
+      for symbol in symbols:
+        symbol_blocks.update(self._index.symbol_blocks.get(symbol, []))
+      blocks &= symbol_blocks
+
+    ticks = self._Blocks(sorted(blocks))
+    mask = np.ones(len(ticks), dtype=bool)
+    if symbols is not None:
+      mask &= np.in1d(ticks['symbol'], list(symbols))
+    if start_ts is not None:
+      mask &= ticks['timestamp'] >= start_ts
+    if end_ts is not None:
+      mask &= ticks['timestamp'] < end_ts
+    return ticks[mask]
+
+  def TickRange(self, start_ts, end_ts):
+    """Returns the (first, last) tick numbers to scan for [start_ts, end_ts).
+
+    Assumes timestamps are non-decreasing from one block to the next.
+    """
+    first_ts = self._index.block_first_ts
+    if start_ts is None:
+      first_block = 0
+    else:
+      first_block = max(
+          np.searchsorted(first_ts, start_ts, side='right') - 1, 0)
+    if end_ts is None:
+      last_block = len(first_ts)
+    else:
+      last_block = np.searchsorted(first_ts, end_ts, side='left')
+    return (first_block * INDEX_BLOCK_TICKS,
+            min(last_block * INDEX_BLOCK_TICKS, len(self._ticks)))
+
+  def TimeRange(self, start_ts, end_ts):
+    return self.Select(start_ts=start_ts, end_ts=end_ts)
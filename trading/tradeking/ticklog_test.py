@@ -0,0 +1,65 @@
+#!/usr/bin/python -B
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from projects.trading.tradeking import records
+from projects.trading.tradeking import ticklog
+
+
+def _Quote(symbol, timestamp, bid):
+  return records.Quote(symbol, timestamp, bid, bid + 0.01, 100, 200)
+
+
+class TickLogTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.now = int(time.time())
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _Write(self, quotes):
+    writer = ticklog.TickLogWriter(self.directory, flush_interval_secs=60)
+    for quote in quotes:
+      writer.Append(quote)
+    writer.Close()
+    return ticklog.LogPath(
+        self.directory, time.strftime('%Y%m%d', time.localtime(self.now)))
+
+  def testTornTailIsTruncatedBeforeAppending(self):
+    path = self._Write([_Quote('VRX', self.now, 10.0),
+                        _Quote('GILD', self.now + 1, 20.0)])
+    # A crash part way through writing a third row.
+    with open(path, 'ab') as f:
+      f.write('\x01' * (ticklog.TICK_DTYPE.itemsize // 2))
+
+    reader = ticklog.TickLogReader(path)
+    self.assertEqual(2, len(reader))
+
+    self._Write([_Quote('VRX', self.now + 2, 11.0)])
+    self.assertEqual(0, os.path.getsize(path) % ticklog.TICK_DTYPE.itemsize)
+
+    reader = ticklog.TickLogReader(path)
+    ticks = reader.Ticks()
+    self.assertEqual(['VRX', 'GILD', 'VRX'], list(ticks['symbol']))
+    self.assertEqual([10.0, 20.0, 11.0], list(ticks['bid']))
+    self.assertEqual([10.0, 11.0], list(reader.SymbolTicks('VRX')['bid']))
+
+  def testIndexLongerThanLogIsRebuilt(self):
+    path = self._Write([_Quote('VRX', self.now, 10.0),
+                        _Quote('GILD', self.now + 1, 20.0)])
+    with open(path, 'r+b') as f:
+      f.truncate(ticklog.TICK_DTYPE.itemsize)
+
+    reader = ticklog.TickLogReader(path)
+    self.assertEqual(1, len(reader))
+    self.assertEqual(['VRX'], reader.Symbols())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,143 @@
+import collections
+import datetime
+import functools
+import Queue
+import sys
+
+import numpy as np
+
+from projects.lib.concurrency import threadpool
+from projects.lib.telemetry import event_collection
+
+
+# (column, dtype, timesales field) for each column of the returned bars.
+_BAR_COLUMNS = (
+    ('timestamp', np.int64, 'timestamp'),
+    ('open', np.float64, 'opn'),
+    ('high', np.float64, 'hi'),
+    ('low', np.float64, 'lo'),
+    ('last', np.float64, 'last'),
+    ('volume', np.int64, 'vl'),
+)
+
+# Results per page for each interval, sized so that a regular session fits in
+# a single page. Longer days (or tick data) are followed onto further pages.
+_PAGE_SIZES = {
+    '1min': 400,
+    '5min': 80,
+    'tick': 1000,
+}
+
+_DATE_FORMAT = '%Y-%m-%d'
+
+
+def _TradingDays(start, end):
+  day = start
+  while day <= end:
+    if day.weekday() < 5:
+      yield day
+    day += datetime.timedelta(days=1)
+
+
+def _AsList(response):
+  # Single results come back as a bare dict rather than a list of one.
+  quotes = (response.get('quotes') or {}).get('quote') or []
+  if type(quotes) is dict:
+    return [quotes]
+  return quotes
+
+
+def _ToColumns(quotes):
+  columns = {}
+  for name, dtype, field in _BAR_COLUMNS:
+    values = (q.get(field) or 0 for q in quotes)
+    columns[name] = np.fromiter(values, dtype=dtype, count=len(quotes))
+  return columns
+
+
+def _EmptyColumns():
+  return dict((name, np.empty(0, dtype)) for name, dtype, _ in _BAR_COLUMNS)
+
+
+class TimesalesFetcher(object):
+  """Backfills historical bars through Session.MarketTimesales.
+
+  The date range is split into one request per symbol per trading day, with
+  a page size that fits the whole day; days that overflow a page are paged
+  through. The requests run concurrently on a ThreadPool of `num_workers`
+  threads and each page is converted straight into NumPy columns.
+
+  fetcher = TimesalesFetcher(session)
+  bars = fetcher.FetchBars(['VRX', 'GILD'], datetime.date(2016, 3, 1),
+                           datetime.date(2016, 3, 31))
+  bars['VRX']['last']  # -> np.ndarray of closing prices, oldest first.
+  """
+
+  def __init__(self, session, num_workers=8):
+    self._session = session
+    self._pool = threadpool.ThreadPool(size=num_workers)
+
+  def Close(self):
+    self._pool.Shutdown()
+
+  def _FetchDay(self, symbol, day, interval):
+    rpp = _PAGE_SIZES[interval]
+    date = day.strftime(_DATE_FORMAT)
+    pages = []
+    try:
+      index = 0
+      while True:
+        response = self._session.MarketTimesales(
+            symbols=symbol, interval=interval, rpp=rpp, index=index,
+            startdate=date, enddate=date)
+        quotes = _AsList(response)
+        pages.append(_ToColumns(quotes))
+        event_collection.Increment('timesales-pages-fetched')
+        if len(quotes) < rpp:
+          break
+        index += 1
+    except Exception:
+      return symbol, None, sys.exc_info()
+    return symbol, pages, None
+
+  def FetchBars(self, symbols, start, end, interval='1min'):
+    """Returns {symbol: {column: np.ndarray}} for bars from start to end.
+
+    start and end are datetime.date objects and are both inclusive. Columns
+    are timestamp, open, high, low, last and volume, sorted by timestamp.
+    """
+    if interval not in _PAGE_SIZES:
+      raise ValueError('Unsupported interval: %s' % (interval,))
+
+    results = Queue.Queue()
+    num_jobs = 0
+    for symbol in symbols:
+      for day in _TradingDays(start, end):
+        closure = functools.partial(self._FetchDay, symbol, day, interval)
+        self._pool.RunTask(closure, results.put)
+        num_jobs += 1
+
+    pages = collections.defaultdict(list)
+    exc_info = None
+    for _ in xrange(num_jobs):
+      symbol, symbol_pages, job_exc_info = results.get().Result()
+      if job_exc_info is not None:
+        exc_info = exc_info or job_exc_info
+      else:
+        pages[symbol].extend(symbol_pages)
+
+    if exc_info is not None:
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+    bars = {}
+    for symbol in symbols:
+      if not pages[symbol]:
+        bars[symbol] = _EmptyColumns()
+        continue
+      columns = dict(
+          (name, np.concatenate([page[name] for page in pages[symbol]]))
+          for name, _, _ in _BAR_COLUMNS)
+      order = np.argsort(columns['timestamp'], kind='mergesort')
+      bars[symbol] = dict(
+          (name, column[order]) for name, column in columns.iteritems())
+    return bars
@@ -2,33 +2,52 @@
 
 import cPickle
 import cStringIO
+import datetime
 import functools
 import json
 import requests
 import requests_oauthlib
 import logging
 import os
+import socket
 import sys
 import textwrap
+import threading
 import time
-import xml.etree.ElementTree as ET
 
-from projects.lib import cache
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
+
+from projects.lib.concurrency import ratelimit
+from projects.lib.telemetry import event_collection
+from projects.lib.utils import cache
+from projects.trading.tradeking import alerts
+from projects.trading.tradeking import pipeline
+from projects.trading.tradeking import pnl
+from projects.trading.tradeking import stream
+from projects.trading.tradeking import timesales
+from projects.trading.tradeking import transport
 
 
 logging.captureWarnings(True)
 
 REMOTE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Formats accepted by the API for startdate/enddate parameters.
+PARAM_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y')
 REMOTE_TIME_FORMAT = '%H%M'
 TZ_OFFSET = 60 * 60 * 3
 
+_SIGN_CHARS = {
+    1: '+',
+    -1: '-',
+}
+
 TOPLIST_EXCHANGES = {
     'AMEX': 'A',
     'NYSE': 'N',
     'NASDAQ': 'Q',
 }
 
-def _FormatParagraphs(text):
+def FormatParagraphs(text):
   text = text.replace('</p>', '')
   paragraphs = text.split('<p>')
 
@@ -41,55 +60,260 @@ def _FormatParagraphs(text):
   return res
 
 
+# Seconds a decoded response stays cached, keyed by endpoint. Responses from
+# UNCACHED endpoints are always fetched. Streamed bodies can only be consumed
+# once, so streaming endpoints must be UNCACHED.
+UNCACHED = 0
+FOREVER = float('inf')
+
+CACHE_POLICIES = {
+    'status': 1,
+    'version': 60 * 60,
+    'accounts': 60,
+    'account': 60,
+    'account-balances': 60,
+    'account-history': 60,
+    'account-holdings': 60,
+    'market-clock': 1,
+    'market-quotes': 1,
+    'market-timesales': 60,
+    'market-toplists': 60,
+    'news-search': 60,
+    'news-article': FOREVER,
+    'member-profile': 60 * 60,
+    'market-stream': UNCACHED,
+}
+
+
+# Requests are admitted lowest priority value first within each rate limit
+# class, so order-critical account calls overtake queued bulk fetches.
+PRIORITY_CRITICAL = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+# (requests, per seconds) allowed for each rate limit class.
+RATE_LIMITS = {
+    'account': (180, 60),
+    'market': (60, 60),
+    'news': (60, 60),
+}
+
+# Rate limit class and priority of each endpoint.
+ENDPOINT_SCHEDULING = {
+    'status': ('account', PRIORITY_INTERACTIVE),
+    'version': ('account', PRIORITY_INTERACTIVE),
+    'accounts': ('account', PRIORITY_CRITICAL),
+    'account': ('account', PRIORITY_CRITICAL),
+    'account-balances': ('account', PRIORITY_CRITICAL),
+    'account-history': ('account', PRIORITY_INTERACTIVE),
+    'account-holdings': ('account', PRIORITY_CRITICAL),
+    'market-clock': ('market', PRIORITY_INTERACTIVE),
+    'market-quotes': ('market', PRIORITY_INTERACTIVE),
+    'market-timesales': ('market', PRIORITY_BULK),
+    'market-toplists': ('market', PRIORITY_BULK),
+    'news-search': ('news', PRIORITY_BULK),
+    'news-article': ('news', PRIORITY_BULK),
+    'member-profile': ('account', PRIORITY_INTERACTIVE),
+}
+
+
+API_URL = 'https://api.tradeking.com'
+STREAM_URL = 'https://stream.tradeking.com'
+
+# Keep-alive connections pooled for each host.
+CONNECTION_POOL_SIZES = {
+    API_URL: 8,
+    STREAM_URL: 2,
+}
+
+
+def _EndsBeforeToday(params):
+  enddate = (params or {}).get('enddate')
+  if not enddate:
+    return False
+
+  for date_format in PARAM_DATE_FORMATS:
+    try:
+      end = datetime.datetime.strptime(enddate, date_format).date()
+    except ValueError:
+      continue
+    return end < datetime.date.today()
+  return False
+
+
+# Endpoints whose responses never change once the predicate on the request
+# parameters holds. These are also kept in the Session's DiskCache, if any, so
+# that they survive restarts.
+IMMUTABLE_ENDPOINTS = {
+    'news-article': lambda params: True,
+    'market-timesales': _EndsBeforeToday,
+}
+
+
 class Session(object):
-  def __init__(self, app_key, app_secret, oauth_token, oauth_secret):
+  def __init__(self, app_key, app_secret, oauth_token, oauth_secret,
+               disk_cache_path=None, disk_cache_max_bytes=1024 * 1024 * 1024,
+               prewarm_connections=False, api_url=API_URL,
+               stream_url=STREAM_URL, rate_limits=RATE_LIMITS):
+    """Creates a session against the live API.
+
+    api_url and stream_url may instead point at another server, such as
+    fake_server.FakeTradeKingServer, and rate_limits raised to load test the
+    client against it.
+    """
     auth = requests_oauthlib.OAuth1(
         app_key, app_secret, oauth_token, oauth_secret)
     self.session = requests.Session()
     self.session.auth = auth
+    self._api_url = api_url
+    self._stream_url = stream_url
+
+    self._adapters = {}
+    host_urls = {
+        API_URL: api_url,
+        STREAM_URL: stream_url,
+    }
+    # One adapter per host; if both point at the same server, e.g. a
+    # FakeTradeKingServer, its pool is sized for both.
+    pool_sizes = {}
+    for default_url, pool_size in CONNECTION_POOL_SIZES.iteritems():
+      host_url = host_urls[default_url]
+      pool_sizes[host_url] = pool_sizes.get(host_url, 0) + pool_size
+    for host_url, pool_size in pool_sizes.iteritems():
+      adapter = transport.PooledAdapter(pool_size)
+      self.session.mount(host_url, adapter)
+      self._adapters[host_url] = adapter
+    if prewarm_connections:
+      self.PrewarmConnections()
+
+    self._latency = {}
+    for endpoint in ENDPOINT_SCHEDULING:
+      self._latency[endpoint] = transport.RequestLatency(
+          'tradeking-http-%s' % (endpoint,))
 
     self._account_id = None
-    self._cache = cache.WriteThruCache(lifetime_secs=10)
+    self._cache = cache.WriteThruCache(
+        lifetime_secs=10, max_entries=1024, name='tradeking')
 
-  def _MakeRequest(self, url, params=None, stream=False):
+    if disk_cache_path is None:
+      self._disk_cache = None
+    else:
+      self._disk_cache = cache.DiskCache(
+          disk_cache_path, disk_cache_max_bytes, name='tradeking')
+
+    # Created on first use, as it starts a thread pool.
+    self._timesales_lock = threading.Lock()
+    self._timesales_fetcher = None
+
+    self._rate_limiters = {}
+    for rate_class, (rate, per_secs) in rate_limits.iteritems():
+      self._rate_limiters[rate_class] = ratelimit.PriorityRateLimiter(
+          'tradeking-%s' % (rate_class,), rate, per_secs)
+
+  def Close(self):
+    """Closes connections and stops exporting this session's metrics."""
+    with self._timesales_lock:
+      if self._timesales_fetcher is not None:
+        self._timesales_fetcher.Close()
+        self._timesales_fetcher = None
+    for latency in self._latency.itervalues():
+      latency.Unregister()
+    self._cache.UnregisterEventCallbacks()
+    if self._disk_cache is not None:
+      self._disk_cache.Close()
+    for limiter in self._rate_limiters.itervalues():
+      limiter.UnregisterEventCallbacks()
+    self.session.close()
+
+  def _MakeRequest(self, endpoint, url, params=None, stream=False):
+    """Fetches url, serving it from the cache according to CACHE_POLICIES.
+
+    What is cached is the decoded payload, so callers must treat the returned
+    object as read-only.
+    """
     request = self.session.prepare_request(
         requests.Request('GET', url, params=params))
 
-    
-#    return (request.url, request.path_url)
-    remote_func = functools.partial(self.session.send, request, stream=stream)
-    response = self._cache.Get(request.url, remote_func)
-
-#    self.session.send(req, stream=stream)
-#    remote_func = functools.partial(
-#        url, self.session.get, params=params, stream=stream)
-
+    if stream:
+      assert CACHE_POLICIES[endpoint] == UNCACHED
+      response = self.session.send(request, stream=True)
+      if response.status_code != requests.codes.ok:
+        response.raise_for_status()
+      return response
+
+    remote_func = functools.partial(
+        self._Fetch, endpoint, request, url.endswith('json'))
+
+    is_immutable = IMMUTABLE_ENDPOINTS.get(endpoint)
+    if self._disk_cache is not None and is_immutable and is_immutable(params):
+      remote_func = functools.partial(
+          self._disk_cache.Get, request.url, remote_func)
+      lifetime = FOREVER
+    else:
+      lifetime = CACHE_POLICIES[endpoint]
+
+    if lifetime == UNCACHED:
+      return remote_func()
+    return self._cache.Get(request.url, remote_func, lifetime_secs=lifetime)
+
+  def _Fetch(self, endpoint, request, decode_json):
+    rate_class, priority = ENDPOINT_SCHEDULING[endpoint]
+    self._rate_limiters[rate_class].Acquire(priority)
+
+    # The body is read separately from the headers so that time to first
+    # byte and transfer time can be told apart.
+    latency = self._latency[endpoint]
+    transport.TakeConnectSeconds()
+    start = time.time()
+    try:
+      response = self.session.send(request, stream=True)
+      headers_at = time.time()
+      response.content
+    except requests.RequestException as e:
+      latency.RecordError(type(e).__name__)
+      raise
+    done_at = time.time()
+    connect_secs = transport.TakeConnectSeconds()
+    latency.Record(
+        connect_secs, headers_at - start - connect_secs, done_at - headers_at)
 
-#    response = self.session.get(url, params=params, stream=stream)
     if response.status_code != requests.codes.ok:
+      latency.RecordError(response.status_code)
       response.raise_for_status()
 
-    if stream:
-      return response.iter_lines()
+    if decode_json:
+      return response.json()['response']
     else:
-      if url.endswith('json'):
-        return response.json()['response']
-      else:
-        return response.text
+      return response.text
+
+  def PrewarmConnections(self):
+    """Fills each host's connection pool with open keep-alive connections.
+
+    Prewarming only saves latency, so hosts that cannot be reached are
+    logged and skipped.
+    """
+    for host_url, adapter in self._adapters.iteritems():
+      try:
+        opened = adapter.Prewarm(host_url)
+      except (requests.RequestException, urllib3_exceptions.HTTPError,
+              socket.error) as e:
+        logging.warning('Could not prewarm connections to %s: %s', host_url, e)
+        continue
+      event_collection.Add('tradeking-http-prewarmed-connections', opened)
 
   def Status(self):
-    url = 'https://api.tradeking.com/v1/utility/status.json'
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/utility/status.json'
+    response = self._MakeRequest('status', url)
     return response
 
   def Version(self):
-    url = 'https://api.tradeking.com/v1/utility/version.json'
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/utility/version.json'
+    response = self._MakeRequest('version', url)
     return response
 
   def Accounts(self):
-    url = 'https://api.tradeking.com/v1/accounts.json'
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/accounts.json'
+    response = self._MakeRequest('accounts', url)
     return response
 
   def AccountId(self):
@@ -99,55 +323,55 @@ class Session(object):
     return self._account_id
 
   def AccountsBalances(self):
-    url = 'https://api.tradeking.com/v1/accounts/balances.json'
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/accounts/balances.json'
+    response = self._MakeRequest('account-balances', url)
     return response
 
   def Account(self, account_id=None):
-    url = 'https://api.tradeking.com/v1/accounts/%s.json' % (account_id,)
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/accounts/%s.json' % (account_id,)
+    response = self._MakeRequest('account', url)
     return response
 
   def AccountBalances(self, account_id):
-    url = 'https://api.tradeking.com/v1/accounts/%s/balances.json' % (
+    url = self._api_url + '/v1/accounts/%s/balances.json' % (
         account_id,)
-    response = self._MakeRequest(url)
+    response = self._MakeRequest('account-balances', url)
     return response
 
   def AccountHistory(self, account_id, date_range, transactions):
-    url = 'https://api.tradeking.com/v1/accounts/%s/history.json' % (
+    url = self._api_url + '/v1/accounts/%s/history.json' % (
         account_id,)
     params = {
         'range': date_range,
         'transactions': transactions,
     }
-    response = self._MakeRequest(url, params)
+    response = self._MakeRequest('account-history', url, params)
     return response
 
   def AccountHoldings(self, account_id):
-    url = 'https://api.tradeking.com/v1/accounts/%s/holdings.json' % (
+    url = self._api_url + '/v1/accounts/%s/holdings.json' % (
         account_id,)
-    response = self._MakeRequest(url)
+    response = self._MakeRequest('account-holdings', url)
     return response
 
   def MarketClock(self):
-    url = 'https://api.tradeking.com/v1/market/clock.json'
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/market/clock.json'
+    response = self._MakeRequest('market-clock', url)
     return response
 
   def MarketQuotes(self, symbols=None, fids=None):
-    url = 'https://api.tradeking.com/v1/market/ext/quotes.json'
+    url = self._api_url + '/v1/market/ext/quotes.json'
     params = {
         'symbols': symbols,
         'fids': fids,
     }
-    response = self._MakeRequest(url, params)
+    response = self._MakeRequest('market-quotes', url, params)
     return response
 
   def MarketTimesales(
       self, symbols=None, interval=None, rpp=None, index=None, startdate=None,
       enddate=None, starttime=None):
-    url = 'https://api.tradeking.com/v1/market/timesales.json'
+    url = self._api_url + '/v1/market/timesales.json'
     params = {
         'symbols': symbols,
         'interval': interval,
@@ -157,20 +381,31 @@ class Session(object):
         'enddate': enddate,
         'starttime': starttime,
     }
-    response = self._MakeRequest(url, params)
+    response = self._MakeRequest('market-timesales', url, params)
     return response
 
+  def MarketBars(self, symbols, start, end, interval='1min'):
+    """Returns bars for symbols between two dates as NumPy columns.
+
+    See timesales.TimesalesFetcher.FetchBars().
+    """
+    with self._timesales_lock:
+      if self._timesales_fetcher is None:
+        self._timesales_fetcher = timesales.TimesalesFetcher(self)
+      fetcher = self._timesales_fetcher
+    return fetcher.FetchBars(symbols, start, end, interval)
+
   def MarketToplists(self, list_type=None, exchange=None):
-    url = 'https://api.tradeking.com/v1/market/toplists/%s.json' % (list_type,)
+    url = self._api_url + '/v1/market/toplists/%s.json' % (list_type,)
     exchange_code = TOPLIST_EXCHANGES.get(exchange)
     params = {
         'exchange': exchange_code,
     }
-    response = self._MakeRequest(url, params)
+    response = self._MakeRequest('market-toplists', url, params)
     return response
 
   def SearchNews(self, symbols=None, maxhits=10, startdate=None, enddate=None):
-    url = 'https://api.tradeking.com/v1/market/news/search.json'
+    url = self._api_url + '/v1/market/news/search.json'
     params = {
         'symbols': symbols,
         'maxhits': maxhits,
@@ -179,26 +414,44 @@ class Session(object):
     }
     # The moon is a ripe orange, ready to be plucked from the sky.
     #     - Kristyn Lagoy
-    response = self._MakeRequest(url, params)
+    response = self._MakeRequest('news-search', url, params)
     return response
 
   def GetNews(self, article_id):
-    url = 'https://api.tradeking.com/v1/market/news/%s.json' % (article_id,)
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/market/news/%s.json' % (article_id,)
+    response = self._MakeRequest('news-article', url)
     return response
 
   def MemberProfile(self):
-    url = 'https://api.tradeking.com/v1/member/profile.json'
-    response = self._MakeRequest(url)
+    url = self._api_url + '/v1/member/profile.json'
+    response = self._MakeRequest('member-profile', url)
     return response
 
+  def OpenQuoteStream(self, symbols):
+    """Returns the open streaming response for quotes and trades on symbols.
+
+    Closing the response from another thread ends iteration over its body.
+    """
+    url = self._stream_url + '/v1/market/quotes.xml'
+    params = {
+        'symbols': ','.join(symbols),
+    }
+    return self._MakeRequest('market-stream', url, params, stream=True)
+
+  def StreamQuotes(self, symbols):
+    response = self.OpenQuoteStream(symbols)
+    return stream.ParseStream(response.iter_content(chunk_size=None))
+
 
 class TradeKing(object):
-  def __init__(self, requests):
+  def __init__(self, requests, api_url=API_URL, stream_url=STREAM_URL):
+    """api_url and stream_url are as for Session."""
     auth = requests_oauthlib.OAuth1(
         APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_SECRET)
     self.session = requests.Session()
     self.session.auth = auth
+    self._api_url = api_url
+    self._stream_url = stream_url
 
   def _MakeRequest(self, url, stream=False):
     '''Simple wrapper around oauth2 request
@@ -208,20 +461,19 @@ class TradeKing(object):
       response.raise_for_status()
 
     if stream:
-      lines = response.iter_lines()
-      return lines
+      return response.iter_content(chunk_size=None)
     else:
       return response.json()['response']
 
   def GetAccounts(self):
-    url = 'https://api.tradeking.com/v1/accounts.json'
+    url = self._api_url + '/v1/accounts.json'
     response = self._MakeRequest(url)
     balances = response['accounts']['accountsummary']['accountbalance']
     holdings = response['accounts']['accountsummary']['accountholdings']
     return balances, holdings
 
   def GetMarketStatus(self):
-    url = 'https://api.tradeking.com/v1/market/clock.json'
+    url = self._api_url + '/v1/market/clock.json'
     response = self._MakeRequest(url)
     return response['status']['current']
 
@@ -229,127 +481,94 @@ class TradeKing(object):
     return self.GetQuotes([symbol])
 
   def GetQuotes(self, symbols):
-    url = 'https://api.tradeking.com/v1/market/ext/quotes.json?'
+    url = self._api_url + '/v1/market/ext/quotes.json?'
     url += 'fids=chg,chg_sign,pchg,pchg_sign,vl,symbol,adv_30&'
     url += 'symbols=' + ','.join(symbols)
     response = self._MakeRequest(url)
 
     return response['quotes']
 
-  def StreamQuotes(self, symbols):
-    url = 'https://stream.tradeking.com/v1/market/quotes.xml?'
+  def StreamQuotes(self, symbols, recorder=None,
+                   overflow_policy=pipeline.CONFLATE, rules=(),
+                   quote_table=None, history=None):
+    url = self._stream_url + '/v1/market/quotes.xml?'
     url += 'symbols=' + ','.join(symbols)
 
-#    spinner = ['\\', '|', '/', '-']
-#    cur_spin = 0
-    count = 0
-#    combined_dir = os.path.join(HIST_DIR, 'combined')
-#    if not os.path.exists(combined_dir):
-#      os.mkdir(combined_dir)
-
-    buf = []
-    end_tag = None
-
-    disp_lines = {}
-    prev_disp = {}
+    # The redraw in DisplayTicks() is slow, so the stream is read and parsed
+    # in other threads. Every tick is recorded, published to the shared quote
+    # table (a quote_table.QuoteTableWriter) and kept in the per-symbol rings
+    # of `history` (a tickbuffer.TickHistory), even those conflated away
+    # before they reach the display.
+    taps = []
+    if recorder is not None:
+      taps.append(recorder.Append)
+    if quote_table is not None:
+      taps.append(quote_table.OnTick)
+    if history is not None:
+      taps.append(history.Add)
+    if len(taps) > 1:
+      def tap(record):
+        for t in taps:
+          t(record)
+    elif taps:
+      tap = taps[0]
+    else:
+      tap = None
+    response = self.session.get(url, stream=True)
+    response.raise_for_status()
+    ticks = pipeline.StreamPipeline(
+        response.iter_content(chunk_size=None), policy=overflow_policy,
+        tap=tap, response=response).Start()
+
+    engine = pnl.PnlEngine()
+    for symbol in COST_BASIS:
+      engine.SetPosition(
+          symbol, NUM_CONTRACTS[symbol], COST_BASIS[symbol], multiplier=100)
+
+    # Alerts see every tick that reaches the display.
+    if rules:
+      alert_engine = alerts.AlertEngine(pnl=engine)
+      for rule in rules:
+        alert_engine.AddRule(rule)
+    else:
+      alert_engine = None
+    try:
+      self.DisplayTicks(ticks, engine, alert_engine)
+    finally:
+      ticks.Stop()
+      engine.UnregisterEventCallbacks()
+      if alert_engine is not None:
+        alert_engine.UnregisterEventCallbacks()
+
+  def DisplayTicks(self, ticks, engine, alert_engine=None):
+    """Redraws held positions from live or replayed (replay.Replay) ticks."""
     next_update = time.time() + 2.0
 
-    for line in self._MakeRequest(url, stream=True):
-      if end_tag:
-#        if count % 500 == 0:
-#          sys.stdout.write('%5s\r' % (spinner[cur_spin],))
-#          sys.stdout.flush()
-#          cur_spin += 1
-#          if cur_spin == len(spinner):
-#            cur_spin = 0
-        if end_tag in line:
-          buf.append(end_tag)
-          root = ET.fromstring(''.join(buf))
-          quote = {}
-          for child in root:
-            k = child.tag
-            v = root.find(k).text
-            quote[k] = v
-
-          symbol = quote['symbol']
-          if symbol in COST_BASIS:
-            cost_basis = COST_BASIS[symbol]
-            if root.tag == 'trade':
-              price = float(quote['last'])
-            elif root.tag == 'quote':
-              price = (float(quote['bid']) + float(quote['ask'])) / 2.0
-
-            diff = float(price) - cost_basis
-            disp_lines[symbol] = (price, diff)
-#quote['symbol']] = '%10s  [%+.2f]' % (price, diff)
-            count += 1
-
-          if time.time() > next_update:
-            os.system('clear')
-            print '        security        price       chg      value     profit         tick'
-            print '=========================================================================='
-            for sym in sorted(disp_lines):
-              price, diff = disp_lines[sym]
-              prev_signs = []
-              if sym in prev_disp:
-                prev_price, prev_diff, prev_signs = prev_disp[sym]
-                change = price - prev_price
-                if change < 0.0:
-                  prev_signs.append('-')
-                elif change > 0.0:
-                  prev_signs.append('+')
-                if len(prev_signs) > 10:
-                  prev_signs = prev_signs[1:11]
-
-              tot_paid = NUM_CONTRACTS[sym] * 100 * COST_BASIS[sym]
-              cur_value = NUM_CONTRACTS[sym] * 100 * price
-              profit = cur_value - tot_paid
-
-              sign_text = ''.join(prev_signs)
-              value_text = '$%.2f' % (cur_value,)
-              profit_text = '%+.2f' % (profit,)
-
-              print '%21s    %.2f   [%+.2f]   %8s   %8s   %10s' % (
-                  sym, price, diff, value_text, profit_text, sign_text)
-              prev_disp[sym] = (price, diff, prev_signs)
-            next_update = time.time() + 2.0
-
-#          if count > 5:
-#            count = 0
-#            print
-
-#          symbol = quote['symbol']
-#          today = time.strftime('%Y%m%d')
-#          out_dir = os.path.join(HIST_DIR, symbol)
-#          if not os.path.exists(out_dir):
-#            os.mkdir(out_dir)
-
-#          out_file = os.path.join(out_dir, '%s_%s' % (today, root.tag))
-#          combined_file = os.path.join(combined_dir, '%s_%s' % (today, root.tag))
-
-#          with open(out_file, 'a') as f:
-#            cPickle.dump(quote, f)
-#          with open(combined_file, 'a') as f:
-#            cPickle.dump(quote, f)
-
-          buf = []
-          end_tag = None
-        else:
-          buf.append(line)
-      else:
-        # We're at the beginning.
-        if '<quote>' in line:
-          end_tag = '</quote>'
-          buf.append('<quote>')
-        elif '<trade>' in line:
-          end_tag = '</trade>'
-          buf.append('<trade>')
-
-
-
-#      print '----------------'
-#      print line
-#      print '----------------'
+    for record in ticks:
+      engine.OnTick(record)
+      if alert_engine is not None:
+        alert_engine.OnTick(record)
+
+      if time.time() > next_update:
+        snapshot = engine.Snapshot()
+        os.system('clear')
+        print '        security        price       chg      value     profit         tick'
+        print '=========================================================================='
+        for slot in sorted(xrange(len(snapshot.symbols)),
+                           key=lambda i: snapshot.symbols[i]):
+          price = snapshot.price[slot]
+          if price != price:
+            continue
+          diff = price - snapshot.cost_basis[slot]
+          sign_text = ''.join(
+              _SIGN_CHARS[sign] for sign in snapshot.signs[slot] if sign)
+          value_text = '$%.2f' % (snapshot.value[slot],)
+          profit_text = '%+.2f' % (snapshot.profit[slot],)
+
+          print '%21s    %.2f   [%+.2f]   %8s   %8s   %10s' % (
+              snapshot.symbols[slot], price, diff, value_text, profit_text,
+              sign_text)
+        next_update = time.time() + 2.0
 
 
 def Pretty(d):
@@ -384,7 +603,7 @@ def main(argv):
 #    print '%s' % (article['id'],)
 #    print
 #    full_article = session.GetNews(article['id'])['article']
-#    story = _FormatParagraphs(full_article['story'])
+#    story = FormatParagraphs(full_article['story'])
 #    for line in story:
 #      print line
 #    print
@@ -0,0 +1,137 @@
+#!/usr/bin/python -B
+
+import datetime
+import gflags
+import requests
+import sys
+import threading
+import time
+import unittest
+
+from projects.lib.telemetry import event_collection
+from projects.trading.tradeking import fake_server
+from projects.trading.tradeking import records
+from projects.trading.tradeking import timesales
+from projects.trading.tradeking import tradeking
+
+
+FLAGS = gflags.FLAGS
+
+_UNLIMITED = dict((rate_class, (10 ** 6, 1))
+                  for rate_class in tradeking.RATE_LIMITS)
+
+
+def _Session(server, **kwargs):
+  return tradeking.Session(
+      'key', 'secret', 'token', 'secret', api_url=server.url,
+      stream_url=server.url, rate_limits=_UNLIMITED, **kwargs)
+
+
+class SessionTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_server.FakeTradeKingServer(
+        num_symbols=10, ticks_per_sec=2000, chunk_secs=0.02)
+    self.server.start()
+    self.session = _Session(self.server)
+
+  def tearDown(self):
+    self.session.Close()
+    self.server.Shutdown()
+
+  def testAccounts(self):
+    self.assertEqual(fake_server.ACCOUNT_ID, self.session.AccountId())
+    holdings = self.session.AccountHoldings(self.session.AccountId())
+    self.assertTrue(holdings['accountholdings']['holding'])
+
+  def testMarketClock(self):
+    clock = self.session.MarketClock()
+    self.assertIn(clock['status']['current'], ('open', 'close'))
+
+  def testMarketQuotes(self):
+    quotes = self.session.MarketQuotes(symbols='SYM0001,SYM0002')
+    self.assertEqual(['SYM0001', 'SYM0002'],
+                     [q['symbol'] for q in quotes['quotes']['quote']])
+
+  def testMarketBars(self):
+    bars = self.session.MarketBars(
+        ['SYM0001'], datetime.date(2016, 3, 1), datetime.date(2016, 3, 2))
+    self.assertTrue(len(bars['SYM0001']['last']))
+
+  def testConcurrentMarketBarsShareOneFetcher(self):
+    created = []
+    original = timesales.TimesalesFetcher
+
+    class SlowFetcher(original):
+      def __init__(self, session):
+        created.append(self)
+        time.sleep(0.05)
+        original.__init__(self, session)
+
+    timesales.TimesalesFetcher = SlowFetcher
+    try:
+      threads = [
+          threading.Thread(target=self.session.MarketBars, args=(
+              ['SYM0001'], datetime.date(2016, 3, 1),
+              datetime.date(2016, 3, 1)))
+          for _ in xrange(4)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join(5)
+    finally:
+      timesales.TimesalesFetcher = original
+    self.assertEqual(1, len(created))
+
+  def testStreamQuotes(self):
+    symbols = self.server.symbols[:3]
+    response = self.session.OpenQuoteStream(symbols)
+    try:
+      received = []
+      for record in tradeking.stream.ParseStream(
+          response.iter_content(chunk_size=None)):
+        received.append(record)
+        if len(received) == 50:
+          break
+    finally:
+      response.close()
+    self.assertEqual(50, len(received))
+    for record in received:
+      self.assertTrue(isinstance(record, (records.Quote, records.Trade)))
+      self.assertIn(record.symbol, symbols)
+
+  def testServerErrorsRaise(self):
+    failing = fake_server.FakeTradeKingServer(error_rate=1.0,
+                                              error_codes=(503,))
+    failing.start()
+    try:
+      session = _Session(failing)
+      self.assertRaises(requests.HTTPError, session.Status)
+      session.Close()
+    finally:
+      failing.Shutdown()
+
+  def testOneAdapterWhenHostsMatch(self):
+    self.assertEqual([self.server.url], self.session._adapters.keys())
+    adapter = self.session._adapters[self.server.url]
+    self.assertTrue(self.session.session.get_adapter(self.server.url)
+                    is adapter)
+    self.assertEqual(sum(tradeking.CONNECTION_POOL_SIZES.values()),
+                     adapter._pool_size)
+
+  def testCloseUnregistersMetrics(self):
+    def Callbacks():
+      return sorted(key for key, _ in event_collection.CALLBACKS)
+
+    before = Callbacks()
+    session = _Session(self.server)
+    session.MarketBars(
+        ['SYM0001'], datetime.date(2016, 3, 1), datetime.date(2016, 3, 1))
+    self.assertGreater(len(Callbacks()), len(before))
+    session.Close()
+    self.assertEqual(before, Callbacks())
+
+
+if __name__ == '__main__':
+  FLAGS(sys.argv[:1])
+  unittest.main()
@@ -0,0 +1,128 @@
+import threading
+import time
+import urlparse
+
+import requests.adapters
+from requests.packages.urllib3 import connection
+from requests.packages.urllib3 import connectionpool
+
+from projects.lib.telemetry import event_collection
+from projects.lib.telemetry import histogram
+
+
+# Time spent establishing connections on the current thread since the last
+# call to TakeConnectSeconds(). Connections are made inside
+# requests.Session.send(), so this is how a caller attributes connect time to
+# the request that caused it.
+_connect_times = threading.local()
+
+
+def TakeConnectSeconds():
+  """Returns and resets connect time accumulated on the calling thread."""
+  seconds = getattr(_connect_times, 'seconds', 0.0)
+  _connect_times.seconds = 0.0
+  return seconds
+
+
+def _RecordConnect(seconds):
+  _connect_times.seconds = getattr(_connect_times, 'seconds', 0.0) + seconds
+  event_collection.Increment('http-connections-opened')
+
+
+class _TimedHTTPConnection(connection.HTTPConnection):
+  def connect(self):
+    start = time.time()
+    connection.HTTPConnection.connect(self)
+    _RecordConnect(time.time() - start)
+
+
+class _TimedHTTPSConnection(connection.HTTPSConnection):
+  def connect(self):
+    start = time.time()
+    connection.HTTPSConnection.connect(self)
+    _RecordConnect(time.time() - start)
+
+
+class _TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+  ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+  ConnectionCls = _TimedHTTPSConnection
+
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+  """HTTPAdapter with a keep-alive pool of `pool_size` connections per host.
+
+  New connections record how long they took to establish; see
+  TakeConnectSeconds().
+  """
+
+  def __init__(self, pool_size):
+    self._pool_size = pool_size
+    super(PooledAdapter, self).__init__(
+        pool_connections=1, pool_maxsize=pool_size)
+
+  def init_poolmanager(self, *args, **kwargs):
+    super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+    self.poolmanager.pool_classes_by_scheme = {
+        'http': _TimedHTTPConnectionPool,
+        'https': _TimedHTTPSConnectionPool,
+    }
+
+  def Prewarm(self, url, num_connections=None):
+    """Opens connections to url's host and parks them in the pool.
+
+    Returns the number of connections opened. urllib3 has no public API for
+    this, so it checks connections out of the pool, connects them and checks
+    them back in.
+    """
+    if num_connections is None:
+      num_connections = self._pool_size
+
+    parsed = urlparse.urlparse(url)
+    pool = self.poolmanager.connection_from_host(
+        parsed.hostname, parsed.port, parsed.scheme)
+
+    conns = [pool._get_conn() for _ in xrange(num_connections)]
+    opened = 0
+    try:
+      for conn in conns:
+        conn.connect()
+        opened += 1
+    finally:
+      for conn in conns:
+        pool._put_conn(conn)
+    TakeConnectSeconds()
+    return opened
+
+
+class RequestLatency(object):
+  """Latency histograms for one kind of request, exported as <prefix>-*.
+
+  Time to first byte excludes connect time, and connect time is only
+  recorded for requests that had to open a connection, so comparing the
+  connect-ms count with the total-ms count shows how often connections churn.
+  """
+
+  def __init__(self, prefix):
+    self._prefix = prefix
+    self.connect_ms = histogram.Histogram('%s-connect-ms' % (prefix,))
+    self.ttfb_ms = histogram.Histogram('%s-ttfb-ms' % (prefix,))
+    self.transfer_ms = histogram.Histogram('%s-transfer-ms' % (prefix,))
+    self.total_ms = histogram.Histogram('%s-total-ms' % (prefix,))
+
+  def Record(self, connect_secs, ttfb_secs, transfer_secs):
+    if connect_secs:
+      self.connect_ms.Add(connect_secs * 1000)
+    self.ttfb_ms.Add(ttfb_secs * 1000)
+    self.transfer_ms.Add(transfer_secs * 1000)
+    self.total_ms.Add((connect_secs + ttfb_secs + transfer_secs) * 1000)
+
+  def Unregister(self):
+    for h in (self.connect_ms, self.ttfb_ms, self.transfer_ms, self.total_ms):
+      h.Unregister()
+
+  def RecordError(self, kind):
+    event_collection.Increment('%s-errors' % (self._prefix,))
+    event_collection.Increment('%s-errors-%s' % (self._prefix, kind))